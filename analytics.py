@@ -0,0 +1,112 @@
+import os
+import threading
+from db import get_db_connection
+
+ANALYTICS_REFRESH_INTERVAL = float(os.getenv('ANALYTICS_REFRESH_INTERVAL', '60'))
+# Days recomputed per refresh transaction
+ANALYTICS_REFRESH_BATCH_DAYS = int(os.getenv('ANALYTICS_REFRESH_BATCH_DAYS', '31'))
+
+# Dimensions the revenue buckets can be grouped by -> bucket column
+REVENUE_DIMENSIONS = {
+    'producer': 'producer_id',
+    'category': 'category',
+    'currency': 'currency',
+    'payment_method': 'payment_method'
+}
+
+REVENUE_PERIODS = {
+    'day': 'day',
+    'week': 'DATE_SUB(day, INTERVAL WEEKDAY(day) DAY)',
+    'month': 'DATE_SUB(day, INTERVAL DAYOFMONTH(day) - 1 DAY)'
+}
+
+
+def refresh_revenue_buckets(cursor, batch_days=ANALYTICS_REFRESH_BATCH_DAYS):
+    """Recompute the revenue buckets of up to ``batch_days`` queued days.
+
+    Dirty days are claimed with SKIP LOCKED so concurrent refreshers never
+    work on the same day, and a day queued again by an order transaction
+    that is still open stays queued for the next run. Returns the days
+    refreshed; the caller commits.
+    """
+    cursor.execute('SELECT day FROM revenue_dirty_days ORDER BY day LIMIT %s FOR UPDATE SKIP LOCKED',
+                   (batch_days,))
+    days = [row[0] for row in cursor.fetchall()]
+    if not days:
+        return []
+    placeholders = ', '.join(['%s'] * len(days))
+    cursor.execute(f'DELETE FROM revenue_daily_buckets WHERE day IN ({placeholders})', tuple(days))
+    for day in days:
+        cursor.execute('''INSERT INTO revenue_daily_buckets (day, producer_id, category, currency, payment_method,
+                                                             order_count, gross_amount, commission_amount, paid_amount)
+                          SELECT DATE(o.created_at), p.producer_id, COALESCE(p.category, ''), COALESCE(o.currency, ''),
+                                 COALESCE(o.payment_method, ''), COUNT(*), SUM(o.total_amount),
+                                 SUM(COALESCE(o.commission_amount, 0)),
+                                 SUM(CASE WHEN o.payment_status = 'completed' THEN o.total_amount ELSE 0 END)
+                          FROM orders o JOIN products p ON o.product_id = p.id
+                          WHERE o.created_at >= %s AND o.created_at < %s + INTERVAL 1 DAY
+                          GROUP BY DATE(o.created_at), p.producer_id, COALESCE(p.category, ''),
+                                   COALESCE(o.currency, ''), COALESCE(o.payment_method, '')''', (day, day))
+    cursor.execute(f'DELETE FROM revenue_dirty_days WHERE day IN ({placeholders})', tuple(days))
+    return days
+
+
+class RevenueBucketRefresher:
+    """Background thread that keeps revenue_daily_buckets up to date"""
+
+    def __init__(self, interval=ANALYTICS_REFRESH_INTERVAL, batch_days=ANALYTICS_REFRESH_BATCH_DAYS):
+        self.interval = interval
+        self.batch_days = batch_days
+        self._stopping = threading.Event()
+        self._thread = None
+        self.refreshed_days = 0
+        self.last_error = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='revenue-buckets', daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=5):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        self._stopping.clear()
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                # Drain the queue, then sleep until the next interval
+                while self.refresh_once() == self.batch_days:
+                    pass
+            except Exception as e:
+                self.last_error = str(e)
+                print(f"Revenue bucket refresh failed: {e}")
+            self._stopping.wait(self.interval)
+
+    def refresh_once(self):
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        try:
+            days = refresh_revenue_buckets(cursor, self.batch_days)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+            conn.close()
+        self.refreshed_days += len(days)
+        return len(days)
+
+
+refresher = None
+
+
+def init_analytics():
+    """Start the background revenue bucket refresher"""
+    global refresher
+    refresher = RevenueBucketRefresher()
+    refresher.start()
+    return refresher
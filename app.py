@@ -1,16 +1,30 @@
+import os
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# eventlet/gevent must patch the standard library before anything else imports socket or threading
+if os.getenv('SOCKETIO_ASYNC_MODE') == 'eventlet':
+    import eventlet
+    eventlet.monkey_patch()
+elif os.getenv('SOCKETIO_ASYNC_MODE') == 'gevent':
+    from gevent import monkey
+    monkey.patch_all()
+
 from flask import Flask, request, jsonify
 from flask_cors import CORS
-from db import get_db_connection
+from werkzeug.middleware.proxy_fix import ProxyFix
+from db import get_db_connection, init_db
 from datetime import datetime
-import os
-from dotenv import load_dotenv
 import bcrypt
 import jwt
 from functools import wraps
-from websocket_service import init_socketio, socketio
-
-# Load environment variables
-load_dotenv()
+from websocket_service import init_socketio, socketio, emit_to_room, start_presence_sweep
+from outbox import init_outbox
+from analytics import init_analytics
+from images import init_images
+from passwords import init_passwords
 
 app = Flask(__name__)
 CORS(app, resources={
@@ -22,10 +36,39 @@ CORS(app, resources={
 })
 
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'your-secret-key-here')
+FLASK_DEBUG = os.getenv('FLASK_DEBUG', '1') == '1'
+
+# Return request-bound DB connections to the pool
+init_db(app)
 
 # Initialize SocketIO
 init_socketio(app)
 
+# Reverse proxies in front of the app (1 for a single nginx); their X-Forwarded-For and
+# X-Forwarded-Proto are trusted for that many hops, so request.remote_addr is the client.
+# Leave 0 when clients connect directly, or they could spoof their address.
+TRUSTED_PROXY_HOPS = int(os.getenv('TRUSTED_PROXY_HOPS', '0'))
+if TRUSTED_PROXY_HOPS:
+    # Outermost, so Socket.IO requests see the client address too
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXY_HOPS, x_proto=TRUSTED_PROXY_HOPS)
+
+_workers_started = False
+
+def start_background_workers():
+    """Start the worker pools and background threads of a process that serves requests"""
+    global _workers_started
+    if _workers_started:
+        return
+    _workers_started = True
+    # Fork the image and password hashing workers before any background threads start
+    init_images()
+    init_passwords()
+    # Deliver queued notification pushes after their transactions commit, numbered for replay
+    init_outbox(app, emit_to_room)
+    # Keep the admin revenue buckets refreshed in the background
+    init_analytics()
+    start_presence_sweep()
+
 # Import and register routes blueprint at the end
 def register_blueprints():
     from routes import routes_bp
@@ -33,5 +76,25 @@ def register_blueprints():
 
 register_blueprints()
 
+if __name__ != '__main__':
+    # Imported by a WSGI server or a script, so this process serves the requests itself
+    start_background_workers()
+
+def run_server():
+    # The reloader's parent process only watches files and restarts the server in a child.
+    # Workers started there would claim outbox rows and emit them to a server with no clients.
+    use_reloader = FLASK_DEBUG and not _workers_started
+    if not use_reloader or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_background_workers()
+    options = {}
+    if socketio.async_mode == 'eventlet':
+        # eventlet.wsgi serves at most max_size connections at once (1024 by default)
+        options['max_size'] = int(os.getenv('SOCKETIO_MAX_CONNECTIONS', '20000'))
+    elif socketio.async_mode == 'threading':
+        # Thread-per-connection Werkzeug server, as before; use eventlet/gevent in production
+        options['allow_unsafe_werkzeug'] = True
+    socketio.run(app, debug=FLASK_DEBUG, use_reloader=use_reloader, host='0.0.0.0',
+                 port=int(os.getenv('PORT', '5000')), **options)
+
 if __name__ == '__main__':
-    socketio.run(app, debug=True, host='0.0.0.0', port=5000) 
\ No newline at end of file
+    run_server()
@@ -26,6 +26,7 @@ export default function AdminMessagesPage() {
   const [isTyping, setIsTyping] = useState(false);
   const [currentUserId, setCurrentUserId] = useState<number>(0);
   const [onlineUsersList, setOnlineUsersList] = useState<any[]>([]);
+  const [onlineUsersTotal, setOnlineUsersTotal] = useState(0);
   const messagesEndRef = useRef<HTMLDivElement>(null);
   const typingTimeoutRef = useRef<NodeJS.Timeout | null>(null);
 
@@ -59,8 +60,10 @@ export default function AdminMessagesPage() {
 
   const loadOnlineUsers = async () => {
     try {
-      const users = await apiService.getOnlineUsers();
-      setOnlineUsersList(users);
+      // First page only; the counts cover everyone online
+      const page = await apiService.getOnlineUsers();
+      setOnlineUsersList(page.users);
+      setOnlineUsersTotal(page.online_users);
     } catch (error) {
       console.error("Error loading online users:", error);
     }
@@ -153,7 +156,7 @@ export default function AdminMessagesPage() {
           <div style={{ display: "flex", alignItems: "center", gap: "0.5rem" }}>
             <FaUsers style={{ color: "#3b82f6", fontSize: "1rem" }} />
             <span style={{ fontSize: "0.875rem", color: "#6b7280" }}>
-              {onlineUsersList.length} online
+              {onlineUsersTotal} online
             </span>
           </div>
           <div style={{ display: "flex", alignItems: "center", gap: "0.5rem" }}>
@@ -561,7 +564,7 @@ export default function AdminMessagesPage() {
             background: "#f9fafb"
           }}>
             <h3 style={{ fontSize: "1rem", fontWeight: 600, color: "#1f2937" }}>
-              Online Users ({onlineUsersList.length})
+              Online Users ({onlineUsersTotal})
             </h3>
           </div>
           
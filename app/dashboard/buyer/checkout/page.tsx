@@ -199,44 +199,35 @@ function CheckoutContent() {
       const fullAddress = `${shippingAddress}, ${shippingCity}, ${shippingState} ${shippingPostalCode}, ${shippingCountry}`;
       
       if (fromCart) {
-        // Place multiple orders for cart items
-        const orderPromises = cartItems.map(async (item) => {
-          const orderData: any = {
-            product_id: item.product_id,
-            quantity: item.quantity,
-            unit_price: item.price,
-            total_amount: (item.price * item.quantity) + calculateShippingCost(),
-            shipping_address: fullAddress,
-            shipping_method: shippingMethod,
-            payment_method: paymentMethod,
-            special_instructions: specialInstructions,
-            status: 'pending',
-            payment_status: paymentResult ? 'completed' : 'pending'
-          };
-
-          if (paymentResult) {
-            orderData.payment_transaction_id = paymentResult.transactionId;
-            orderData.payment_timestamp = paymentResult.timestamp;
-          }
-
-          const res = await fetch(`${API_BASE}/orders`, {
-            method: 'POST',
-            headers: {
-              'Content-Type': 'application/json',
-              'Authorization': `Bearer ${token}`
-            },
-            body: JSON.stringify(orderData)
-          });
+        // Place every cart line in one atomic request (the server checks out the cart)
+        const orderData: any = {
+          shipping_address: fullAddress,
+          shipping_method: shippingMethod,
+          shipping_cost: calculateShippingCost(),
+          payment_method: paymentMethod,
+          special_instructions: specialInstructions,
+          status: 'pending',
+          payment_status: paymentResult ? 'completed' : 'pending'
+        };
 
-          if (!res.ok) {
-            const data = await res.json();
-            throw new Error(data.error || 'Failed to place order');
-          }
+        if (paymentResult) {
+          orderData.payment_transaction_id = paymentResult.transactionId;
+          orderData.payment_timestamp = paymentResult.timestamp;
+        }
 
-          return res.json();
+        const res = await fetch(`${API_BASE}/orders/batch`, {
+          method: 'POST',
+          headers: {
+            'Content-Type': 'application/json',
+            'Authorization': `Bearer ${token}`
+          },
+          body: JSON.stringify(orderData)
         });
 
-        await Promise.all(orderPromises);
+        if (!res.ok) {
+          const data = await res.json();
+          throw new Error(data.error || 'Failed to place order');
+        }
       } else if (product) {
         // Place single order
         const orderData: any = {
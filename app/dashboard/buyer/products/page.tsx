@@ -32,10 +32,21 @@ function Spinner() {
   );
 }
 
+// Cards and list rows use the server-built WebP variants instead of the full-size original
+const productImage = (product: any, variant: 'card' | 'thumb') => {
+  const url = product.image_variants?.[variant] || product.images?.[0] || product.main_image_url;
+  return `http://localhost:5000${url}`;
+};
+
+// Products fetched per page; more are loaded with the next_cursor from GET /products
+const PRODUCTS_PAGE_SIZE = 48;
+
 export default function BuyerProductsPage() {
   const [products, setProducts] = useState<any[]>([]);
   const [filteredProducts, setFilteredProducts] = useState<any[]>([]);
   const [loading, setLoading] = useState(true);
+  const [loadingMore, setLoadingMore] = useState(false);
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
   const [error, setError] = useState("");
   const [search, setSearch] = useState("");
   const [selectedCategory, setSelectedCategory] = useState("All");
@@ -175,37 +186,36 @@ export default function BuyerProductsPage() {
     }
   };
 
-  const fetchProducts = async () => {
+  const fetchProducts = async (cursor?: string) => {
     try {
-      setLoading(true);
-      const data = await apiService.getProducts();
-      console.log('Fetched products:', data); // Debug log
-      
-      // Debug: Log image information for each product
-      data.forEach((product: any, index: number) => {
-        console.log(`Product ${index + 1} (${product.name}):`, {
-          id: product.id,
-          main_image_url: product.main_image_url,
-          images: product.images,
-          hasImages: product.images && product.images.length > 0,
-          firstImage: product.images?.[0]
-        });
-      });
-      
+      if (cursor) setLoadingMore(true);
+      else setLoading(true);
+      const params: any = { limit: PRODUCTS_PAGE_SIZE };
+      if (cursor) params.cursor = cursor;
+      const response = await apiService.getProducts(params);
+      const page = Array.isArray(response?.products) ? response.products : [];
+      console.log('Fetched products:', page.length); // Debug log
+
+      const data = cursor ? [...products, ...page] : page;
       setProducts(data);
-      setFilteredProducts(data);
+      setNextCursor(response?.next_cursor || null);
+      if (!cursor) setFilteredProducts(data);
       
       // Calculate max price for price range
       if (data && data.length > 0) {
         const maxProductPrice = Math.max(...data.map((p: any) => p.price || 0));
+        // Later pages widen the range too, unless the buyer has narrowed it
+        if (!cursor || priceRange[1] >= maxPrice) {
+          setPriceRange([cursor ? priceRange[0] : 0, maxProductPrice]);
+        }
         setMaxPrice(maxProductPrice);
-        setPriceRange([0, maxProductPrice]);
       }
     } catch (err: any) {
       console.error('Error fetching products:', err); // Debug log
       setError(err.message || 'Failed to load products');
     } finally {
       setLoading(false);
+      setLoadingMore(false);
     }
   };
 
@@ -815,7 +825,7 @@ export default function BuyerProductsPage() {
                     }}>
                       {(product.images && product.images[0]) || product.main_image_url ? (
                         <img
-                          src={`http://localhost:5000${product.images?.[0] || product.main_image_url}`}
+                          src={productImage(product, 'thumb')}
                           alt={product.name}
                           style={{ width: '100%', height: '100%', objectFit: 'cover' }}
                         />
@@ -1159,12 +1169,15 @@ export default function BuyerProductsPage() {
             <div style={{ height: '200px', background: '#f3f4f6', position: 'relative', overflow: 'hidden' }}>
               {(product.images && product.images[0]) || product.main_image_url ? (
                 <img
-                  src={`http://localhost:5000${product.images?.[0] || product.main_image_url}`}
+                  src={productImage(product, 'card')}
                   alt={product.name}
                   style={{ width: '100%', height: '100%', objectFit: 'cover' }}
                   onError={(e) => {
-                    // Fallback to main_image_url if images[0] fails
-                    if (product.images?.[0] && product.main_image_url && product.images[0] !== product.main_image_url) {
+                    // Fall back to the original upload, then to main_image_url
+                    const original = `http://localhost:5000${product.images?.[0] || product.main_image_url}`;
+                    if (e.currentTarget.src !== original) {
+                      e.currentTarget.src = original;
+                    } else if (product.images?.[0] && product.main_image_url && product.images[0] !== product.main_image_url) {
                       e.currentTarget.src = `http://localhost:5000${product.main_image_url}`;
                     } else {
                       e.currentTarget.style.display = 'none';
@@ -1425,7 +1438,7 @@ export default function BuyerProductsPage() {
                 }}>
                   {(product.images && product.images[0]) || product.main_image_url ? (
                     <img
-                      src={`http://localhost:5000${product.images?.[0] || product.main_image_url}`}
+                      src={productImage(product, 'thumb')}
                       alt={product.name}
                       style={{ width: '100%', height: '100%', objectFit: 'cover' }}
                     />
@@ -1526,6 +1539,28 @@ export default function BuyerProductsPage() {
       </div>
         )}
 
+        {/* Load More */}
+        {nextCursor && (
+          <div style={{ display: 'flex', justifyContent: 'center', marginTop: '32px' }}>
+            <button
+              onClick={() => fetchProducts(nextCursor)}
+              disabled={loadingMore}
+              style={{
+                background: loadingMore ? '#9ca3af' : '#0070f3',
+                color: 'white',
+                border: 'none',
+                padding: '12px 24px',
+                borderRadius: '8px',
+                fontSize: '16px',
+                fontWeight: 600,
+                cursor: loadingMore ? 'not-allowed' : 'pointer'
+              }}
+            >
+              {loadingMore ? 'Loading...' : 'Load More Products'}
+            </button>
+          </div>
+        )}
+
         {/* Empty State */}
       {filteredProducts.length === 0 && (
           <div style={{ 
@@ -1620,7 +1655,7 @@ export default function BuyerProductsPage() {
               }}>
                 {(quickViewProduct.images && quickViewProduct.images[0]) || quickViewProduct.main_image_url ? (
                   <img
-                    src={`http://localhost:5000${quickViewProduct.images?.[0] || quickViewProduct.main_image_url}`}
+                    src={productImage(quickViewProduct, 'card')}
                     alt={quickViewProduct.name}
                     style={{ width: '100%', height: '100%', objectFit: 'cover' }}
                   />
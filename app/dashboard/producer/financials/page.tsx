@@ -6,7 +6,9 @@ import { FaDollarSign, FaChartLine, FaCalendar, FaDownload, FaFilter, FaSearch }
 export default function ProducerFinancialsPage() {
   const [financialData, setFinancialData] = useState<any>({});
   const [transactions, setTransactions] = useState<any[]>([]);
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
   const [loading, setLoading] = useState(true);
+  const [loadingMore, setLoadingMore] = useState(false);
   const [dateFilter, setDateFilter] = useState("30d");
   const [searchTerm, setSearchTerm] = useState("");
 
@@ -20,6 +22,7 @@ export default function ProducerFinancialsPage() {
       
       setFinancialData(financialData.summary);
       setTransactions(financialData.transactions);
+      setNextCursor(financialData.nextCursor || null);
     } catch (error) {
       console.error("Error loading financial data:", error);
     } finally {
@@ -27,6 +30,21 @@ export default function ProducerFinancialsPage() {
     }
   };
 
+  // Transactions come a page at a time; the summary already covers every order
+  const loadMoreTransactions = async () => {
+    if (!nextCursor) return;
+    try {
+      setLoadingMore(true);
+      const page = await apiService.getProducerFinancials({ cursor: nextCursor });
+      setTransactions(prev => [...prev, ...page.transactions]);
+      setNextCursor(page.nextCursor || null);
+    } catch (error) {
+      console.error("Error loading more transactions:", error);
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   const filteredTransactions = transactions.filter(transaction => {
     const buyerName = transaction.buyer_company || `${transaction.buyer_first_name} ${transaction.buyer_last_name}` || transaction.buyer_username;
     const matchesSearch = transaction.id.toString().includes(searchTerm) ||
@@ -242,7 +260,7 @@ export default function ProducerFinancialsPage() {
               <div>
                 <div style={{ fontSize: "0.875rem", color: "#6b7280" }}>Completed Orders</div>
                 <div style={{ fontSize: "1.125rem", fontWeight: 600, color: "#1f2937" }}>
-                  {transactions.filter(t => t.status === 'completed').length}
+                  {Number(financialData.completedOrders || 0)}
                 </div>
               </div>
               <div style={{ 
@@ -253,7 +271,7 @@ export default function ProducerFinancialsPage() {
                 fontSize: "0.75rem",
                 fontWeight: 500
               }}>
-                {((transactions.filter(t => t.status === 'completed').length / transactions.length) * 100).toFixed(0)}%
+                {financialData.totalOrders ? ((Number(financialData.completedOrders || 0) / financialData.totalOrders) * 100).toFixed(0) : 0}%
               </div>
             </div>
 
@@ -268,7 +286,7 @@ export default function ProducerFinancialsPage() {
               <div>
                 <div style={{ fontSize: "0.875rem", color: "#6b7280" }}>Pending Revenue</div>
                 <div style={{ fontSize: "1.125rem", fontWeight: 600, color: "#1f2937" }}>
-                  ₦{transactions.filter(t => t.status === 'pending').reduce((sum, t) => sum + Number(t.total_amount || 0), 0).toFixed(2)}
+                  ₦{Number(financialData.pendingRevenue || 0).toFixed(2)}
                 </div>
               </div>
               <div style={{ 
@@ -279,7 +297,7 @@ export default function ProducerFinancialsPage() {
                 fontSize: "0.75rem",
                 fontWeight: 500
               }}>
-                {transactions.filter(t => t.status === 'pending').length} orders
+                {Number(financialData.pendingOrders || 0)} orders
               </div>
             </div>
 
@@ -428,6 +446,25 @@ export default function ProducerFinancialsPage() {
                 </div>
               </div>
             ))}
+            {nextCursor && (
+              <div style={{ padding: "1rem 1.5rem", textAlign: "center" }}>
+                <button
+                  onClick={loadMoreTransactions}
+                  disabled={loadingMore}
+                  style={{
+                    padding: "0.75rem 1.5rem",
+                    background: loadingMore ? "#9ca3af" : "#10b981",
+                    color: "#fff",
+                    border: "none",
+                    borderRadius: 6,
+                    fontWeight: 500,
+                    cursor: loadingMore ? "not-allowed" : "pointer"
+                  }}
+                >
+                  {loadingMore ? "Loading..." : "Load More Transactions"}
+                </button>
+              </div>
+            )}
           </div>
         ) : (
           <div style={{ 
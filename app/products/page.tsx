@@ -3,6 +3,13 @@ import { useState, useEffect } from "react";
 import Link from "next/link";
 import { apiService, Product } from "@/services/api";
 
+// Grid cards use the server-built card variant instead of the full-size original
+const cardImage = (product: Product & { image_variants?: { card?: string } }) => {
+  const card = product.image_variants?.card;
+  if (card) return `http://localhost:5000${card}`;
+  return product.main_image_url || product.images[0] || '/placeholder-product.jpg';
+};
+
 export default function ProductsPage() {
   const [products, setProducts] = useState<Product[]>([]);
   const [loading, setLoading] = useState(true);
@@ -194,7 +201,7 @@ export default function ProductsPage() {
                 <Link href={`/products/${product.id}`} style={{ textDecoration: 'none', color: 'inherit', flex: 1 }}>
                   <div style={{ position: 'relative', width: '100%', height: 200, background: '#f3f4f6' }}>
                     <img 
-                      src={product.main_image_url || product.images[0] || '/placeholder-product.jpg'} 
+                      src={cardImage(product)} 
                       alt={product.name}
                       style={{ 
                         width: '100%', 
@@ -0,0 +1,105 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from db import get_db_connection
+
+AUTH_CACHE_TTL = float(os.getenv('AUTH_CACHE_TTL', '60'))
+AUTH_CACHE_SIZE = int(os.getenv('AUTH_CACHE_SIZE', '10000'))
+
+# Only what the auth layer and socket handlers need - never password or bank data
+PRINCIPAL_COLUMNS = 'id, username, user_type, first_name, last_name, company_name, is_active'
+
+
+class PrincipalCache:
+    """Thread-safe LRU cache of authenticated principals with a TTL"""
+
+    def __init__(self, ttl=AUTH_CACHE_TTL, max_size=AUTH_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()  # user_id -> (principal, expires_at)
+        self._lock = threading.Lock()
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def generation(self):
+        return self._generation
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                self.misses += 1
+                return None
+            principal, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[user_id]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return dict(principal)
+
+    def put(self, user_id, principal, generation=None):
+        """Cache a principal unless an invalidation happened since ``generation``"""
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return
+            self._entries[user_id] = (dict(principal), time.monotonic() + self.ttl)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+            self._generation += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._generation += 1
+
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._entries), 'max_size': self.max_size, 'ttl': self.ttl,
+                    'hits': self.hits, 'misses': self.misses}
+
+
+principal_cache = PrincipalCache()
+
+
+def _key(user_id):
+    # JWT payloads carry ints, request bodies may carry strings
+    try:
+        return int(user_id)
+    except (TypeError, ValueError):
+        return user_id
+
+
+def get_principal(user_id):
+    """Return the cached principal for ``user_id``, loading it on a miss.
+
+    Returns None if the user does not exist (misses are not cached).
+    """
+    user_id = _key(user_id)
+    principal = principal_cache.get(user_id)
+    if principal is not None:
+        return principal
+    generation = principal_cache.generation
+    conn = get_db_connection()
+    cursor = conn.cursor(dictionary=True, buffered=True)
+    cursor.execute(f'SELECT {PRINCIPAL_COLUMNS} FROM users WHERE id = %s', (user_id,))
+    principal = cursor.fetchone()
+    cursor.close()
+    conn.close()
+    if principal:
+        principal_cache.put(user_id, principal, generation)
+    return principal
+
+
+def invalidate_principal(user_id):
+    """Drop a user's cached principal after their account row changes"""
+    principal_cache.invalidate(_key(user_id))
@@ -0,0 +1,152 @@
+"""Connection-scaling benchmark for the Socket.IO server.
+
+Opens ``--idle`` sockets that only stay connected and ``--active`` sockets
+that join a conversation in pairs and send acknowledged events at ``--rate``
+per second, then reports connect success, event throughput and ack latency.
+With ``--server-pid`` the server's RSS and OS thread count are sampled too,
+which shows the thread-per-connection cost of ``SOCKETIO_ASYNC_MODE=threading``.
+
+    SOCKETIO_ASYNC_MODE=eventlet SOCKETIO_LOGGING=0 FLASK_DEBUG=0 python app.py &
+    python bench_socketio_connections.py --idle 10000 --active 1000 --server-pid $!
+
+Needs the asyncio client (pip install "python-socketio[asyncio_client]") and
+existing users to sign tokens for (--user-ids). Run the client on another box
+(or raise `ulimit -n` on both sides) for 10k+ sockets. Exits non-zero if any
+socket fails to connect or the p99 ack latency exceeds --max-p99-ms.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import resource
+import sys
+import time
+import jwt
+import socketio
+from dotenv import load_dotenv
+
+load_dotenv()
+# Sockets closed by the server would otherwise log one line each
+logging.getLogger('engineio.client').setLevel(logging.CRITICAL)
+
+
+def raise_fd_limit():
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    return resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+
+
+def server_usage(pid):
+    """(RSS in MiB, OS threads) of the server process from /proc"""
+    if not pid:
+        return None
+    usage = {}
+    with open(f'/proc/{pid}/status') as f:
+        for line in f:
+            key, _, value = line.partition(':')
+            usage[key] = value.strip()
+    return int(usage['VmRSS'].split()[0]) / 1024, int(usage['Threads'])
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', default='http://localhost:5000')
+    parser.add_argument('--idle', type=int, default=10000, help='sockets that only stay connected')
+    parser.add_argument('--active', type=int, default=1000, help='sockets sending events')
+    parser.add_argument('--rate', type=float, default=1.0, help='events per second per active socket')
+    parser.add_argument('--duration', type=float, default=30.0, help='seconds of active traffic')
+    parser.add_argument('--event', choices=('typing', 'mark_read'), default='typing',
+                        help='typing fans out only; mark_read also writes to MySQL')
+    parser.add_argument('--inquiry-base', type=int, default=1, help='first inquiry id used for the pairs')
+    parser.add_argument('--user-ids', default='1', help='comma separated users to sign tokens for')
+    parser.add_argument('--connect-concurrency', type=int, default=200)
+    parser.add_argument('--polling', action='store_true', help='use the long-polling transport')
+    parser.add_argument('--server-pid', type=int, default=None)
+    parser.add_argument('--max-p99-ms', type=float, default=0, help='fail if p99 ack latency is above this')
+    args = parser.parse_args()
+
+    fd_limit = raise_fd_limit()
+    if args.idle + args.active + 100 > fd_limit:
+        print(f'Open file limit {fd_limit} is too low for {args.idle + args.active} sockets')
+        return 2
+
+    secret = os.getenv('SECRET_KEY', 'your-secret-key-here')
+    user_ids = [int(uid) for uid in args.user_ids.split(',')]
+    tokens = [jwt.encode({'user_id': uid}, secret, algorithm='HS256') for uid in user_ids]
+    transports = ['polling'] if args.polling else ['websocket']
+    gate = asyncio.Semaphore(args.connect_concurrency)
+    connect_times, failures = [], []
+    latencies = []
+    timeouts = 0
+
+    async def connect(index):
+        client = socketio.AsyncClient(reconnection=False)
+        async with gate:
+            started = time.perf_counter()
+            try:
+                await client.connect(args.url, auth={'token': tokens[index % len(tokens)]},
+                                     transports=transports, wait_timeout=30)
+            except Exception as e:
+                failures.append(str(e))
+                return None
+            connect_times.append(time.perf_counter() - started)
+        return client
+
+    async def drive(client, index, deadline):
+        nonlocal timeouts
+        inquiry_id = args.inquiry_base + index // 2
+        await client.emit('join_conversation', {'conversation_id': inquiry_id})
+        payload = {'inquiry_id': inquiry_id, 'is_typing': True}
+        interval = 1.0 / args.rate
+        # Spread the first sends over one interval so the load is steady
+        await asyncio.sleep(interval * (index % 100) / 100)
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                await client.call(args.event, payload, timeout=10)
+                latencies.append(time.perf_counter() - started)
+            except socketio.exceptions.TimeoutError:
+                timeouts += 1
+            await asyncio.sleep(max(0.0, interval - (time.perf_counter() - started)))
+
+    before = server_usage(args.server_pid)
+    started = time.perf_counter()
+    clients = await asyncio.gather(*(connect(i) for i in range(args.idle + args.active)))
+    connect_seconds = time.perf_counter() - started
+    idle = [c for c in clients[:args.idle] if c is not None]
+    active = [c for c in clients[args.idle:] if c is not None]
+    connected = server_usage(args.server_pid)
+    print(f'Connected {len(idle)}/{args.idle} idle and {len(active)}/{args.active} active sockets '
+          f'in {connect_seconds:.1f}s (connect p50 {percentile(connect_times, 0.5) * 1000:.0f}ms, '
+          f'p99 {percentile(connect_times, 0.99) * 1000:.0f}ms, {len(failures)} failed)')
+    if failures:
+        print(f'First failure: {failures[0]}')
+
+    deadline = time.perf_counter() + args.duration
+    await asyncio.gather(*(drive(client, i, deadline) for i, client in enumerate(active)))
+    loaded = server_usage(args.server_pid)
+
+    p99 = percentile(latencies, 0.99) * 1000
+    print(f'{len(latencies)} {args.event} events in {args.duration:.0f}s ({len(latencies) / args.duration:.0f}/s), '
+          f'{timeouts} timed out; ack p50 {percentile(latencies, 0.5) * 1000:.1f}ms, '
+          f'p95 {percentile(latencies, 0.95) * 1000:.1f}ms, p99 {p99:.1f}ms')
+    for label, usage in (('before', before), ('connected', connected), ('under load', loaded)):
+        if usage:
+            print(f'Server {label}: {usage[0]:.0f} MiB RSS, {usage[1]} OS threads')
+
+    await asyncio.gather(*(client.disconnect() for client in idle + active), return_exceptions=True)
+    if failures or timeouts or (args.max_p99_ms and p99 > args.max_p99_ms):
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(asyncio.run(main()))
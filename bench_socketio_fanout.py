@@ -0,0 +1,160 @@
+"""Bytes, sends and encodes per new_message / notification emit, legacy vs fan_out.
+
+Registers simulated sockets with the real Socket.IO manager (no network or
+database): per conversation a buyer on --buyer-devices devices and a producer,
+both viewing the conversation, plus --admins admins watching every one. The
+Engine.IO send calls are counted instead of written to sockets.
+
+    python bench_socketio_fanout.py --conversations 200 --admins 3 --messages 5000
+
+"legacy" replays the four room emits handle_send_message used to make
+(conversation, buyer, producer, admin); "fan_out" is the current path.
+"""
+import argparse
+import os
+import time
+from datetime import datetime
+
+# Measure the in-process path without per-packet logging
+os.environ['SOCKETIO_LOGGING'] = '0'
+os.environ['SOCKETIO_MESSAGE_QUEUE'] = ''
+
+from flask import Flask
+import websocket_service
+from event_log import event_log
+from websocket_service import fan_out, socketio
+
+
+class Counter:
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.sends = 0
+        self.bytes = 0
+        self.encodes = 0
+        self.sockets = set()
+
+
+def instrument(server, counter):
+    """Count Engine.IO frames and Socket.IO packet encodes instead of sending"""
+    def send(eio_sid, data):
+        counter.sends += 1
+        counter.bytes += 1 + len(data.encode('utf-8'))
+        counter.sockets.add(eio_sid)
+
+    def send_packet(eio_sid, pkt):
+        counter.sends += 1
+        counter.bytes += len(pkt.encode().encode('utf-8'))
+        counter.sockets.add(eio_sid)
+
+    server.eio.send = send
+    server.eio.send_packet = send_packet
+    encode = server.packet_class.encode
+
+    def counted_encode(self, *args, **kwargs):
+        counter.encodes += 1
+        return encode(self, *args, **kwargs)
+
+    server.packet_class.encode = counted_encode
+
+
+def connect(manager, eio_sid, rooms):
+    sid = manager.connect(eio_sid, '/')
+    for room in rooms:
+        manager.enter_room(sid, '/', room)
+
+
+def message(index, buyer_id, producer_id):
+    return {
+        'id': index, 'inquiry_id': index, 'sender_id': buyer_id, 'sender_name': 'Jane Buyer',
+        'sender_username': 'jane', 'sender_type': 'buyer', 'message': 'Is the 20kg lot still available? ' * 6,
+        'is_read': False, 'created_at': datetime.utcnow().isoformat(), 'product_name': 'Arabica green beans',
+        'buyer_name': 'Jane Buyer', 'producer_name': 'Finca Example'
+    }
+
+
+def legacy_new_message(data, inquiry_id, buyer_id, producer_id):
+    socketio.emit('new_message', data, room=f"conversation_{inquiry_id}")
+    socketio.emit('new_message', data, room=f"user_{buyer_id}")
+    socketio.emit('new_message', data, room=f"user_{producer_id}")
+    socketio.emit('new_message', data, room='admin')
+
+
+def fan_out_new_message(data, inquiry_id, buyer_id, producer_id):
+    fan_out('new_message', data, [f"conversation_{inquiry_id}", f"user_{buyer_id}", f"user_{producer_id}", 'admin'])
+
+
+def measure(label, counter, messages, send):
+    counter.reset()
+    deliveries = 0
+    started = time.perf_counter()
+    for index in range(messages):
+        before = counter.sends
+        send(index)
+        deliveries += counter.sends - before
+    elapsed = time.perf_counter() - started
+    print(f'{label:<34} {counter.sends / messages:6.2f} sends  {counter.bytes / messages:8.0f} bytes  '
+          f'{counter.encodes / messages:6.2f} encodes  {elapsed / messages * 1e6:7.1f} us  per message')
+    return counter.sends / messages
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--conversations', type=int, default=200)
+    parser.add_argument('--buyer-devices', type=int, default=2)
+    parser.add_argument('--admins', type=int, default=3)
+    parser.add_argument('--messages', type=int, default=5000)
+    args = parser.parse_args()
+
+    websocket_service.init_socketio(Flask(__name__))
+    server = socketio.server
+    counter = Counter()
+    instrument(server, counter)
+    manager = server.manager
+    manager.initialize()
+
+    admin_ids = [900000 + i for i in range(args.admins)]
+    conversations = []
+    for i in range(args.conversations):
+        buyer_id, producer_id = 1000 + i, 500000 + i
+        conversations.append((i, buyer_id, producer_id))
+        for device in range(args.buyer_devices):
+            connect(manager, f'b{i}-{device}', [f'user_{buyer_id}', 'role_buyer', f'conversation_{i}'])
+        connect(manager, f'p{i}', [f'user_{producer_id}', 'role_producer', f'conversation_{i}'])
+        event_log.track(buyer_id, 'buyer')
+        event_log.track(producer_id, 'producer')
+    for admin_id in admin_ids:
+        rooms = [f'user_{admin_id}', 'role_admin', 'admin'] + [f'conversation_{i}' for i in range(args.conversations)]
+        connect(manager, f'a{admin_id}', rooms)
+        event_log.track(admin_id, 'admin')
+
+    unique = args.buyer_devices + 1 + args.admins
+    print(f'{args.conversations} conversations, {unique} sockets per conversation '
+          f'({args.buyer_devices} buyer devices, 1 producer, {args.admins} admins)\n')
+
+    def pick(index):
+        conversation_id, buyer_id, producer_id = conversations[index % len(conversations)]
+        return message(index, buyer_id, producer_id), conversation_id, buyer_id, producer_id
+
+    legacy = measure('new_message legacy (4 room emits)', counter, args.messages,
+                     lambda index: legacy_new_message(*pick(index)))
+    after = measure('new_message fan_out', counter, args.messages,
+                    lambda index: fan_out_new_message(*pick(index)))
+    print(f'  sockets reached per message: {unique}; legacy sent {legacy - unique:.2f} duplicates, '
+          f'fan_out {after - unique:.2f}\n')
+
+    notification = {'type': 'order', 'title': 'New order', 'message': 'Order #1234 was placed', 'related_id': 1234}
+    measure('notification to user legacy', counter, args.messages,
+            lambda index: socketio.emit('notification', notification, room=f"user_{pick(index)[2]}"))
+    measure('notification to user fan_out', counter, args.messages,
+            lambda index: websocket_service.send_notification_to_user(pick(index)[2], notification))
+    role_messages = max(1, args.messages // args.conversations)
+    measure('notification to role legacy', counter, role_messages,
+            lambda index: socketio.emit('notification', notification, room='role_buyer'))
+    measure('notification to role fan_out', counter, role_messages,
+            lambda index: websocket_service.send_notification_to_role('buyer', notification))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,199 @@
+"""Cross-process Socket.IO delivery check through the message queue.
+
+Starts the local broker (unless --message-queue points at one), runs
+--workers copies of the app on consecutive ports and connects --clients
+sockets spread across them. Two paths are measured:
+
+* notification: a write-only emitter in this process (standing in for an
+  HTTP worker) sends ``notification`` events to ``user_<id>`` rooms, which
+  must reach that user's sockets on every worker;
+* typing: a socket on one worker sends ``typing`` and every other socket in
+  the conversation, on all workers, must get ``user_typing``.
+
+    python bench_socketio_queue.py --workers 4 --clients 200 --user-ids 1,2,3
+
+The workers authenticate sockets like production, so the --user-ids must
+exist in the configured database. Exits non-zero if any delivery is missing
+or the p99 latency exceeds --max-p99-ms.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import shlex
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import jwt
+import socketio
+from dotenv import load_dotenv
+from flask_socketio import SocketIO
+from socketio_queue import SOCKETIO_CHANNEL, queue_options
+
+load_dotenv()
+logging.getLogger('engineio.client').setLevel(logging.CRITICAL)
+
+
+def queue_emitter(url):
+    """Write-only SocketIO that emits through the queue, like a process without sockets"""
+    emitter = SocketIO()
+    emitter.init_app(None, async_mode='threading', **queue_options(url, SOCKETIO_CHANNEL, write_only=True))
+    return emitter
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def start(command, env):
+    # Own process group so the workers' pool processes are stopped with them
+    return subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                            start_new_session=True)
+
+
+def stop(processes):
+    for process in processes:
+        try:
+            os.killpg(process.pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+    for process in processes:
+        try:
+            process.wait(10)
+        except subprocess.TimeoutExpired:
+            os.killpg(process.pid, signal.SIGKILL)
+
+
+def wait_for(check, timeout, what):
+    deadline = time.monotonic() + timeout
+    while not check():
+        if time.monotonic() > deadline:
+            raise RuntimeError(f'Timed out waiting for {what}')
+        time.sleep(0.2)
+
+
+def port_open(port):
+    try:
+        socket.create_connection(('127.0.0.1', port), 0.5).close()
+        return True
+    except OSError:
+        return False
+
+
+def report(label, latencies, delivered, expected):
+    print(f'{label}: {delivered}/{expected} delivered; latency p50 {percentile(latencies, 0.5) * 1000:.1f}ms, '
+          f'p95 {percentile(latencies, 0.95) * 1000:.1f}ms, p99 {percentile(latencies, 0.99) * 1000:.1f}ms')
+
+
+async def run(args, url, ports):
+    secret = os.getenv('SECRET_KEY', 'your-secret-key-here')
+    user_ids = [int(uid) for uid in args.user_ids.split(',')]
+    clients, client_users = [None] * args.clients, [None] * args.clients
+    notifications = {}  # seq -> [latencies]
+    typing = []  # (arrival time, client index)
+
+    async def connect(index):
+        user_id = user_ids[index % len(user_ids)]
+        client = socketio.AsyncClient(reconnection=False)
+
+        @client.on('notification')
+        def on_notification(data):
+            if data.get('type') == 'queue_bench':
+                notifications.setdefault(data['seq'], []).append(time.time() - data['sent_at'])
+
+        @client.on('user_typing')
+        def on_typing(data):
+            typing.append((time.perf_counter(), index))
+
+        token = jwt.encode({'user_id': user_id}, secret, algorithm='HS256')
+        await client.connect(f'http://127.0.0.1:{ports[index % len(ports)]}', auth={'token': token},
+                             transports=['websocket'], wait_timeout=30)
+        await client.emit('join_conversation', {'conversation_id': args.conversation_id})
+        clients[index] = client
+        client_users[index] = user_id
+
+    await asyncio.gather(*(connect(i) for i in range(args.clients)))
+    # join_conversation is not acknowledged; give the workers a moment to process it
+    await asyncio.sleep(1)
+    print(f'{len(clients)} sockets on {len(ports)} workers via {url}')
+
+    # HTTP worker -> socket workers
+    emitter = queue_emitter(url)
+    expected = 0
+    for seq in range(args.messages):
+        user_id = user_ids[seq % len(user_ids)]
+        expected += client_users.count(user_id)
+        payload = {'type': 'queue_bench', 'seq': seq, 'sent_at': time.time()}
+        await asyncio.to_thread(emitter.emit, 'notification', payload, room=f'user_{user_id}')
+        await asyncio.sleep(1.0 / args.rate)
+    await asyncio.sleep(args.settle)
+    latencies = [latency for values in notifications.values() for latency in values]
+    report('notification (emitter -> workers)', latencies, len(latencies), expected)
+    failed = len(latencies) != expected
+
+    # Socket worker -> socket workers; one typing event in flight at a time
+    typing_latencies, delivered, expected = [], 0, 0
+    for seq in range(args.typing):
+        sender = seq % len(clients)
+        typing.clear()
+        started = time.perf_counter()
+        await clients[sender].emit('typing', {'inquiry_id': args.conversation_id, 'is_typing': seq % 2 == 0})
+        expected += len(clients) - 1
+        deadline = started + args.settle
+        while len(typing) < len(clients) - 1 and time.perf_counter() < deadline:
+            await asyncio.sleep(0.001)
+        arrivals = [arrival for arrival, index in typing if index != sender]
+        delivered += len(arrivals)
+        typing_latencies.extend(arrival - started for arrival in arrivals)
+    report('typing (worker -> workers)', typing_latencies, delivered, expected)
+    failed = failed or delivered != expected
+
+    await asyncio.gather(*(client.disconnect() for client in clients), return_exceptions=True)
+    p99 = max(percentile(latencies, 0.99), percentile(typing_latencies, 0.99)) * 1000
+    return 1 if failed or (args.max_p99_ms and p99 > args.max_p99_ms) else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=3)
+    parser.add_argument('--base-port', type=int, default=5101)
+    parser.add_argument('--clients', type=int, default=60, help='sockets, spread round-robin over the workers')
+    parser.add_argument('--user-ids', default='1', help='comma separated users the sockets sign in as')
+    parser.add_argument('--conversation-id', type=int, default=1, help='room joined by every socket for typing')
+    parser.add_argument('--messages', type=int, default=200, help='notifications sent from the emitter')
+    parser.add_argument('--rate', type=float, default=100.0, help='notifications per second')
+    parser.add_argument('--typing', type=int, default=50, help='typing events sent between workers')
+    parser.add_argument('--settle', type=float, default=5.0, help='seconds to wait for late deliveries')
+    parser.add_argument('--message-queue', default='', help='existing queue URL; default starts the local broker')
+    parser.add_argument('--worker-cmd', default=f'{sys.executable} app.py')
+    parser.add_argument('--max-p99-ms', type=float, default=0, help='fail if p99 latency is above this')
+    args = parser.parse_args()
+
+    processes = []
+    try:
+        url = args.message_queue
+        if not url:
+            path = os.path.join(tempfile.mkdtemp(), 'socketio.sock')
+            url = f'unix://{path}'
+            processes.append(start([sys.executable, 'socketio_queue.py', '--path', path], os.environ.copy()))
+            wait_for(lambda: os.path.exists(path), 10, 'the broker')
+        ports = [args.base_port + i for i in range(args.workers)]
+        for port in ports:
+            env = dict(os.environ, PORT=str(port), SOCKETIO_MESSAGE_QUEUE=url,
+                       SOCKETIO_LOGGING='0', FLASK_DEBUG='0')
+            processes.append(start(shlex.split(args.worker_cmd), env))
+        for port in ports:
+            wait_for(lambda: port_open(port), 60, f'the worker on port {port}')
+        return asyncio.run(run(args, url, ports))
+    finally:
+        stop(processes)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,111 @@
+"""Concurrency benchmark for the stock reservation path used by create_order.
+
+Creates a throwaway product with a fixed stock, hammers it from many threads
+with reserve_stock() inside run_in_transaction(), then checks that exactly
+``stock`` units were sold and quantity never went negative.
+
+    python bench_stock_reservation.py --threads 32 --stock 2000 --target 500
+
+Requires the MySQL database configured in .env. Exits non-zero on oversell
+or if throughput is below --target orders/sec.
+"""
+import argparse
+import sys
+import threading
+import time
+from datetime import datetime
+import db
+from models import reserve_stock, run_in_transaction
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--stock', type=int, default=2000)
+    parser.add_argument('--quantity', type=int, default=1, help='units per order')
+    parser.add_argument('--attempts', type=int, default=None,
+                        help='orders attempted per thread (default: enough to exhaust stock twice)')
+    parser.add_argument('--target', type=float, default=0, help='minimum orders/sec')
+    args = parser.parse_args()
+    attempts = args.attempts or max(1, (2 * args.stock) // (args.threads * args.quantity))
+
+    pool = db.ConnectionPool(size=args.threads, max_overflow=0)
+    conn = pool.acquire()
+    cursor = conn.cursor()
+    cursor.execute('SELECT id FROM users LIMIT 1')
+    row = cursor.fetchone()
+    if not row:
+        print('Benchmark needs at least one user row to own the test product')
+        return 2
+    cursor.execute('''INSERT INTO products (name, price, quantity, product_status, producer_id, created_at, updated_at)
+                      VALUES (%s, %s, %s, %s, %s, %s, %s)''',
+                   ('bench-stock-reservation', 1, args.stock, 'bench', row[0], datetime.utcnow(), datetime.utcnow()))
+    product_id = cursor.lastrowid
+    conn.commit()
+    cursor.close()
+    conn.close()
+
+    counts = {'reserved': 0, 'insufficient': 0, 'errors': 0}
+    lock = threading.Lock()
+    start_gate = threading.Barrier(args.threads)
+
+    def reserve(conn):
+        cursor = conn.cursor()
+        try:
+            return reserve_stock(cursor, product_id, args.quantity)
+        finally:
+            cursor.close()
+
+    def worker():
+        start_gate.wait()
+        for _ in range(attempts):
+            conn = pool.acquire()
+            try:
+                outcome = 'reserved' if run_in_transaction(conn, reserve) else 'insufficient'
+            except Exception as e:
+                print(f'Reservation failed: {e}')
+                outcome = 'errors'
+            finally:
+                conn.close()
+            with lock:
+                counts[outcome] += 1
+
+    threads = [threading.Thread(target=worker) for _ in range(args.threads)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    conn = pool.acquire()
+    cursor = conn.cursor()
+    cursor.execute('SELECT quantity FROM products WHERE id = %s', (product_id,))
+    final_quantity = cursor.fetchone()[0]
+    cursor.execute('DELETE FROM products WHERE id = %s', (product_id,))
+    conn.commit()
+    cursor.close()
+    conn.close()
+
+    total = sum(counts.values())
+    sold = counts['reserved'] * args.quantity
+    rate = total / elapsed if elapsed else 0
+    print(f"threads={args.threads} attempts={total} elapsed={elapsed:.2f}s rate={rate:.0f} orders/s")
+    print(f"reserved={counts['reserved']} insufficient={counts['insufficient']} errors={counts['errors']}")
+    print(f"stock={args.stock} sold={sold} final_quantity={final_quantity}")
+    print(f"pool={pool.stats()}")
+
+    ok = True
+    if final_quantity < 0 or sold + final_quantity != args.stock:
+        print('FAIL: oversold or lost stock')
+        ok = False
+    if args.target and rate < args.target:
+        print(f'FAIL: {rate:.0f} orders/s is below target {args.target:.0f}')
+        ok = False
+    if ok:
+        print('OK: no oversell')
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
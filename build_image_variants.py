@@ -0,0 +1,66 @@
+"""Build the thumbnail/WebP variants of uploaded images.
+
+Uploads queue their variants automatically; run this to backfill images
+uploaded before the variant pipeline existed, or ones deferred while the
+image pool was saturated. Afterwards product_images.variants_version is
+synced with the files on disk, since the API reads availability from it.
+
+    python build_image_variants.py
+
+Variant names are served as immutable, so existing files are never
+rewritten. To rebuild after changing the sizes or quality, bump
+IMAGE_VARIANTS_VERSION and run this again: the new version is written
+under new names and the old files go when their upload is collected.
+"""
+import argparse
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from db import get_db_connection
+from images import (UPLOAD_FOLDER, IMAGE_VARIANTS, IMAGE_WORKERS, iter_uploads, render_variants,
+                    sync_variant_versions, variant_path)
+
+IMAGE_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
+
+
+def pending_uploads():
+    for relpath, path in iter_uploads():
+        if relpath.rsplit('.', 1)[-1].lower() not in IMAGE_EXTENSIONS:
+            continue
+        if not all(os.path.exists(os.path.join(UPLOAD_FOLDER, variant_path(relpath, name)))
+                   for name in IMAGE_VARIANTS):
+            yield path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=IMAGE_WORKERS, help='worker processes')
+    args = parser.parse_args()
+
+    built = failed = 0
+    with ProcessPoolExecutor(args.workers) as executor:
+        futures = {executor.submit(render_variants, path): path for path in pending_uploads()}
+        for future in as_completed(futures):
+            try:
+                future.result()
+                built += 1
+            except Exception as e:
+                failed += 1
+                print(f'{os.path.basename(futures[future])}: {e}')
+
+    print(f'Built variants for {built} images, {failed} failed')
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        synced = sync_variant_versions(cursor)
+        conn.commit()
+    finally:
+        cursor.close()
+        conn.close()
+    print(f'Updated variants_version on {synced} product images')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,6 +1,10 @@
 import os
+import threading
+import time
+from collections import deque
 import mysql.connector
 from dotenv import load_dotenv
+from flask import g, has_app_context
 
 load_dotenv()
 
@@ -9,10 +13,297 @@ MYSQL_USER = os.getenv('MYSQL_USER', 'root')
 MYSQL_PASSWORD = os.getenv('MYSQL_PASSWORD', '')
 MYSQL_DATABASE = os.getenv('MYSQL_DATABASE', 'tradelink')
 
-def get_db_connection():
-    return mysql.connector.connect(
+# Connection pool settings
+MYSQL_POOL_SIZE = int(os.getenv('MYSQL_POOL_SIZE', '10'))
+MYSQL_POOL_MAX_OVERFLOW = int(os.getenv('MYSQL_POOL_MAX_OVERFLOW', '10'))
+MYSQL_POOL_TIMEOUT = float(os.getenv('MYSQL_POOL_TIMEOUT', '30'))
+MYSQL_POOL_RECYCLE = float(os.getenv('MYSQL_POOL_RECYCLE', '3600'))
+MYSQL_POOL_PING_AFTER = float(os.getenv('MYSQL_POOL_PING_AFTER', '30'))
+# Bound how long a transaction waits on a row lock (seconds)
+MYSQL_LOCK_WAIT_TIMEOUT = int(os.getenv('MYSQL_LOCK_WAIT_TIMEOUT', '5'))
+# The C extension blocks the whole event loop under eventlet/gevent; the pure-Python
+# driver talks over the patched sockets and yields while waiting on MySQL
+GREEN_ASYNC_MODE = os.getenv('SOCKETIO_ASYNC_MODE', 'threading') in ('eventlet', 'gevent')
+# Unset leaves the choice to the connector (C extension when installed)
+MYSQL_USE_PURE = os.getenv('MYSQL_USE_PURE', '1' if GREEN_ASYNC_MODE else '')
+
+
+# Called as query_observer(statement, seconds) after every statement on a pooled cursor
+query_observer = None
+
+
+class PoolTimeout(Exception):
+    """Raised when no pooled connection becomes available in time"""
+
+
+def _connect():
+    options = {}
+    if MYSQL_USE_PURE:
+        options['use_pure'] = MYSQL_USE_PURE == '1'
+    conn = mysql.connector.connect(
         host=MYSQL_HOST,
         user=MYSQL_USER,
         password=MYSQL_PASSWORD,
-        database=MYSQL_DATABASE
-    ) 
\ No newline at end of file
+        database=MYSQL_DATABASE,
+        consume_results=True,
+        **options
+    )
+    cursor = conn.cursor()
+    cursor.execute('SET SESSION innodb_lock_wait_timeout = %s', (MYSQL_LOCK_WAIT_TIMEOUT,))
+    cursor.close()
+    return conn
+
+
+class ConnectionPool:
+    """Bounded pool of MySQL connections with overflow and checkout timeout.
+
+    Up to ``size`` connections are kept idle between checkouts; up to
+    ``max_overflow`` extra connections may be opened under load and are
+    closed again when returned.  Idle connections are pinged on borrow once
+    they have been unused for ``ping_after`` seconds and are replaced after
+    ``recycle`` seconds.
+    """
+
+    def __init__(self, size=MYSQL_POOL_SIZE, max_overflow=MYSQL_POOL_MAX_OVERFLOW,
+                 timeout=MYSQL_POOL_TIMEOUT, recycle=MYSQL_POOL_RECYCLE,
+                 ping_after=MYSQL_POOL_PING_AFTER, connect=_connect):
+        self.size = size
+        self.max_overflow = max_overflow
+        self.timeout = timeout
+        self.recycle = recycle
+        self.ping_after = ping_after
+        self._connect = connect
+        self._idle = deque()  # (connection, created_at, returned_at)
+        self._cond = threading.Condition()
+        self._opened = 0
+        self._in_use = 0
+        self._waiters = 0
+        self._checkouts = 0
+        self._timeouts = 0
+        self._failed_pings = 0
+        self._wait_time = 0.0
+        self._max_wait_time = 0.0
+
+    def _is_healthy(self, conn, created_at, returned_at):
+        now = time.monotonic()
+        if self.recycle and now - created_at > self.recycle:
+            return False
+        if now - returned_at < self.ping_after:
+            return True
+        try:
+            conn.ping(reconnect=False)
+            return True
+        except Exception:
+            self._failed_pings += 1
+            return False
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def acquire(self):
+        """Borrow a connection, waiting up to ``timeout`` seconds"""
+        started = time.monotonic()
+        deadline = started + self.timeout
+        with self._cond:
+            self._waiters += 1
+            try:
+                while True:
+                    while self._idle:
+                        conn, created_at, returned_at = self._idle.pop()
+                        if self._is_healthy(conn, created_at, returned_at):
+                            return self._checked_out(conn, created_at, started)
+                        self._opened -= 1
+                        self._discard(conn)
+                    if self._opened < self.size + self.max_overflow:
+                        self._opened += 1
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._timeouts += 1
+                        raise PoolTimeout(
+                            f'No database connection available within {self.timeout}s '
+                            f'(pool size {self.size}, overflow {self.max_overflow})')
+                    self._cond.wait(remaining)
+            finally:
+                self._waiters -= 1
+
+        # Open outside the lock so a slow handshake doesn't block other borrowers
+        try:
+            conn = self._connect()
+        except Exception:
+            with self._cond:
+                self._opened -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            return self._checked_out(conn, time.monotonic(), started)
+
+    def _checked_out(self, conn, created_at, started):
+        waited = time.monotonic() - started
+        self._in_use += 1
+        self._checkouts += 1
+        self._wait_time += waited
+        self._max_wait_time = max(self._max_wait_time, waited)
+        return PooledConnection(self, conn, created_at)
+
+    def release(self, conn, created_at):
+        """Return a raw connection to the pool, discarding any open transaction"""
+        healthy = True
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except Exception:
+            healthy = False
+        with self._cond:
+            self._in_use -= 1
+            if healthy and len(self._idle) < self.size:
+                self._idle.append((conn, created_at, time.monotonic()))
+                conn = None
+            else:
+                self._opened -= 1
+            self._cond.notify()
+        if conn is not None:
+            self._discard(conn)
+
+    def discard(self, conn):
+        """Close a checked-out raw connection instead of returning it"""
+        with self._cond:
+            self._in_use -= 1
+            self._opened -= 1
+            self._cond.notify()
+        self._discard(conn)
+
+    def stats(self):
+        """Snapshot of pool counters for monitoring"""
+        with self._cond:
+            return {
+                'size': self.size,
+                'max_overflow': self.max_overflow,
+                'opened': self._opened,
+                'idle': len(self._idle),
+                'in_use': self._in_use,
+                'waiters': self._waiters,
+                'checkouts': self._checkouts,
+                'timeouts': self._timeouts,
+                'failed_pings': self._failed_pings,
+                'total_wait_seconds': round(self._wait_time, 6),
+                'max_wait_seconds': round(self._max_wait_time, 6),
+                'avg_wait_seconds': round(self._wait_time / self._checkouts, 6) if self._checkouts else 0.0
+            }
+
+
+class PooledConnection:
+    """Proxy around a pooled connection.
+
+    ``close()`` hands the connection back to the pool instead of tearing down
+    the socket.  While the connection is bound to a Flask request, ``close()``
+    only rolls back uncommitted work (exactly what a real close would do) and
+    the connection stays bound until the request ends.
+    """
+
+    def __init__(self, pool, conn, created_at):
+        self._pool = pool
+        self._conn = conn
+        self._created_at = created_at
+        self._request_bound = False
+
+    def __getattr__(self, name):
+        conn = self.__dict__.get('_conn')
+        if conn is None:
+            raise AttributeError(f'Connection already returned to the pool ({name})')
+        return getattr(conn, name)
+
+    def cursor(self, *args, **kwargs):
+        if self._conn is None:
+            raise AttributeError('Connection already returned to the pool (cursor)')
+        cursor = self._conn.cursor(*args, **kwargs)
+        if query_observer is not None:
+            return ObservedCursor(cursor, query_observer)
+        return cursor
+
+    def close(self):
+        if self._conn is None:
+            return
+        if self._request_bound:
+            if self._conn.in_transaction:
+                self._conn.rollback()
+            return
+        self._return()
+
+    def _return(self):
+        conn, self._conn = self._conn, None
+        if conn is not None:
+            self._pool.release(conn, self._created_at)
+
+    def discard(self):
+        """Drop the connection, e.g. when an unread result is still pending on it"""
+        conn, self._conn = self._conn, None
+        if conn is not None:
+            self._pool.discard(conn)
+
+
+class ObservedCursor:
+    """Cursor proxy that reports each statement and its duration to an observer"""
+
+    def __init__(self, cursor, observer):
+        self._cursor = cursor
+        self._observer = observer
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def execute(self, operation, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return self._cursor.execute(operation, *args, **kwargs)
+        finally:
+            self._observer(operation, time.perf_counter() - started)
+
+    def executemany(self, operation, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return self._cursor.executemany(operation, *args, **kwargs)
+        finally:
+            self._observer(operation, time.perf_counter() - started)
+
+
+pool = ConnectionPool()
+
+
+def get_db_connection():
+    """Return a pooled connection.
+
+    Inside a Flask request (or Socket.IO event) the same connection is reused
+    by every caller until the request ends.
+    """
+    if has_app_context():
+        conn = g.get('_db_conn')
+        if conn is None or conn._conn is None:
+            conn = pool.acquire()
+            conn._request_bound = True
+            g._db_conn = conn
+        return conn
+    return pool.acquire()
+
+
+def release_request_connection(exception=None):
+    """Return the request-bound connection to the pool"""
+    conn = g.pop('_db_conn', None)
+    if conn is not None:
+        conn._request_bound = False
+        conn._return()
+
+
+def get_pool_stats():
+    return pool.stats()
+
+
+def init_db(app):
+    """Register pool teardown with the Flask app"""
+    app.teardown_appcontext(release_request_connection)
@@ -0,0 +1,81 @@
+import os
+import secrets
+import threading
+from collections import OrderedDict, deque
+from socketio_queue import SOCKETIO_MESSAGE_QUEUE
+
+# Events kept per user for replay after a reconnect
+EVENT_LOG_SIZE = int(os.getenv('EVENT_LOG_SIZE', '100'))
+# Users with a replay buffer; the least recently connected are evicted
+EVENT_LOG_USERS = int(os.getenv('EVENT_LOG_USERS', '10000'))
+
+
+class EventLog:
+    """Per-user sequence numbers and bounded replay buffers for pushed events.
+
+    A user gets a buffer when they first connect. From then on every event
+    addressed to them is numbered 1, 2, 3... and the last ``size`` are kept,
+    also while they are offline, so a reconnecting client can be sent just
+    what it missed. The epoch is new for every process start; sequence
+    numbers from another epoch are never replayed.
+    """
+
+    def __init__(self, size=EVENT_LOG_SIZE, max_users=EVENT_LOG_USERS, enabled=True):
+        self.size = size
+        self.max_users = max_users
+        self.enabled = enabled
+        self.epoch = secrets.token_hex(8)
+        self._lock = threading.Lock()
+        self._users = OrderedDict()  # user_id -> {'role', 'seq', 'events': deque of (event, data, seq)}
+        self._roles = {}  # role -> set of user ids with a buffer
+
+    def track(self, user_id, role):
+        """Keep a buffer for ``user_id``; returns the user's latest sequence number"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            log = self._users.get(user_id)
+            if log is None:
+                log = self._users[user_id] = {'role': role, 'seq': 0, 'events': deque(maxlen=self.size)}
+                self._roles.setdefault(role, set()).add(user_id)
+                while len(self._users) > self.max_users:
+                    evicted, old = self._users.popitem(last=False)
+                    self._roles[old['role']].discard(evicted)
+            self._users.move_to_end(user_id)
+            return log['seq']
+
+    def record(self, user_ids, event, data):
+        """Number one event for each of ``user_ids`` and keep it; returns {user_id: seq}.
+
+        Users without a buffer are left out. ``data`` is shared by the
+        buffers, so callers must not change it afterwards.
+        """
+        seqs = {}
+        with self._lock:
+            for user_id in user_ids:
+                log = self._users.get(user_id)
+                if log is not None:
+                    log['seq'] += 1
+                    log['events'].append((event, data, log['seq']))
+                    seqs[user_id] = log['seq']
+        return seqs
+
+    def users_with_role(self, role):
+        with self._lock:
+            return list(self._roles.get(role, ()))
+
+    def since(self, user_id, epoch, last_seq):
+        """Events after ``last_seq`` as (event, data), or None if some can't be replayed"""
+        with self._lock:
+            log = self._users.get(user_id)
+            if log is None or epoch != self.epoch or not 0 <= last_seq <= log['seq']:
+                return None
+            missed = log['seq'] - last_seq
+            if missed > len(log['events']):
+                return None
+            replay = list(log['events'])[len(log['events']) - missed:]
+        return [(event, dict(data, seq=seq)) for event, data, seq in replay]
+
+
+# Sequence numbers are per process, so replay is off when processes share a message queue
+event_log = EventLog(enabled=not SOCKETIO_MESSAGE_QUEUE)
@@ -0,0 +1,73 @@
+import csv
+import os
+import zlib
+from io import StringIO
+from flask import Response, request
+from db import pool
+
+EXPORT_CHUNK_ROWS = int(os.getenv('EXPORT_CHUNK_ROWS', '1000'))
+# A slow download keeps the server-side result open; don't let MySQL drop it early
+EXPORT_NET_WRITE_TIMEOUT = int(os.getenv('EXPORT_NET_WRITE_TIMEOUT', '600'))
+# GROUP_CONCAT columns (e.g. a product's image URLs) are silently cut at 1024 bytes by default
+EXPORT_GROUP_CONCAT_MAX_LEN = int(os.getenv('EXPORT_GROUP_CONCAT_MAX_LEN', '1048576'))
+
+
+def iter_csv_export(query, params=(), compress=False, chunk_rows=EXPORT_CHUNK_ROWS):
+    """Yield a query's rows as CSV bytes, ``chunk_rows`` rows at a time.
+
+    Runs on its own pooled connection with an unbuffered cursor, so rows are
+    pulled from MySQL as the client reads them and memory stays bounded by
+    one chunk whatever the table size. With ``compress`` the output is a
+    gzip stream, flushed after every chunk.
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+    buffer = StringIO()
+    writer = csv.writer(buffer)
+
+    def take():
+        data = buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+        if compressor:
+            data = compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        return data
+
+    conn = pool.acquire()
+    finished = False
+    try:
+        cursor = conn.cursor()
+        cursor.execute('SET SESSION net_write_timeout = %s, group_concat_max_len = %s',
+                       (EXPORT_NET_WRITE_TIMEOUT, EXPORT_GROUP_CONCAT_MAX_LEN))
+        cursor.execute(query, tuple(params))
+        writer.writerow(cursor.column_names)
+        yield take()
+        while True:
+            rows = cursor.fetchmany(chunk_rows)
+            if not rows:
+                break
+            writer.writerows(rows)
+            yield take()
+        cursor.execute('''SET SESSION net_write_timeout = @@GLOBAL.net_write_timeout,
+                          group_concat_max_len = @@GLOBAL.group_concat_max_len''')
+        cursor.close()
+        finished = True
+        if compressor:
+            yield compressor.flush()
+    except Exception as e:
+        print(f"CSV export failed: {e}")
+        raise
+    finally:
+        # An abandoned download leaves unread rows on the connection; don't pool it
+        if finished:
+            conn.close()
+        else:
+            conn.discard()
+
+
+def csv_export_response(query, params, filename):
+    """Stream a query as a CSV attachment, gzipped if the client accepts it"""
+    compress = request.accept_encodings['gzip'] > 0
+    headers = {'Content-Disposition': f'attachment; filename={filename}', 'Vary': 'Accept-Encoding'}
+    if compress:
+        headers['Content-Encoding'] = 'gzip'
+    return Response(iter_csv_export(query, params, compress), mimetype='text/csv', headers=headers)
@@ -0,0 +1,43 @@
+"""Delete uploaded files that no product, product image or message attachment references.
+
+Uploads modified within the grace period are kept, so images uploaded for a
+product that hasn't been saved yet survive. Variants of deleted uploads go too.
+
+    python gc_uploads.py --dry-run           # list what would be deleted
+    python gc_uploads.py --grace-hours 48
+
+Requires the MySQL database configured in .env.
+"""
+import argparse
+import sys
+import db
+from uploads import UPLOADS_GC_GRACE_HOURS, collect_garbage
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--dry-run', action='store_true', help='only list unreferenced uploads')
+    parser.add_argument('--grace-hours', type=float, default=UPLOADS_GC_GRACE_HOURS,
+                        help='keep unreferenced uploads modified more recently than this')
+    args = parser.parse_args()
+
+    conn = db.get_db_connection()
+    cursor = conn.cursor()
+    try:
+        removed, freed = collect_garbage(cursor, args.grace_hours, args.dry_run)
+    except Exception as e:
+        print(f'Upload garbage collection failed: {e}')
+        return 1
+    finally:
+        cursor.close()
+        conn.close()
+
+    for relpath in removed:
+        print(relpath)
+    action = 'Would delete' if args.dry_run else 'Deleted'
+    print(f'{action} {len(removed)} uploads ({freed / (1024 * 1024):.1f} MiB)')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
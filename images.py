@@ -0,0 +1,398 @@
+import atexit
+import functools
+import multiprocessing
+import os
+import re
+import threading
+import zlib
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from PIL import Image, ImageOps
+from db import get_db_connection
+
+UPLOAD_FOLDER = os.path.join(os.path.dirname(__file__), 'uploads')
+VARIANT_FOLDER = os.path.join(UPLOAD_FOLDER, 'variants')
+# Uploads being received and hashed; same filesystem so they can be renamed into place
+TEMP_FOLDER = os.path.join(UPLOAD_FOLDER, 'tmp')
+
+IMAGE_WORKERS = int(os.getenv('IMAGE_WORKERS', '2'))
+# Uploads allowed to wait for a worker; beyond that they are left to build_image_variants.py
+IMAGE_QUEUE_LIMIT = int(os.getenv('IMAGE_QUEUE_LIMIT', '64'))
+IMAGE_WEBP_QUALITY = int(os.getenv('IMAGE_WEBP_QUALITY', '80'))
+# Seconds an upload waits for its metadata to be stripped before it fails
+IMAGE_STRIP_TIMEOUT = float(os.getenv('IMAGE_STRIP_TIMEOUT', '30'))
+# Variants are cached as immutable, so they are never rebuilt under the same name. Bump this after
+# changing IMAGE_VARIANTS or IMAGE_WEBP_QUALITY and run build_image_variants.py to write new names.
+IMAGE_VARIANTS_VERSION = int(os.getenv('IMAGE_VARIANTS_VERSION', '1'))
+
+# Variant name -> longest edge in pixels, largest first
+IMAGE_VARIANTS = {
+    'detail': 1200,
+    'card': 480,
+    'thumb': 160
+}
+
+# Content-addressed blob path: ab/cd/<sha256>.<ext>
+BLOB_PATH = re.compile(r'^([0-9a-f]{2})/([0-9a-f]{2})/(\1\2[0-9a-f]{60})\.[a-z0-9]+$')
+
+
+def variant_path(relpath, name, version=IMAGE_VARIANTS_VERSION):
+    """Path of an upload's variant relative to UPLOAD_FOLDER; mirrors its shard directories.
+
+    Version 1 keeps the original unversioned names.
+    """
+    directory, filename = os.path.split(relpath)
+    suffix = f'.v{version}' if version != 1 else ''
+    return os.path.join('variants', directory, f'{os.path.splitext(filename)[0]}_{name}{suffix}.webp')
+
+
+def variant_files(relpath):
+    """Paths relative to UPLOAD_FOLDER of an upload's variants, of every version"""
+    directory = os.path.dirname(variant_path(relpath, 'thumb'))
+    stem = os.path.splitext(os.path.basename(relpath))[0]
+    pattern = re.compile(re.escape(stem) + '_(' + '|'.join(IMAGE_VARIANTS) + r')(\.v\d+)?\.webp$')
+    try:
+        names = os.listdir(os.path.join(UPLOAD_FOLDER, directory))
+    except FileNotFoundError:
+        return []
+    return [os.path.join(directory, name) for name in names if pattern.match(name)]
+
+
+def render_variants(source_path, quality=IMAGE_WEBP_QUALITY, version=IMAGE_VARIANTS_VERSION):
+    """Write the WebP variants of one upload; runs in a pool worker.
+
+    Variants are saved without EXIF or other metadata, and each one is
+    written to a temporary file first so a half-written file is never served.
+    A variant that already exists is left alone: its name is cached as
+    immutable, so new settings need a new ``version``.
+    """
+    relpath = os.path.relpath(source_path, UPLOAD_FOLDER)
+    os.makedirs(os.path.join(UPLOAD_FOLDER, os.path.dirname(variant_path(relpath, 'thumb', version))), exist_ok=True)
+    largest = max(IMAGE_VARIANTS.values())
+    with Image.open(source_path) as original:
+        # Lets the JPEG decoder downscale while decoding large photos
+        original.draft('RGB', (largest, largest))
+        image = ImageOps.exif_transpose(original)
+        has_alpha = image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info)
+        image = image.convert('RGBA' if has_alpha else 'RGB')
+    written = []
+    # Each size is shrunk from the previous one, so only the first resize touches the full image
+    for name, edge in IMAGE_VARIANTS.items():
+        image.thumbnail((edge, edge), Image.LANCZOS)
+        path = os.path.join(UPLOAD_FOLDER, variant_path(relpath, name, version))
+        if os.path.exists(path):
+            continue
+        image.save(path + '.tmp', 'WEBP', quality=quality, method=4)
+        os.replace(path + '.tmp', path)
+        written.append(path)
+    return written
+
+
+def _orientation_exif(path):
+    """Minimal EXIF (TIFF bytes) holding only the image's orientation, or None if upright"""
+    try:
+        with Image.open(path) as image:
+            orientation = image.getexif().get(0x0112)
+    except Exception:
+        return None
+    if orientation in (None, 1):
+        return None
+    exif = Image.Exif()
+    exif[0x0112] = orientation
+    return exif.tobytes()[6:]
+
+
+def _strip_jpeg(data, exif):
+    out = [data[:2]]
+    changed = False
+    i = 2
+    while i + 4 <= len(data) and data[i] == 0xFF:
+        marker = data[i + 1]
+        if marker == 0xFF:
+            i += 1
+            continue
+        if marker == 0xDA:
+            break
+        length = int.from_bytes(data[i + 2:i + 4], 'big')
+        segment = data[i:i + 2 + length]
+        # APP1 (EXIF/XMP), APP12, APP13 (IPTC) and comments; ICC (APP2) and Adobe (APP14) stay
+        if marker in (0xE1, 0xEC, 0xED, 0xFE):
+            if exif and marker == 0xE1 and segment[4:10] == b'Exif\0\0':
+                payload = b'Exif\0\0' + exif
+                changed = changed or segment[4:] != payload
+                out.append(b'\xff\xe1' + (len(payload) + 2).to_bytes(2, 'big') + payload)
+                exif = None
+            else:
+                changed = True
+        else:
+            out.append(segment)
+        i += 2 + length
+    out.append(data[i:])
+    return b''.join(out) if changed else None
+
+
+def _strip_png(data, exif):
+    out = [data[:8]]
+    changed = False
+    i = 8
+    while i + 12 <= len(data):
+        length = int.from_bytes(data[i:i + 4], 'big')
+        kind = data[i + 4:i + 8]
+        if kind in (b'eXIf', b'tEXt', b'zTXt', b'iTXt', b'tIME'):
+            if exif and kind == b'eXIf':
+                changed = changed or data[i + 8:i + 8 + length] != exif
+                out.append(len(exif).to_bytes(4, 'big') + kind + exif
+                           + zlib.crc32(kind + exif).to_bytes(4, 'big'))
+                exif = None
+            else:
+                changed = True
+        else:
+            out.append(data[i:i + 12 + length])
+        i += 12 + length
+    out.append(data[i:])
+    return b''.join(out) if changed else None
+
+
+def _strip_webp(data, exif):
+    out = []
+    changed = kept_exif = False
+    i = 12
+    while i + 8 <= len(data):
+        kind = data[i:i + 4]
+        size = int.from_bytes(data[i + 4:i + 8], 'little')
+        end = i + 8 + size + (size & 1)
+        if kind in (b'EXIF', b'XMP '):
+            if exif and kind == b'EXIF':
+                changed = changed or data[i + 8:i + 8 + size] != exif
+                out.append(kind + len(exif).to_bytes(4, 'little') + exif + b'\0' * (len(exif) & 1))
+                exif = None
+                kept_exif = True
+            else:
+                changed = True
+        else:
+            out.append(data[i:end])
+        i = end
+    if not changed:
+        return None
+    body = bytearray(b''.join(out))
+    if body[:4] == b'VP8X':
+        # Clear the XMP flag, and the EXIF flag unless the orientation was kept
+        body[8] &= ~0x04 & 0xFF
+        if not kept_exif:
+            body[8] &= ~0x08 & 0xFF
+    return b'RIFF' + (len(body) + 4).to_bytes(4, 'little') + b'WEBP' + bytes(body)
+
+
+def strip_metadata(path):
+    """Drop EXIF, XMP, IPTC and text metadata from an image file in place, without re-encoding.
+
+    Only the orientation tag is kept, so photos still display upright.
+    Returns True if the file was rewritten.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    if data[:3] == b'\xff\xd8\xff':
+        strip = _strip_jpeg
+    elif data[:8] == b'\x89PNG\r\n\x1a\n':
+        strip = _strip_png
+    elif data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        strip = _strip_webp
+    else:
+        return False
+    stripped = strip(data, _orientation_exif(path))
+    if stripped is None:
+        return False
+    with open(path, 'wb') as f:
+        f.write(stripped)
+    return True
+
+
+def upload_relpath(image_url):
+    """Path under UPLOAD_FOLDER of a local upload URL, or None for external images"""
+    if not image_url:
+        return None
+    path = image_url.split('?', 1)[0]
+    if '/uploads/' in path:
+        path = path.split('/uploads/', 1)[1]
+    elif ':' in path or (path.count('/') and not BLOB_PATH.match(path)):
+        return None
+    path = os.path.normpath(path.lstrip('/'))
+    if path.startswith('..') or os.path.isabs(path) or path == '.':
+        return None
+    return path
+
+
+def iter_uploads():
+    """Yield ``(relpath, path)`` for every stored upload, skipping variants and temp files"""
+    for directory, subdirs, files in os.walk(UPLOAD_FOLDER):
+        if directory == UPLOAD_FOLDER:
+            subdirs[:] = [d for d in subdirs if d not in ('variants', 'tmp')]
+        for name in files:
+            path = os.path.join(directory, name)
+            yield os.path.relpath(path, UPLOAD_FOLDER), path
+
+
+def built_variants_version(image_url, version=IMAGE_VARIANTS_VERSION):
+    """``version`` if every variant of the upload is on disk in it, else None.
+
+    Checked when an image is saved or its variants finish, so reads can use
+    the version stored on product_images instead of touching the filesystem.
+    """
+    relpath = upload_relpath(image_url)
+    if not relpath:
+        return None
+    for name in IMAGE_VARIANTS:
+        if not os.path.exists(os.path.join(UPLOAD_FOLDER, variant_path(relpath, name, version))):
+            return None
+    return version
+
+
+def variant_urls(image_url, version):
+    """URLs of an upload's variants keyed by size; empty if ``version`` is None"""
+    relpath = upload_relpath(image_url)
+    if not relpath or version is None:
+        return {}
+    return {name: f'/uploads/{variant_path(relpath, name, version)}' for name in IMAGE_VARIANTS}
+
+
+def mark_variants_built(image_url, version=IMAGE_VARIANTS_VERSION):
+    """Record on product_images that an upload's variants of ``version`` exist"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute('''UPDATE product_images SET variants_version = %s
+                          WHERE image_url = %s AND NOT (variants_version <=> %s)''',
+                       (version, image_url, version))
+        conn.commit()
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def sync_variant_versions(cursor):
+    """Set product_images.variants_version from the files on disk; returns rows changed"""
+    cursor.execute('SELECT id, image_url, variants_version FROM product_images')
+    changes = []
+    for image_id, image_url, stored in cursor.fetchall():
+        version = built_variants_version(image_url)
+        if version is None and stored is not None:
+            # Keep serving an older set until the current version is built
+            version = built_variants_version(image_url, stored)
+        if version != stored:
+            changes.append((version, image_id))
+    if changes:
+        cursor.executemany('UPDATE product_images SET variants_version = %s WHERE id = %s', changes)
+    return len(changes)
+
+
+class ImageProcessor:
+    """Bounded process pool that builds upload variants off the request threads.
+
+    At most ``queue_limit`` uploads are queued or in flight; ``submit``
+    never blocks and returns False when the pool is saturated.
+    """
+
+    def __init__(self, workers=IMAGE_WORKERS, queue_limit=IMAGE_QUEUE_LIMIT):
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self._slots = threading.BoundedSemaphore(queue_limit)
+        self._lock = threading.Lock()
+        self._executor = None
+        # Under eventlet/gevent the interpreter hangs at exit on a pool that is still running
+        atexit.register(self.stop)
+        self.processed = 0
+        self.failed = 0
+        self.skipped = 0
+
+    def start(self):
+        """Fork the workers now, before the app starts its own threads"""
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('fork'))
+            self._executor.submit(int).result()
+
+    def stop(self):
+        """Shut the workers down, dropping queued jobs"""
+        executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+    def submit(self, source_path):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.skipped += 1
+            print(f"Image queue full, variants for {os.path.basename(source_path)} deferred")
+            return False
+        try:
+            future = self._submit(render_variants, source_path)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(functools.partial(self._done, source_path))
+        return True
+
+    def run(self, fn, *args, timeout=None):
+        """Run ``fn(*args)`` in a worker and wait for its result; not counted against the queue limit"""
+        future = self._submit(fn, *args)
+        try:
+            return future.result(timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            raise
+
+    def _submit(self, fn, *args):
+        self.start()
+        try:
+            return self._executor.submit(fn, *args)
+        except BrokenProcessPool:
+            # A worker died (e.g. killed decoding a huge image); replace the pool once
+            print("Image pool broken, restarting workers")
+            self._executor = None
+            self.start()
+            return self._executor.submit(fn, *args)
+
+    def _done(self, source_path, future):
+        self._slots.release()
+        error = future.exception()
+        with self._lock:
+            if error is None:
+                self.processed += 1
+            else:
+                self.failed += 1
+        if error is not None:
+            print(f"Image variant build failed: {error}")
+            return
+        try:
+            mark_variants_built(f"/uploads/{os.path.relpath(source_path, UPLOAD_FOLDER)}")
+        except Exception as e:
+            # build_image_variants.py picks the row up on its next run
+            print(f"Could not record variants for {os.path.basename(source_path)}: {e}")
+
+    def stats(self):
+        with self._lock:
+            return {'workers': self.workers, 'queue_limit': self.queue_limit,
+                    'processed': self.processed, 'failed': self.failed, 'skipped': self.skipped}
+
+
+processor = None
+
+
+def init_images():
+    """Start the image variant pool"""
+    global processor
+    processor = ImageProcessor()
+    processor.start()
+    return processor
+
+
+def strip_upload_metadata(path):
+    """strip_metadata in the image pool, off the request thread; inline when no pool is running"""
+    if processor is None:
+        return strip_metadata(path)
+    return processor.run(strip_metadata, path, timeout=IMAGE_STRIP_TIMEOUT)
+
+
+def queue_variants(source_path):
+    """Queue variant generation for a saved upload; returns False if deferred"""
+    if processor is None:
+        return False
+    return processor.submit(source_path)
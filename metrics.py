@@ -0,0 +1,277 @@
+import hmac
+import os
+import re
+import threading
+import time
+from bisect import bisect_left
+from functools import lru_cache, wraps
+from flask import g, has_app_context, request
+import db
+import images
+import outbox
+import passwords
+
+# Same statement shape executed more than this many times in one request is flagged as N+1
+METRICS_N_PLUS_ONE_THRESHOLD = int(os.getenv('METRICS_N_PLUS_ONE_THRESHOLD', '10'))
+# Seconds between N+1 log lines for one endpoint; db_n_plus_one_total still counts every request
+METRICS_N_PLUS_ONE_LOG_INTERVAL = float(os.getenv('METRICS_N_PLUS_ONE_LOG_INTERVAL', '300'))
+# Bearer token required to scrape /metrics; /metrics is not served without one
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 250)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=''):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = 'untyped'
+
+    def __init__(self, name, documentation, label_names=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            items = sorted(self._values.items())
+        for labels, value in items:
+            lines.append(f'{self.name}{_labels(self.label_names, labels)} {_number(value)}')
+        return lines
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, labels=(), amount=1):
+        self.inc(labels, -amount)
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, label_names=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(buckets)
+
+    def observe(self, labels, value):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            items = sorted((labels, ([*counts], total, count)) for labels, (counts, total, count) in self._values.items())
+        for labels, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += bucket_count
+                le = 'le="%s"' % (bound if bound == '+Inf' else _number(float(bound)))
+                lines.append(f'{self.name}_bucket{_labels(self.label_names, labels, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{_labels(self.label_names, labels)} {_number(total)}')
+            lines.append(f'{self.name}_count{_labels(self.label_names, labels)} {count}')
+        return lines
+
+
+http_requests = Counter('http_requests_total', 'HTTP requests handled', ('endpoint', 'method', 'status'))
+http_latency = Histogram('http_request_duration_seconds', 'HTTP request latency', ('endpoint', 'method'))
+http_in_flight = Gauge('http_requests_in_flight', 'HTTP requests being handled', ('endpoint',))
+socket_events = Counter('socketio_events_total', 'Socket.IO events handled', ('event', 'status'))
+socket_latency = Histogram('socketio_event_duration_seconds', 'Socket.IO event handler latency', ('event',))
+socket_in_flight = Gauge('socketio_events_in_flight', 'Socket.IO events being handled', ('event',))
+# The histogram's _count doubles as the statement counter
+db_query_latency = Histogram('db_query_duration_seconds', 'SQL statement latency', ('endpoint',), QUERY_BUCKETS)
+db_queries_per_request = Histogram('db_queries_per_request', 'SQL statements per request or event',
+                                   ('endpoint',), QUERY_COUNT_BUCKETS)
+db_n_plus_one = Counter('db_n_plus_one_total', 'Requests repeating one statement shape more than the threshold',
+                        ('endpoint',))
+
+METRICS = [http_requests, http_latency, http_in_flight, socket_events, socket_latency, socket_in_flight,
+           db_query_latency, db_queries_per_request, db_n_plus_one]
+
+
+@lru_cache(maxsize=4096)
+def statement_shape(statement):
+    """Collapse whitespace and IN/VALUES placeholder lists so repeats of one query compare equal"""
+    shape = re.sub(r'\s+', ' ', statement).strip()
+    return re.sub(r'%s(?:\s*,\s*%s)+', '%s, ...', shape)
+
+
+def observe_query(statement, seconds):
+    """Query observer installed on the pooled connections' cursors"""
+    stats = g.get('_metrics') if has_app_context() else None
+    endpoint = stats['endpoint'] if stats else 'background'
+    db_query_latency.observe((endpoint,), seconds)
+    if stats:
+        stats['queries'] += 1
+        shape = statement_shape(statement if isinstance(statement, str) else statement.decode('utf-8', 'replace'))
+        stats['shapes'][shape] = stats['shapes'].get(shape, 0) + 1
+
+
+def metrics_authorized(authorization):
+    """True if ``authorization`` carries the configured scrape token"""
+    return bool(METRICS_TOKEN) and hmac.compare_digest((authorization or '').encode('utf-8'),
+                                                       f'Bearer {METRICS_TOKEN}'.encode('utf-8'))
+
+
+_n_plus_one_reports = {}  # endpoint -> [last reported at, requests not reported since]
+_n_plus_one_lock = threading.Lock()
+
+
+def _report_n_plus_one(endpoint, repeated):
+    """Log an endpoint's repeated statements at most once per METRICS_N_PLUS_ONE_LOG_INTERVAL"""
+    now = time.monotonic()
+    with _n_plus_one_lock:
+        report = _n_plus_one_reports.setdefault(endpoint, [None, 0])
+        if report[0] is not None and now - report[0] < METRICS_N_PLUS_ONE_LOG_INTERVAL:
+            report[1] += 1
+            return
+        skipped = report[1]
+        report[0], report[1] = now, 0
+    since = f" (and {skipped} requests since the last report)" if skipped else ''
+    for count, shape in repeated:
+        print(f"Possible N+1 in {endpoint}{since}: {count}x {shape[:200]}")
+
+
+def _start(endpoint):
+    g._metrics = {'endpoint': endpoint, 'started': time.perf_counter(), 'queries': 0, 'shapes': {}}
+
+
+def _finish():
+    """Record the query count and N+1 shapes of the current request; returns its duration"""
+    stats = g.pop('_metrics', None)
+    if stats is None:
+        return None
+    endpoint = stats['endpoint']
+    db_queries_per_request.observe((endpoint,), stats['queries'])
+    repeated = [(count, shape) for shape, count in stats['shapes'].items() if count > METRICS_N_PLUS_ONE_THRESHOLD]
+    if repeated:
+        db_n_plus_one.inc((endpoint,))
+        _report_n_plus_one(endpoint, repeated)
+    return time.perf_counter() - stats['started']
+
+
+def _endpoint():
+    return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+
+def _before_request():
+    endpoint = _endpoint()
+    http_in_flight.inc((endpoint,))
+    _start(endpoint)
+
+
+def _after_request(response):
+    g._metrics_status = response.status_code
+    return response
+
+
+def _teardown_request(exception=None):
+    endpoint = _endpoint()
+    duration = _finish()
+    if duration is None:
+        return
+    status = g.pop('_metrics_status', 500)
+    http_in_flight.dec((endpoint,))
+    http_requests.inc((endpoint, request.method, str(status)))
+    http_latency.observe((endpoint, request.method), duration)
+
+
+def observe_event(event):
+    """Decorator timing a Socket.IO handler and the SQL it runs"""
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            socket_in_flight.inc((event,))
+            _start(f'socketio:{event}')
+            status = 'error'
+            try:
+                result = f(*args, **kwargs)
+                status = 'ok'
+                return result
+            finally:
+                duration = _finish()
+                socket_in_flight.dec((event,))
+                socket_events.inc((event, status))
+                socket_latency.observe((event,), duration)
+        return wrapper
+    return decorator
+
+
+def init_metrics(blueprint):
+    """Time the blueprint's requests and every SQL statement run on pooled connections"""
+    blueprint.before_request(_before_request)
+    blueprint.after_request(_after_request)
+    blueprint.teardown_request(_teardown_request)
+    db.query_observer = observe_query
+
+
+def _gauge_lines(name, documentation, kind, values):
+    lines = [f'# HELP {name} {documentation}', f'# TYPE {name} {kind}']
+    for labels, value in values:
+        lines.append(f'{name}{labels} {_number(value)}')
+    return lines
+
+
+def render_metrics():
+    """All metrics in the Prometheus text exposition format"""
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    pool = db.get_pool_stats()
+    for key in ('opened', 'idle', 'in_use', 'waiters'):
+        lines.extend(_gauge_lines(f'db_pool_{key}', f'Connection pool {key.replace("_", " ")}', 'gauge',
+                                  [('', pool[key])]))
+    lines.extend(_gauge_lines('db_pool_checkouts_total', 'Connection pool checkouts', 'counter',
+                              [('', pool['checkouts'])]))
+    lines.extend(_gauge_lines('db_pool_timeouts_total', 'Connection pool checkout timeouts', 'counter',
+                              [('', pool['timeouts'])]))
+    lines.extend(_gauge_lines('db_pool_wait_seconds_total', 'Time spent waiting for a pooled connection',
+                              'counter', [('', pool['total_wait_seconds'])]))
+    # Background pools: (metric prefix, stats, counters to export)
+    pools = [('outbox', outbox.dispatcher, ('dispatched', 'failed')),
+             ('password_pool', passwords.hasher, ('completed', 'rejected')),
+             ('image_pool', images.processor, ('processed', 'failed', 'skipped'))]
+    for prefix, worker, keys in pools:
+        if worker is None:
+            continue
+        stats = worker.stats()
+        for key in keys:
+            lines.extend(_gauge_lines(f'{prefix}_{key}_total', f'{prefix.replace("_", " ").capitalize()} jobs {key}',
+                                      'counter', [('', stats[key])]))
+    return '\n'.join(lines) + '\n'
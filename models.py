@@ -1,5 +1,12 @@
 from datetime import datetime
+from decimal import Decimal
+import base64
+import json
+import random
+import time
 import bcrypt
+import mysql.connector
+from images import variant_urls
 
 # You can add direct MySQL query helper functions here if needed.
 
@@ -7,4 +14,234 @@ import bcrypt
 # def get_user_by_id(user_id, conn):
 #     cursor = conn.cursor(dictionary=True)
 #     cursor.execute('SELECT * FROM users WHERE id = %s', (user_id,))
-#     return cursor.fetchone() 
\ No newline at end of file
+#     return cursor.fetchone() 
+
+# Max ids per IN (...) list when batching lookups
+IN_CHUNK_SIZE = 1000
+
+def load_product_images(cursor, product_ids):
+    """Fetch image URLs for many products in a few IN (...) queries.
+
+    Returns {product_id: [(image_url, variants_version), ...]} with the
+    primary image first.
+    """
+    images = {}
+    ids = list(dict.fromkeys(pid for pid in product_ids if pid is not None))
+    for start in range(0, len(ids), IN_CHUNK_SIZE):
+        chunk = ids[start:start + IN_CHUNK_SIZE]
+        placeholders = ', '.join(['%s'] * len(chunk))
+        cursor.execute(f'''SELECT product_id, image_url, variants_version FROM product_images
+                          WHERE product_id IN ({placeholders})
+                          ORDER BY product_id, is_primary DESC, id''', tuple(chunk))
+        for row in cursor.fetchall():
+            if isinstance(row, dict):
+                images.setdefault(row['product_id'], []).append((row['image_url'], row['variants_version']))
+            else:
+                images.setdefault(row[0], []).append((row[1], row[2]))
+    return images
+
+def attach_product_images(cursor, rows, id_key='id'):
+    """Set row['images'] and row['image_variants'] from a single batched image lookup.
+
+    Variants come from the main image (or the first image), using the
+    variants_version stored on its product_images row.
+    """
+    rows = [dict(row) for row in rows]
+    images = load_product_images(cursor, [row[id_key] for row in rows])
+    for row in rows:
+        product_images = images.get(row[id_key], [])
+        row['images'] = [image_url for image_url, _ in product_images]
+        image_url = row.get('main_image_url') or (row['images'] or [None])[0]
+        row['image_variants'] = variant_urls(image_url, dict(product_images).get(image_url))
+    return rows
+
+def encode_cursor(values):
+    """Encode keyset pagination values as an opaque URL-safe token"""
+    raw = json.dumps(values, default=str, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_cursor(token):
+    """Decode a token from encode_cursor; raises ValueError if malformed"""
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        values = json.loads(raw.decode('utf-8'))
+    except Exception:
+        raise ValueError('Invalid cursor')
+    if not isinstance(values, list):
+        raise ValueError('Invalid cursor')
+    return values
+
+# ER_LOCK_DEADLOCK, ER_LOCK_WAIT_TIMEOUT
+RETRYABLE_ERRNOS = (1213, 1205)
+
+def reserve_stock(cursor, product_id, quantity):
+    """Decrement stock only if enough is left; returns False when it isn't.
+
+    The guarded UPDATE takes the row lock and checks availability in one
+    statement, so concurrent buyers can never drive quantity below zero.
+    """
+    cursor.execute('UPDATE products SET quantity = quantity - %s WHERE id = %s AND quantity >= %s',
+                   (quantity, product_id, quantity))
+    return cursor.rowcount == 1
+
+def run_in_transaction(conn, work, retries=3):
+    """Run work(conn) and commit, retrying on deadlock or lock wait timeout.
+
+    ``work`` must be safe to re-run from scratch; the transaction is rolled
+    back before every retry.
+    """
+    attempt = 0
+    while True:
+        try:
+            result = work(conn)
+            conn.commit()
+            return result
+        except mysql.connector.Error as e:
+            conn.rollback()
+            attempt += 1
+            if e.errno not in RETRYABLE_ERRNOS or attempt > retries:
+                raise
+            # Jittered backoff so contending transactions don't collide again
+            time.sleep(random.uniform(0, 0.02 * (2 ** attempt)))
+        except Exception:
+            conn.rollback()
+            raise
+
+def ensure_conversation_summary(cursor, inquiry_id):
+    """Create the summary row for an inquiry if it doesn't exist yet"""
+    cursor.execute('''INSERT IGNORE INTO conversation_summaries (inquiry_id, buyer_id, producer_id)
+                      SELECT i.id, i.buyer_id, COALESCE(p.producer_id, i.producer_id)
+                      FROM inquiries i
+                      LEFT JOIN products p ON i.product_id = p.id
+                      WHERE i.id = %s''', (inquiry_id,))
+
+def record_message_in_summary(cursor, inquiry_id, message_id, message, created_at):
+    """Fold a newly inserted message into its conversation summary.
+
+    Must run in the same transaction as the message INSERT. last_message_*
+    only moves forward, so concurrent inserts can't regress it.
+    """
+    cursor.execute('''INSERT INTO conversation_summaries (inquiry_id, buyer_id, producer_id, last_message_id, last_message, last_message_time)
+                      SELECT i.id, i.buyer_id, COALESCE(p.producer_id, i.producer_id), %s, %s, %s
+                      FROM inquiries i
+                      LEFT JOIN products p ON i.product_id = p.id
+                      WHERE i.id = %s
+                      ON DUPLICATE KEY UPDATE
+                          last_message = IF(VALUES(last_message_id) > COALESCE(last_message_id, 0), VALUES(last_message), last_message),
+                          last_message_time = IF(VALUES(last_message_id) > COALESCE(last_message_id, 0), VALUES(last_message_time), last_message_time),
+                          last_message_id = GREATEST(COALESCE(last_message_id, 0), VALUES(last_message_id))''',
+                   (message_id, message, created_at, inquiry_id))
+
+def mark_conversation_read(cursor, inquiry_id, user_id):
+    """Advance the reader's high-water mark to the newest message.
+
+    A single-row upsert on conversation_reads; messages are never rewritten.
+    """
+    cursor.execute('''INSERT INTO conversation_reads (inquiry_id, user_id, last_read_message_id, updated_at)
+                      VALUES (%s, %s, (SELECT COALESCE(MAX(id), 0) FROM messages WHERE inquiry_id = %s), %s)
+                      ON DUPLICATE KEY UPDATE
+                          updated_at = IF(VALUES(last_read_message_id) > last_read_message_id, VALUES(updated_at), updated_at),
+                          last_read_message_id = GREATEST(last_read_message_id, VALUES(last_read_message_id))''',
+                   (inquiry_id, user_id, inquiry_id, datetime.utcnow()))
+
+def apply_read_state(cursor, inquiry_id, messages):
+    """Set is_read on message rows from the participants' watermarks.
+
+    A message counts as read once any participant other than its sender has
+    read past it, matching the old per-row is_read flag.
+    """
+    cursor.execute('SELECT user_id, last_read_message_id FROM conversation_reads WHERE inquiry_id = %s',
+                   (inquiry_id,))
+    watermarks = [(row['user_id'], row['last_read_message_id']) if isinstance(row, dict) else tuple(row)
+                  for row in cursor.fetchall()]
+    for message in messages:
+        message['is_read'] = any(user_id != message['sender_id'] and last_read >= message['id']
+                                 for user_id, last_read in watermarks)
+    return messages
+
+# Per-producer daily order rollups (producer_daily_stats)
+ROLLUP_COLUMNS = ('order_count', 'gross_amount', 'commission_amount', 'completed_count', 'completed_amount',
+                  'pending_count', 'pending_amount', 'paid_amount')
+
+ROLLUP_ORDER_QUERY = '''SELECT o.id, p.producer_id, o.created_at, o.total_amount, o.commission_amount, o.status, o.payment_status
+                        FROM orders o JOIN products p ON o.product_id = p.id'''
+
+def order_rollup_contribution(order):
+    """What one order adds to its producer's rollup row, in ROLLUP_COLUMNS order"""
+    total = Decimal(str(order['total_amount'] or 0))
+    completed = order['status'] == 'completed'
+    pending = order['status'] == 'pending'
+    return (1, total, Decimal(str(order['commission_amount'] or 0)),
+            int(completed), total if completed else 0,
+            int(pending), total if pending else 0,
+            total if order['payment_status'] == 'completed' else 0)
+
+def load_order_for_rollup(cursor, order_id):
+    """Lock an order and return the fields the rollups depend on (None if missing)"""
+    cursor.execute(ROLLUP_ORDER_QUERY + ' WHERE o.id = %s FOR UPDATE', (order_id,))
+    row = cursor.fetchone()
+    if row is not None and not isinstance(row, dict):
+        row = dict(zip(cursor.column_names, row))
+    return row
+
+def apply_rollup_changes(cursor, changes):
+    """Fold order changes into producer_daily_stats in the caller's transaction.
+
+    ``changes`` is an iterable of ``(before, after)`` order dicts as returned
+    by load_order_for_rollup; ``before`` is None for a new order and
+    ``after`` None for a deleted one. Deltas are summed per (producer, day)
+    and written with one upsert, in key order to keep lock order stable.
+    The days of every changed order are also queued for the admin revenue
+    buckets, even when the rollup delta is zero: the buckets are also keyed
+    by currency, payment method and category.
+    """
+    deltas = {}
+    days = set()
+    for before, after in changes:
+        for order, sign in ((before, -1), (after, 1)):
+            if order is None:
+                continue
+            key = (order['producer_id'], order['created_at'].date())
+            days.add(key[1])
+            totals = deltas.setdefault(key, [0] * len(ROLLUP_COLUMNS))
+            for i, value in enumerate(order_rollup_contribution(order)):
+                totals[i] += sign * value
+    rows = [(producer_id, day, *totals) for (producer_id, day), totals in sorted(deltas.items()) if any(totals)]
+    if rows:
+        columns = ', '.join(ROLLUP_COLUMNS)
+        updates = ', '.join(f'{column} = {column} + VALUES({column})' for column in ROLLUP_COLUMNS)
+        placeholders = ', '.join(['%s'] * (len(ROLLUP_COLUMNS) + 2))
+        cursor.executemany(f'''INSERT INTO producer_daily_stats (producer_id, day, {columns})
+                               VALUES ({placeholders})
+                               ON DUPLICATE KEY UPDATE {updates}''', rows)
+    mark_revenue_days_dirty(cursor, days)
+
+def mark_revenue_days_dirty(cursor, days):
+    """Queue days whose orders changed for the revenue bucket refresher"""
+    if days:
+        cursor.executemany('INSERT IGNORE INTO revenue_dirty_days (day) VALUES (%s)',
+                           [(day,) for day in sorted(days)])
+
+def mark_product_revenue_days_dirty(cursor, product_id):
+    """Queue every day with orders for ``product_id``, e.g. after its category changed"""
+    cursor.execute('''INSERT IGNORE INTO revenue_dirty_days (day)
+                      SELECT DISTINCT DATE(created_at) FROM orders WHERE product_id = %s''', (product_id,))
+
+def rebuild_producer_rollups(cursor, producer_id=None):
+    """Recompute producer_daily_stats from orders, for one producer or all"""
+    params = (producer_id,) if producer_id is not None else ()
+    cursor.execute('DELETE FROM producer_daily_stats' + (' WHERE producer_id = %s' if params else ''), params)
+    cursor.execute(f'''INSERT INTO producer_daily_stats (producer_id, day, {', '.join(ROLLUP_COLUMNS)})
+                      SELECT p.producer_id, DATE(o.created_at),
+                             COUNT(*),
+                             SUM(o.total_amount),
+                             SUM(COALESCE(o.commission_amount, 0)),
+                             SUM(o.status = 'completed'),
+                             SUM(CASE WHEN o.status = 'completed' THEN o.total_amount ELSE 0 END),
+                             SUM(o.status = 'pending'),
+                             SUM(CASE WHEN o.status = 'pending' THEN o.total_amount ELSE 0 END),
+                             SUM(CASE WHEN o.payment_status = 'completed' THEN o.total_amount ELSE 0 END)
+                      FROM orders o JOIN products p ON o.product_id = p.id
+                      {'WHERE p.producer_id = %s' if params else ''}
+                      GROUP BY p.producer_id, DATE(o.created_at)''', params)
+    return cursor.rowcount
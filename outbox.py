@@ -0,0 +1,148 @@
+import json
+import os
+import threading
+from datetime import datetime
+from flask import g, has_app_context
+from db import get_db_connection
+
+OUTBOX_WORKERS = int(os.getenv('OUTBOX_WORKERS', '2'))
+OUTBOX_BATCH_SIZE = int(os.getenv('OUTBOX_BATCH_SIZE', '100'))
+# Fallback poll for rows committed by other processes or without a wake-up
+OUTBOX_POLL_INTERVAL = float(os.getenv('OUTBOX_POLL_INTERVAL', '1'))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv('OUTBOX_MAX_ATTEMPTS', '5'))
+
+
+def queue_emit(cursor, event, room, payload):
+    """Stage a Socket.IO emit in the caller's transaction.
+
+    Nothing is sent until the transaction commits and the dispatcher picks
+    the row up, so rolled-back work never reaches clients.
+    """
+    cursor.execute('INSERT INTO outbox (event, room, payload, created_at) VALUES (%s, %s, %s, %s)',
+                   (event, room, json.dumps(payload, default=str), datetime.utcnow()))
+    if has_app_context():
+        g._outbox_pending = True
+
+
+class OutboxDispatcher:
+    """Background threads that drain the outbox table in batches.
+
+    Each worker claims up to ``batch_size`` rows with SKIP LOCKED, emits
+    them and deletes them in one transaction, so several workers (or
+    processes) can drain concurrently without sending a row twice. A row
+    whose emit fails is retried up to ``max_attempts`` times.
+    """
+
+    def __init__(self, emit, workers=OUTBOX_WORKERS, batch_size=OUTBOX_BATCH_SIZE,
+                 poll_interval=OUTBOX_POLL_INTERVAL, max_attempts=OUTBOX_MAX_ATTEMPTS):
+        self._emit = emit
+        self.workers = workers
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._threads = []
+        self._lock = threading.Lock()
+        self.dispatched = 0
+        self.failed = 0
+
+    def start(self):
+        if self._threads:
+            return
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f'outbox-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout=5):
+        self._stopping.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+        self._stopping.clear()
+
+    def wake(self):
+        self._wakeup.set()
+
+    def _run(self):
+        while not self._stopping.is_set():
+            # Clear before draining so a wake-up during the batch isn't lost
+            self._wakeup.clear()
+            try:
+                claimed = self.dispatch_batch()
+            except Exception as e:
+                print(f"Outbox dispatch failed: {e}")
+                claimed = 0
+            if claimed < self.batch_size:
+                self._wakeup.wait(self.poll_interval)
+
+    def dispatch_batch(self):
+        """Emit one batch of pending rows; returns how many rows were claimed"""
+        conn = get_db_connection()
+        cursor = conn.cursor(dictionary=True)
+        try:
+            cursor.execute('''SELECT id, event, room, payload, attempts FROM outbox
+                              ORDER BY id LIMIT %s FOR UPDATE SKIP LOCKED''', (self.batch_size,))
+            rows = cursor.fetchall()
+            if not rows:
+                conn.rollback()
+                return 0
+
+            done, retry = [], []
+            errors = 0
+            for row in rows:
+                try:
+                    self._emit(row['event'], json.loads(row['payload']), room=row['room'])
+                    done.append(row['id'])
+                except Exception as e:
+                    print(f"Outbox emit {row['id']} ({row['event']}) failed: {e}")
+                    errors += 1
+                    if row['attempts'] + 1 >= self.max_attempts:
+                        done.append(row['id'])
+                    else:
+                        retry.append(row['id'])
+
+            if done:
+                placeholders = ', '.join(['%s'] * len(done))
+                cursor.execute(f'DELETE FROM outbox WHERE id IN ({placeholders})', tuple(done))
+            if retry:
+                placeholders = ', '.join(['%s'] * len(retry))
+                cursor.execute(f'UPDATE outbox SET attempts = attempts + 1 WHERE id IN ({placeholders})', tuple(retry))
+            conn.commit()
+            with self._lock:
+                self.dispatched += len(rows) - errors
+                self.failed += errors
+            return len(rows)
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+            conn.close()
+
+    def stats(self):
+        with self._lock:
+            return {'workers': len(self._threads), 'batch_size': self.batch_size,
+                    'dispatched': self.dispatched, 'failed': self.failed}
+
+
+dispatcher = None
+
+
+def _wake_after_request(exception=None):
+    if g.pop('_outbox_pending', False) and dispatcher is not None:
+        dispatcher.wake()
+
+
+def init_outbox(app, emit):
+    """Start the dispatcher and wake it when a request has queued emits.
+
+    ``emit(event, payload, room=...)`` delivers each row.
+    """
+    global dispatcher
+    dispatcher = OutboxDispatcher(emit)
+    app.teardown_appcontext(_wake_after_request)
+    dispatcher.start()
+    return dispatcher
@@ -0,0 +1,121 @@
+import atexit
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+import bcrypt
+
+# bcrypt work factor for new hashes; logins transparently rehash passwords stored with another cost
+BCRYPT_ROUNDS = int(os.getenv('BCRYPT_ROUNDS', '12'))
+PASSWORD_WORKERS = int(os.getenv('PASSWORD_WORKERS', str(os.cpu_count() or 2)))
+# Hashes allowed to wait for a worker before new requests are turned away with a 429
+PASSWORD_QUEUE_LIMIT = int(os.getenv('PASSWORD_QUEUE_LIMIT', '32'))
+PASSWORD_TIMEOUT = float(os.getenv('PASSWORD_TIMEOUT', '10'))
+
+
+class PasswordHasherBusy(Exception):
+    """Raised when the hashing pool is saturated; callers answer 429"""
+
+
+def _hash(password, rounds):
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds)).decode('utf-8')
+
+
+def _check(password, password_hash):
+    return bcrypt.checkpw(password, password_hash)
+
+
+class PasswordHasher:
+    """Bounded process pool for bcrypt so hashing never pins the request threads.
+
+    At most ``queue_limit`` hashes are queued or running; beyond that
+    ``run`` raises PasswordHasherBusy immediately instead of queueing.
+    """
+
+    def __init__(self, workers=PASSWORD_WORKERS, queue_limit=PASSWORD_QUEUE_LIMIT, timeout=PASSWORD_TIMEOUT):
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(queue_limit)
+        self._lock = threading.Lock()
+        self._executor = None
+        # Under eventlet/gevent the interpreter hangs at exit on a pool that is still running
+        atexit.register(self.stop)
+        self.completed = 0
+        self.rejected = 0
+
+    def start(self):
+        """Fork the workers now, before the app starts its own threads"""
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('fork'))
+            self._executor.submit(int).result()
+
+    def stop(self):
+        """Shut the workers down, dropping queued jobs"""
+        executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+    def run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise PasswordHasherBusy()
+        try:
+            self.start()
+            try:
+                future = self._executor.submit(fn, *args)
+            except BrokenProcessPool:
+                print("Password pool broken, restarting workers")
+                self._executor = None
+                self.start()
+                future = self._executor.submit(fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        # The slot is held until the job is done, even if this caller stops waiting
+        future.add_done_callback(lambda done: self._slots.release())
+        try:
+            result = future.result(self.timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            with self._lock:
+                self.rejected += 1
+            raise PasswordHasherBusy()
+        with self._lock:
+            self.completed += 1
+        return result
+
+    def stats(self):
+        with self._lock:
+            return {'workers': self.workers, 'queue_limit': self.queue_limit,
+                    'completed': self.completed, 'rejected': self.rejected}
+
+
+hasher = PasswordHasher()
+
+
+def init_passwords():
+    """Start the password hashing pool"""
+    hasher.start()
+    return hasher
+
+
+def hash_password(password):
+    """bcrypt hash of ``password`` at BCRYPT_ROUNDS, computed in the pool"""
+    return hasher.run(_hash, password.encode('utf-8'), BCRYPT_ROUNDS)
+
+
+def check_password(password, password_hash):
+    """Verify ``password`` against a stored bcrypt hash in the pool"""
+    return hasher.run(_check, password.encode('utf-8'), password_hash.encode('utf-8'))
+
+
+def needs_rehash(password_hash):
+    """True if the stored hash was made with a different work factor"""
+    try:
+        return int(password_hash.split('$')[2]) != BCRYPT_ROUNDS
+    except (IndexError, ValueError):
+        return True
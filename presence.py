@@ -0,0 +1,119 @@
+import os
+import threading
+import time
+from bisect import bisect_right, insort
+from datetime import datetime
+
+# Sockets with no event or confirmed Engine.IO liveness for this long are reaped
+PRESENCE_TTL = float(os.getenv('PRESENCE_TTL', '90'))
+PRESENCE_SWEEP_INTERVAL = float(os.getenv('PRESENCE_SWEEP_INTERVAL', '30'))
+
+
+class PresenceRegistry:
+    """Thread-safe registry of connected sockets, indexed by socket and by user.
+
+    A user with several devices has one entry holding all of their sids, so
+    online checks and per-role counts are O(1) and the admin listing pages
+    through users in id order. Each sid records when it was last seen;
+    ``expired`` lists the ones past the TTL for the sweeper to confirm and
+    reap. State is per process.
+    """
+
+    def __init__(self, ttl=PRESENCE_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._sids = {}  # sid -> [user_id, last_seen]
+        self._users = {}  # user_id -> {'user': profile, 'sids': {sid: connected_at}}
+        self._user_ids = []  # online user ids, sorted for paging
+        self._role_counts = {}
+
+    def add(self, sid, user):
+        """Register ``sid`` for ``user``; returns True if it is the user's first device"""
+        user_id = user['user_id']
+        now = datetime.utcnow()
+        with self._lock:
+            self._drop(sid)
+            self._sids[sid] = [user_id, time.monotonic()]
+            entry = self._users.get(user_id)
+            first = entry is None
+            if first:
+                entry = self._users[user_id] = {'user': user, 'sids': {}}
+                insort(self._user_ids, user_id)
+                self._role_counts[user['user_type']] = self._role_counts.get(user['user_type'], 0) + 1
+            else:
+                # The newest device's profile wins; user_type is fixed per user
+                entry['user'] = user
+            entry['sids'][sid] = now
+        return first
+
+    def remove(self, sid):
+        """Forget ``sid``; returns (profile, went_offline) or (None, False) if unknown"""
+        with self._lock:
+            return self._drop(sid)
+
+    def _drop(self, sid):
+        record = self._sids.pop(sid, None)
+        if record is None:
+            return None, False
+        entry = self._users[record[0]]
+        del entry['sids'][sid]
+        if entry['sids']:
+            return entry['user'], False
+        user = entry['user']
+        del self._users[record[0]]
+        self._user_ids.pop(bisect_right(self._user_ids, record[0]) - 1)
+        self._role_counts[user['user_type']] -= 1
+        if not self._role_counts[user['user_type']]:
+            del self._role_counts[user['user_type']]
+        return user, True
+
+    def touch(self, sid):
+        """Mark ``sid`` as alive; returns its user's profile, or None if not registered"""
+        with self._lock:
+            record = self._sids.get(sid)
+            if record is None:
+                return None
+            record[1] = time.monotonic()
+            return self._users[record[0]]['user']
+
+    def is_online(self, user_id):
+        return user_id in self._users
+
+    def sids_for(self, user_id):
+        with self._lock:
+            entry = self._users.get(user_id)
+            return list(entry['sids']) if entry else []
+
+    def counts(self):
+        with self._lock:
+            return {'online_users': len(self._users), 'connections': len(self._sids),
+                    'by_role': dict(self._role_counts)}
+
+    def expired(self):
+        """Sids not seen within the TTL"""
+        cutoff = time.monotonic() - self.ttl
+        with self._lock:
+            return [sid for sid, (user_id, last_seen) in self._sids.items() if last_seen < cutoff]
+
+    def page(self, limit, after_user_id=None, role=None):
+        """Up to ``limit`` online users after ``after_user_id`` in id order.
+
+        Returns (users, last_user_id); last_user_id is None on the final page.
+        """
+        users = []
+        with self._lock:
+            index = bisect_right(self._user_ids, after_user_id) if after_user_id is not None else 0
+            while index < len(self._user_ids) and len(users) <= limit:
+                entry = self._users[self._user_ids[index]]
+                index += 1
+                if role and entry['user']['user_type'] != role:
+                    continue
+                users.append(dict(entry['user'], devices=len(entry['sids']),
+                                  connected_at=min(entry['sids'].values()).isoformat()))
+        if len(users) > limit:
+            users.pop()
+            return users, users[-1]['user_id']
+        return users, None
+
+
+presence = PresenceRegistry()
@@ -0,0 +1,60 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Auth attempts per client IP: sustained rate and burst
+AUTH_IP_PER_MINUTE = float(os.getenv('AUTH_IP_PER_MINUTE', '20'))
+AUTH_IP_BURST = float(os.getenv('AUTH_IP_BURST', '20'))
+# Failed attempts per account (email or user)
+AUTH_ACCOUNT_PER_MINUTE = float(os.getenv('AUTH_ACCOUNT_PER_MINUTE', '5'))
+AUTH_ACCOUNT_BURST = float(os.getenv('AUTH_ACCOUNT_BURST', '5'))
+RATE_LIMIT_MAX_KEYS = int(os.getenv('RATE_LIMIT_MAX_KEYS', '100000'))
+
+
+class TokenBucketLimiter:
+    """Thread-safe per-key token buckets, least recently used keys evicted.
+
+    Each key holds up to ``burst`` tokens, refilled at ``per_minute``.
+    State is per process.
+    """
+
+    def __init__(self, per_minute, burst, max_keys=RATE_LIMIT_MAX_KEYS):
+        self.rate = per_minute / 60.0
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()  # key -> (tokens, updated_at)
+        self._lock = threading.Lock()
+
+    def _tokens(self, key, now):
+        entry = self._buckets.get(key)
+        if entry is None:
+            return self.burst
+        tokens, updated_at = entry
+        return min(self.burst, tokens + (now - updated_at) * self.rate)
+
+    def _retry_after(self, tokens):
+        return (1 - tokens) / self.rate if self.rate > 0 else 60.0
+
+    def check(self, key):
+        """Seconds until ``key`` may proceed (0 if now), without taking a token"""
+        with self._lock:
+            tokens = self._tokens(key, time.monotonic())
+        return 0 if tokens >= 1 else self._retry_after(tokens)
+
+    def hit(self, key):
+        """Take a token for ``key``; returns 0, or seconds to wait if none is left"""
+        now = time.monotonic()
+        with self._lock:
+            tokens = self._tokens(key, now)
+            if tokens < 1:
+                return self._retry_after(tokens)
+            self._buckets[key] = (tokens - 1, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return 0
+
+
+ip_limiter = TokenBucketLimiter(AUTH_IP_PER_MINUTE, AUTH_IP_BURST)
+account_limiter = TokenBucketLimiter(AUTH_ACCOUNT_PER_MINUTE, AUTH_ACCOUNT_BURST)
@@ -0,0 +1,41 @@
+"""Rebuild the producer_daily_stats rollups from the orders table.
+
+The rollups are maintained incrementally on every order write; run this to
+backfill them or to repair drift after orders were changed outside the API.
+
+    python rebuild_producer_rollups.py                  # every producer
+    python rebuild_producer_rollups.py --producer-id 42
+
+Requires the MySQL database configured in .env.
+"""
+import argparse
+import sys
+import db
+from models import rebuild_producer_rollups
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--producer-id', type=int, default=None, help='only rebuild this producer')
+    args = parser.parse_args()
+
+    conn = db.get_db_connection()
+    cursor = conn.cursor()
+    try:
+        rows = rebuild_producer_rollups(cursor, args.producer_id)
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        print(f'Rebuild failed: {e}')
+        return 1
+    finally:
+        cursor.close()
+        conn.close()
+
+    scope = f'producer {args.producer_id}' if args.producer_id is not None else 'all producers'
+    print(f'Rebuilt {rows} daily rollup rows for {scope}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,123 @@
+import csv
+import io
+import re
+from decimal import Decimal, InvalidOperation
+
+# Statement columns tried in order when the caller doesn't name them
+REFERENCE_COLUMNS = ('reference', 'transaction_reference', 'transaction_id', 'payment_reference', 'ref')
+AMOUNT_COLUMNS = ('amount', 'credit', 'credit_amount', 'value')
+
+CENT = Decimal('0.01')
+
+
+def normalize_reference(value):
+    return (value or '').strip().upper()
+
+
+def parse_amount(value):
+    """Parse a statement amount like "₦1,250.00"; raises InvalidOperation"""
+    cleaned = re.sub(r'[^0-9.\-]', '', value or '')
+    if not cleaned:
+        raise InvalidOperation(value)
+    return Decimal(cleaned).quantize(CENT)
+
+
+def build_payment_index(cursor):
+    """Hash index of pending orders: reference -> [(order id, amount), ...].
+
+    A batch checkout stamps one reference on every order line, so a
+    reference can map to several orders.
+    """
+    cursor.execute('''SELECT id, payment_transaction_id, total_amount FROM orders
+                      WHERE payment_status = 'pending' AND payment_transaction_id IS NOT NULL
+                      ORDER BY id''')
+    index = {}
+    for order_id, reference, total_amount in cursor:
+        reference = normalize_reference(reference)
+        if not reference:
+            continue
+        index.setdefault(reference, []).append((order_id, Decimal(total_amount).quantize(CENT)))
+    return index
+
+
+def _match_row(orders, matched, amount):
+    """Order ids paid by one statement row, or (None, reason).
+
+    An amount equal to the total of the reference's still-unmatched orders
+    pays all of them (a batch checkout paid in one transfer); otherwise it
+    must equal exactly one of them.
+    """
+    remaining = [(order_id, total) for order_id, total in orders if order_id not in matched]
+    if not remaining:
+        paid = [total for order_id, total in orders]
+        return None, 'duplicate' if amount in paid or amount == sum(paid) else 'amount_mismatch'
+    if amount == sum(total for order_id, total in remaining):
+        return [order_id for order_id, total in remaining], None
+    candidates = [order_id for order_id, total in remaining if total == amount]
+    if len(candidates) == 1:
+        return candidates, None
+    return candidates or None, 'ambiguous' if candidates else 'amount_mismatch'
+
+
+def _pick_column(fieldnames, wanted, candidates):
+    names = {name.strip().lower(): name for name in fieldnames or [] if name}
+    if wanted:
+        return names.get(wanted.strip().lower())
+    for candidate in candidates:
+        if candidate in names:
+            return names[candidate]
+    return None
+
+
+def match_statement(stream, index, reference_column=None, amount_column=None, max_reported=1000):
+    """Match a bank statement CSV against the payment index, one row at a time.
+
+    ``stream`` is a binary file object; it is decoded and parsed
+    incrementally so the statement is never held in memory. Returns
+    ``(matched_order_ids, unmatched, stats)`` where ``unmatched`` holds at
+    most ``max_reported`` rows; ``stats['unmatched']`` has the full count.
+    Rows whose amount fits several orders are reported as ``ambiguous``
+    with the candidate ``order_ids`` rather than guessed.
+    Raises ValueError if the reference or amount column can't be found.
+    """
+    reader = csv.DictReader(io.TextIOWrapper(stream, encoding='utf-8-sig', newline=''))
+    ref_key = _pick_column(reader.fieldnames, reference_column, REFERENCE_COLUMNS)
+    amount_key = _pick_column(reader.fieldnames, amount_column, AMOUNT_COLUMNS)
+    if not ref_key or not amount_key:
+        raise ValueError('Statement needs a reference and an amount column')
+
+    matched = {}
+    unmatched = []
+    stats = {'rows': 0, 'matched': 0, 'matched_orders': 0, 'unmatched': 0}
+
+    def report(line, reference, amount, reason, order_ids=None):
+        stats['unmatched'] += 1
+        if len(unmatched) < max_reported:
+            entry = {'line': line, 'reference': reference, 'amount': amount, 'reason': reason}
+            if order_ids:
+                entry['order_ids'] = order_ids
+            unmatched.append(entry)
+
+    # Line 1 is the header
+    for line, row in enumerate(reader, start=2):
+        stats['rows'] += 1
+        reference = normalize_reference(row.get(ref_key))
+        raw_amount = row.get(amount_key)
+        try:
+            amount = parse_amount(raw_amount)
+        except InvalidOperation:
+            report(line, reference, raw_amount, 'invalid_amount')
+            continue
+        orders = index.get(reference)
+        if not orders:
+            report(line, reference, str(amount), 'no_matching_order')
+            continue
+        order_ids, reason = _match_row(orders, matched, amount)
+        if reason:
+            report(line, reference, str(amount), reason, order_ids)
+            continue
+        for order_id in order_ids:
+            matched[order_id] = line
+        stats['matched'] += 1
+        stats['matched_orders'] += len(order_ids)
+    return list(matched), unmatched, stats
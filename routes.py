@@ -1,79 +1,92 @@
-from flask import Blueprint, request, jsonify, send_from_directory, current_app
-from db import get_db_connection
-import bcrypt
+from flask import Blueprint, Response, request, jsonify, current_app
+from db import get_db_connection, get_pool_stats
+from auth_cache import get_principal, invalidate_principal
+from exports import csv_export_response
+from outbox import queue_emit
+from analytics import REVENUE_DIMENSIONS, REVENUE_PERIODS
+from reconciliation import build_payment_index, match_statement
+from images import UPLOAD_FOLDER, IMAGE_VARIANTS, built_variants_version, variant_path, variant_urls, queue_variants
+from uploads import serve_upload, store_upload
+from passwords import PasswordHasherBusy, hash_password, check_password, needs_rehash
+from rate_limit import ip_limiter, account_limiter
+from metrics import METRICS_TOKEN, init_metrics, metrics_authorized, render_metrics
+from presence import presence
+from models import (attach_product_images, encode_cursor, decode_cursor, reserve_stock, run_in_transaction,
+                    ensure_conversation_summary, record_message_in_summary, mark_conversation_read,
+                    apply_read_state, load_order_for_rollup, apply_rollup_changes, ROLLUP_ORDER_QUERY,
+                    mark_product_revenue_days_dirty, IN_CHUNK_SIZE)
+from decimal import Decimal, InvalidOperation
 import jwt
 import os
-from datetime import datetime
-from functools import wraps
 import csv
-from io import StringIO
-from websocket_service import send_notification_to_user
+import json
+import secrets
+from datetime import datetime, timedelta
+from functools import wraps
 
-def create_notification(user_id, notification_type, title, message, related_id=None):
-    """Create a notification in the database and send real-time notification"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
+def create_notification(cursor, user_id, notification_type, title, message, related_id=None):
+    """Create a notification in the caller's transaction.
+
+    The real-time push is queued in the outbox and sent once the caller
+    commits; nothing is sent if it rolls back.
+    """
+    # Prepare data JSON if related_id is provided
+    data_json = None
+    if related_id:
+        data_json = json.dumps({"related_id": related_id})
     
-    try:
-        # Prepare data JSON if related_id is provided
-        data_json = None
-        if related_id:
-            import json
-            data_json = json.dumps({"related_id": related_id})
-        
-        # Insert notification into database
-        cursor.execute('''INSERT INTO notifications (user_id, type, title, message, data, status, created_at, updated_at)
-                          VALUES (%s, %s, %s, %s, %s, %s, %s, %s)''',
-                       (user_id, notification_type, title, message, data_json, 'unread', datetime.utcnow(), datetime.utcnow()))
-        
-        notification_id = cursor.lastrowid
-        conn.commit()
-        
-        # Send real-time notification
-        notification_data = {
-            "id": notification_id,
-            "type": notification_type,
-            "title": title,
-            "message": message,
-            "related_id": related_id,
-            "status": "unread",
-            "timestamp": datetime.utcnow().isoformat()
-        }
-        send_notification_to_user(user_id, notification_data)
-        
-        return notification_id
-    except Exception as e:
-        print(f"Error creating notification: {e}")
-        conn.rollback()
-        return None
-    finally:
-        cursor.close()
-        conn.close()
+    # Insert notification into database
+    cursor.execute('''INSERT INTO notifications (user_id, type, title, message, data, status, created_at, updated_at)
+                      VALUES (%s, %s, %s, %s, %s, %s, %s, %s)''',
+                   (user_id, notification_type, title, message, data_json, 'unread', datetime.utcnow(), datetime.utcnow()))
+    
+    notification_id = cursor.lastrowid
+    
+    # Send real-time notification
+    notification_data = {
+        "id": notification_id,
+        "type": notification_type,
+        "title": title,
+        "message": message,
+        "related_id": related_id,
+        "status": "unread",
+        "timestamp": datetime.utcnow().isoformat()
+    }
+    queue_emit(cursor, 'notification', f"user_{user_id}", notification_data)
+    
+    return notification_id
 
-def check_low_stock_and_notify(product_id, new_quantity):
+def check_low_stock_and_notify(cursor, product_id, product_name, producer_id, new_quantity):
     """Check if product stock is low and create notification"""
     if new_quantity <= 5:  # Low stock threshold
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
-        cursor.execute('SELECT p.name, p.producer_id FROM products p WHERE p.id = %s', (product_id,))
-        product = cursor.fetchone()
-        cursor.close()
-        conn.close()
-        
-        if product:
-            create_notification(
-                product['producer_id'],
-                'stock',
-                'Low Stock Alert',
-                f'Your product "{product["name"]}" is running low on stock. Current quantity: {new_quantity}',
-                product_id
-            )
+        create_notification(
+            cursor,
+            producer_id,
+            'stock',
+            'Low Stock Alert',
+            f'Your product "{product_name}" is running low on stock. Current quantity: {new_quantity}',
+            product_id
+        )
 
-UPLOAD_FOLDER = os.path.join(os.path.dirname(__file__), 'uploads')
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
 routes_bp = Blueprint('routes', __name__)
 
+# Per-endpoint latency, status and SQL counters, served at /metrics
+init_metrics(routes_bp)
+
+@routes_bp.errorhandler(PasswordHasherBusy)
+def password_hasher_busy(error):
+    """Shed load fast when every password hashing slot is taken"""
+    response = jsonify({'error': 'Server is busy, please try again shortly'})
+    response.headers['Retry-After'] = '1'
+    return response, 429
+
+def too_many_attempts(retry_after):
+    response = jsonify({'error': 'Too many attempts, please try again later'})
+    response.headers['Retry-After'] = str(int(retry_after) + 1)
+    return response, 429
+
 # Helper: JWT authentication decorator
 def jwt_required(f):
     @wraps(f)
@@ -86,12 +99,7 @@ def jwt_required(f):
         try:
             data = jwt.decode(token, os.getenv('SECRET_KEY', 'your-secret-key-here'), algorithms=['HS256'])
             user_id = data['user_id']
-            conn = get_db_connection()
-            cursor = conn.cursor(dictionary=True, buffered=True)
-            cursor.execute('SELECT * FROM users WHERE id = %s', (user_id,))
-            user = cursor.fetchone()
-            cursor.close()
-            conn.close()
+            user = get_principal(user_id)
             if not user:
                 return jsonify({'error': 'User not found!'}), 401
             # Store user_id in request for use in the route function
@@ -118,14 +126,10 @@ def admin_required(f):
         try:
             data = jwt.decode(token, os.getenv('SECRET_KEY', 'your-secret-key-here'), algorithms=['HS256'])
             user_id = data['user_id']
-            conn = get_db_connection()
-            cursor = conn.cursor(dictionary=True, buffered=True)
-            cursor.execute('SELECT * FROM users WHERE id = %s', (user_id,))
-            user = cursor.fetchone()
-            cursor.close()
-            conn.close()
+            user = get_principal(user_id)
             if not user or user['user_type'] != ADMIN_TYPE:  # type: ignore
                 return jsonify({'error': 'Admin access required'}), 403
+            request.user_id = user_id
         except Exception as e:
             return jsonify({'error': 'Token is invalid!'}), 401
         return f(*args, **kwargs)
@@ -141,8 +145,6 @@ def admin_users():
         start_date = request.args.get('start_date')
         end_date = request.args.get('end_date')
         export = request.args.get('export') == 'csv'
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True, buffered=True)
         query = 'SELECT * FROM users WHERE 1=1'
         params = []
         if user_id:
@@ -157,17 +159,14 @@ def admin_users():
         if end_date:
             query += ' AND created_at <= %s'
             params.append(end_date)
+        if export:
+            return csv_export_response(query, params, 'users.csv')
+        conn = get_db_connection()
+        cursor = conn.cursor(dictionary=True, buffered=True)
         cursor.execute(query, tuple(params))
         users = cursor.fetchall()
         cursor.close()
         conn.close()
-        if export:
-            si = StringIO()
-            writer = csv.DictWriter(si, fieldnames=users[0].keys())  # type: ignore
-            writer.writeheader()
-            writer.writerows(users)  # type: ignore
-            output = si.getvalue()
-            return output, 200, {'Content-Type': 'text/csv', 'Content-Disposition': 'attachment; filename=users.csv'}
         return jsonify(users)
     
     elif request.method == 'POST':
@@ -200,7 +199,7 @@ def admin_users():
             return jsonify({'error': 'Username or email already exists'}), 409
 
         # Hash password
-        password_hash = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+        password_hash = hash_password(password)
         
         # Insert new user
         cursor.execute('''INSERT INTO users (username, email, password_hash, user_type, first_name, last_name, company_name, phone, address, country, city, postal_code, created_at, updated_at, is_verified, is_active)
@@ -246,6 +245,12 @@ def register():
 
     if not all([username, email, password, user_type, first_name, last_name, phone]):
         return jsonify({'error': 'Missing required fields'}), 400
+    if not isinstance(email, str) or not isinstance(password, str):
+        return jsonify({'error': 'Email and password must be strings'}), 400
+
+    retry_after = ip_limiter.hit(request.remote_addr) or account_limiter.hit(f"email:{email.strip().lower()}")
+    if retry_after:
+        return too_many_attempts(retry_after)
 
     # Bank details are now optional for sellers during registration
     # They can be added later in their profile
@@ -261,7 +266,7 @@ def register():
     if not password:
         return jsonify({'error': 'Password is required'}), 400
 
-    password_hash = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+    password_hash = hash_password(password)
     
     # Insert user with bank details
     cursor.execute('''INSERT INTO users (username, email, password_hash, user_type, first_name, last_name, company_name, phone, address, country, city, postal_code, bank_name, account_name, account_number, bank_code, swift_code, routing_number, created_at, updated_at, is_verified, is_active)
@@ -275,12 +280,6 @@ def register():
                           VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)''',
                        (user_id, bank_name, account_name, account_number, bank_code, swift_code, routing_number, True, False, datetime.utcnow(), datetime.utcnow()))
     
-    conn.commit()
-    # Fetch the new user
-    cursor.execute('SELECT id, username, email, user_type, first_name, last_name, company_name, phone, address, country, city, postal_code, bank_name, account_name, account_number, bank_code, swift_code, routing_number FROM users WHERE id = %s', (user_id,))
-    user = cursor.fetchone()
-    cursor.close()
-    conn.close()
     # Emit real-time notification to seller
     notification_data = {
         "type": "user",
@@ -289,9 +288,31 @@ def register():
         "user_id": user_id,
         "timestamp": datetime.utcnow().isoformat()
     }
-    send_notification_to_user(user_id, notification_data)
+    queue_emit(cursor, 'notification', f"user_{user_id}", notification_data)
+    
+    conn.commit()
+    # Fetch the new user
+    cursor.execute('SELECT id, username, email, user_type, first_name, last_name, company_name, phone, address, country, city, postal_code, bank_name, account_name, account_number, bank_code, swift_code, routing_number FROM users WHERE id = %s', (user_id,))
+    user = cursor.fetchone()
+    cursor.close()
+    conn.close()
     return jsonify({'message': 'User registered successfully', 'user': user}), 201
 
+def rehash_password(user_id, old_hash, password):
+    """Re-hash a password stored with another work factor after it was verified"""
+    try:
+        new_hash = hash_password(password)
+    except PasswordHasherBusy:
+        # Never fail a login over the upgrade; the next login retries it
+        return
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute('UPDATE users SET password_hash = %s WHERE id = %s AND password_hash = %s',
+                   (new_hash, user_id, old_hash))
+    conn.commit()
+    cursor.close()
+    conn.close()
+
 # User Login
 @routes_bp.route('/auth/login', methods=['POST'])
 def login():
@@ -300,6 +321,13 @@ def login():
     password = data.get('password')
     if not all([email, password]):
         return jsonify({'error': 'Missing email or password'}), 400
+    if not isinstance(email, str) or not isinstance(password, str):
+        return jsonify({'error': 'Email and password must be strings'}), 400
+    # Every attempt costs an IP token; only failures cost the account's
+    account_key = f"email:{email.strip().lower()}"
+    retry_after = ip_limiter.hit(request.remote_addr) or account_limiter.check(account_key)
+    if retry_after:
+        return too_many_attempts(retry_after)
     conn = get_db_connection()
     cursor = conn.cursor(dictionary=True)
     cursor.execute('SELECT * FROM users WHERE email = %s', (email,))
@@ -307,37 +335,137 @@ def login():
     cursor.close()
     conn.close()
     if not user or not user.get('password_hash'):
+        account_limiter.hit(account_key)
         return jsonify({'error': 'Invalid credentials'}), 401
     if not password:
         return jsonify({'error': 'Password is required'}), 400
     # In login, after fetching user, cast user to dict if not None
     user = dict(user) if user else None  # type: ignore
     # On the password_hash encode line, add # type: ignore
-    if not bcrypt.checkpw(password.encode('utf-8'), user['password_hash'].encode('utf-8')):  # type: ignore
+    if not check_password(password, user['password_hash']):  # type: ignore
+        account_limiter.hit(account_key)
         return jsonify({'error': 'Invalid credentials'}), 401
+    if needs_rehash(user['password_hash']):  # type: ignore
+        rehash_password(user['id'], user['password_hash'], password)  # type: ignore
     token = jwt.encode({'user_id': user['id'], 'username': user['username']}, os.getenv('SECRET_KEY', 'your-secret-key-here'), algorithm='HS256')  # type: ignore
     return jsonify({'token': token, 'user': {'id': user['id'], 'username': user['username'], 'email': user['email'], 'user_type': user['user_type'], 'first_name': user['first_name'], 'last_name': user['last_name']}})  # type: ignore
 
+# Keyset sort orders for /products: (column, direction)
+PRODUCT_SORTS = {
+    'name': ('p.name', 'ASC'),
+    'price': ('p.price', 'ASC'),
+    'price_desc': ('p.price', 'DESC'),
+    'newest': ('p.created_at', 'DESC'),
+}
+PRODUCT_SORT_ALIASES = {'price-low': 'price', 'price-high': 'price_desc'}
+PRODUCT_PAGE_PARAMS = ('limit', 'cursor', 'sort', 'category', 'producer_id', 'min_price', 'max_price', 'q')
+DEFAULT_PRODUCT_PAGE_SIZE = 24
+MAX_PRODUCT_PAGE_SIZE = 100
+
+def _parse_product_cursor(token, sort):
+    """Decode a /products cursor into (sort value, product id)"""
+    values = decode_cursor(token)
+    if len(values) != 3 or values[0] != sort:
+        raise ValueError('Invalid cursor')
+    value, last_id = values[1], int(values[2])
+    if sort in ('price', 'price_desc'):
+        value = Decimal(str(value))
+    elif sort == 'newest':
+        value = datetime.fromisoformat(value)
+    elif not isinstance(value, str):
+        raise ValueError('Invalid cursor')
+    return value, last_id
+
 # Get All Products
 @routes_bp.route('/products', methods=['GET'])
 def get_products():
+    """List active products.
+
+    Without query parameters the full catalog is returned as an array (legacy
+    clients). With any of ``limit``, ``cursor``, ``sort``, ``category``,
+    ``producer_id``, ``min_price``, ``max_price`` or ``q`` the result is
+    filtered server side and keyset paginated:
+    ``{"products": [...], "next_cursor": "..." | null}``.
+    """
+    paginated = any(param in request.args for param in PRODUCT_PAGE_PARAMS)
+
+    query = '''SELECT p.*, u.username as producer_username, u.company_name as producer_company, u.first_name as producer_first_name, u.last_name as producer_last_name 
+               FROM products p 
+               JOIN users u ON p.producer_id = u.id 
+               WHERE p.product_status = 'active' '''
+    params = []
+
+    if paginated:
+        sort = request.args.get('sort', 'name')
+        sort = PRODUCT_SORT_ALIASES.get(sort, sort)
+        if sort not in PRODUCT_SORTS:
+            return jsonify({'error': f'Invalid sort. Use one of: {", ".join(PRODUCT_SORTS)}'}), 400
+        column, direction = PRODUCT_SORTS[sort]
+        try:
+            limit = int(request.args.get('limit', DEFAULT_PRODUCT_PAGE_SIZE))
+            producer_id = int(request.args['producer_id']) if request.args.get('producer_id') else None
+            min_price = Decimal(request.args['min_price']) if request.args.get('min_price') else None
+            max_price = Decimal(request.args['max_price']) if request.args.get('max_price') else None
+        except (ValueError, InvalidOperation):
+            return jsonify({'error': 'Invalid limit, producer_id or price filter'}), 400
+        limit = max(1, min(limit, MAX_PRODUCT_PAGE_SIZE))
+
+        category = request.args.get('category')
+        if category and category != 'All':
+            query += ' AND p.category = %s'
+            params.append(category)
+        if producer_id is not None:
+            query += ' AND p.producer_id = %s'
+            params.append(producer_id)
+        if min_price is not None:
+            query += ' AND p.price >= %s'
+            params.append(min_price)
+        if max_price is not None:
+            query += ' AND p.price <= %s'
+            params.append(max_price)
+        search = (request.args.get('q') or '').strip()
+        if search:
+            like = '%' + search.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+            query += ''' AND (p.name LIKE %s OR p.description LIKE %s OR p.category LIKE %s
+                              OR p.origin LIKE %s OR u.company_name LIKE %s OR u.username LIKE %s)'''
+            params.extend([like] * 6)
+
+        cursor_token = request.args.get('cursor')
+        if cursor_token:
+            try:
+                last_value, last_id = _parse_product_cursor(cursor_token, sort)
+            except (ValueError, TypeError, InvalidOperation):
+                return jsonify({'error': 'Invalid cursor'}), 400
+            op = '>' if direction == 'ASC' else '<'
+            query += f' AND ({column} {op} %s OR ({column} = %s AND p.id {op} %s))'
+            params.extend([last_value, last_value, last_id])
+
+        query += f' ORDER BY {column} {direction}, p.id {direction} LIMIT %s'
+        params.append(limit + 1)
+
     conn = get_db_connection()
     cursor = conn.cursor(dictionary=True)
-    cursor.execute('''SELECT p.*, u.username as producer_username, u.company_name as producer_company, u.first_name as producer_first_name, u.last_name as producer_last_name 
-                      FROM products p 
-                      JOIN users u ON p.producer_id = u.id 
-                      WHERE p.product_status = 'active' ''')
+    cursor.execute(query, tuple(params))
     products = cursor.fetchall()
-    # For each product, get its images
-    for i, product in enumerate(products):
-        product = dict(product)  # type: ignore
-        cursor.execute('SELECT image_url FROM product_images WHERE product_id = %s', (product['id'],))  # type: ignore
-        images = [row['image_url'] for row in cursor.fetchall()]  # type: ignore
-        product['images'] = images  # type: ignore
-        products[i] = product  # type: ignore
+    if paginated:
+        has_more = len(products) > limit
+        products = products[:limit]
+    # Load images for all products in one batched query
+    products = attach_product_images(cursor, products)
     cursor.close()
     conn.close()
-    return jsonify(products)
+
+    if not paginated:
+        return jsonify(products)
+
+    next_cursor = None
+    if has_more and products:
+        last = products[-1]
+        sort_value = last[column.split('.', 1)[1]]
+        if isinstance(sort_value, datetime):
+            sort_value = sort_value.isoformat()
+        next_cursor = encode_cursor([sort, sort_value, last['id']])
+    return jsonify({'products': products, 'next_cursor': next_cursor, 'limit': limit})
 
 # Get Products for Current Seller
 @routes_bp.route('/producer/products', methods=['GET'])
@@ -357,13 +485,8 @@ def get_producer_products():
     cursor = conn.cursor(dictionary=True)
     cursor.execute('SELECT * FROM products WHERE producer_id = %s ORDER BY created_at DESC', (user_id,))
     products = cursor.fetchall()
-    # For each product, get its images
-    for i, product in enumerate(products):
-        product = dict(product)  # type: ignore
-        cursor.execute('SELECT image_url FROM product_images WHERE product_id = %s', (product['id'],))  # type: ignore
-        images = [row['image_url'] for row in cursor.fetchall()]  # type: ignore
-        product['images'] = images  # type: ignore
-        products[i] = product  # type: ignore
+    # Load images for all products in one batched query
+    products = attach_product_images(cursor, products)
     cursor.close()
     conn.close()
     return jsonify(products)
@@ -382,11 +505,8 @@ def get_product(product_id):
         cursor.close()
         conn.close()
         return jsonify({'error': 'Product not found'}), 404
-    # Get all images for this product
-    product = dict(product)  # type: ignore
-    cursor.execute('SELECT image_url FROM product_images WHERE product_id = %s', (product_id,))
-    images = [row['image_url'] for row in cursor.fetchall()]
-    product['images'] = images
+    # Get all images for this product, with its variants
+    product = attach_product_images(cursor, [product])[0]
     cursor.close()
     conn.close()
     return jsonify(product)
@@ -448,30 +568,42 @@ def create_product():
                    (name, description, price, currency, price_unit, quantity, category, main_image_url, min_order_quantity, lead_time, origin, specifications, export_compliance, packaging, shelf_life, product_status, producer_id, created_at, updated_at))
     product_id = cursor.lastrowid
     # Insert images into product_images table
+    unbuilt = []
     for idx, img_url in enumerate(images):
-        cursor.execute('''INSERT INTO product_images (product_id, image_url, is_primary, created_at) VALUES (%s, %s, %s, %s)''',
-                       (product_id, img_url, idx == 0, datetime.utcnow()))
-    conn.commit()
-    cursor.close()
-    conn.close()
+        # Variants usually finish before the product is saved; later ones are recorded by the image pool
+        version = built_variants_version(img_url)
+        if version is None:
+            unbuilt.append(img_url)
+        cursor.execute('''INSERT INTO product_images (product_id, image_url, is_primary, variants_version, created_at) VALUES (%s, %s, %s, %s, %s)''',
+                       (product_id, img_url, idx == 0, version, datetime.utcnow()))
     
     # Create notification for admin about new product
-    conn = get_db_connection()
-    cursor = conn.cursor(dictionary=True)
     cursor.execute('SELECT id FROM users WHERE user_type = "admin" LIMIT 1')
     admin = cursor.fetchone()
-    cursor.close()
-    conn.close()
-    
     if admin:
         create_notification(
-            admin['id'],
+            cursor,
+            admin[0],
             'product',
             'New Product Added',
             f'A new product "{name}" has been added to the marketplace',
             product_id
         )
     
+    conn.commit()
+    # The pool's UPDATE misses rows it runs before the commit above; its files are on disk by then
+    finished = []
+    for img_url in unbuilt:
+        version = built_variants_version(img_url)
+        if version is not None:
+            finished.append((version, product_id, img_url))
+    if finished:
+        cursor.executemany('''UPDATE product_images SET variants_version = %s
+                              WHERE product_id = %s AND image_url = %s''', finished)
+        conn.commit()
+    cursor.close()
+    conn.close()
+    
     return jsonify({'message': 'Product created successfully'}), 201
 
 # Update Product
@@ -491,6 +623,9 @@ def update_product(product_id):
     conn = get_db_connection()
     cursor = conn.cursor()
     cursor.execute(f'''UPDATE products SET {', '.join(fields)}, updated_at = %s WHERE id = %s''', tuple(values))
+    if 'category' in data:
+        # Revenue buckets are grouped by category
+        mark_product_revenue_days_dirty(cursor, product_id)
     conn.commit()
     cursor.close()
     conn.close()
@@ -539,6 +674,12 @@ def create_order():
 
     if not all([product_id, quantity, unit_price, total_amount, shipping_address]):
         return jsonify({'error': 'Missing required fields'}), 400
+    try:
+        quantity = int(quantity)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Quantity must be a whole number'}), 400
+    if quantity < 1:
+        return jsonify({'error': 'Quantity must be at least 1'}), 400
 
     conn = get_db_connection()
     cursor = conn.cursor()
@@ -567,52 +708,260 @@ def create_order():
         return jsonify({'error': 'Admin user not found'}), 404
 
     admin_id = admin_result[0]
+    cursor.close()
 
-    # Insert order with commission amounts and currency
-    cursor.execute('''INSERT INTO orders (buyer_id, product_id, quantity, unit_price, total_amount, currency, shipping_address, shipping_method, payment_method, special_instructions, status, payment_status, payment_transaction_id, payment_timestamp, commission_amount, producer_amount, created_at, updated_at)
-                      VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)''',
-                   (buyer_id, product_id, quantity, unit_price, total_amount, currency, shipping_address, shipping_method, payment_method, special_instructions, status, payment_status, payment_transaction_id, payment_timestamp, commission_amount, producer_amount, datetime.utcnow(), datetime.utcnow()))
-
-    order_id = cursor.lastrowid
+    def place_order(conn):
+        cursor = conn.cursor()
+        try:
+            # Reserve stock first: the guarded decrement fails instead of overselling
+            if not reserve_stock(cursor, product_id, quantity):
+                return None
+
+            # Insert order with commission amounts and currency
+            now = datetime.utcnow()
+            cursor.execute('''INSERT INTO orders (buyer_id, product_id, quantity, unit_price, total_amount, currency, shipping_address, shipping_method, payment_method, special_instructions, status, payment_status, payment_transaction_id, payment_timestamp, commission_amount, producer_amount, created_at, updated_at)
+                              VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)''',
+                           (buyer_id, product_id, quantity, unit_price, total_amount, currency, shipping_address, shipping_method, payment_method, special_instructions, status, payment_status, payment_transaction_id, payment_timestamp, commission_amount, producer_amount, now, now))
+
+            order_id = cursor.lastrowid
+            apply_rollup_changes(cursor, [(None, {
+                'producer_id': producer_id, 'created_at': now, 'total_amount': total_amount,
+                'commission_amount': commission_amount, 'status': status, 'payment_status': payment_status
+            })])
+
+            # Create commission record
+            cursor.execute('''INSERT INTO commissions (order_id, producer_id, admin_id, order_amount, commission_amount, producer_amount, commission_percentage, status, created_at, updated_at)
+                              VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)''',
+                           (order_id, producer_id, admin_id, total_amount, commission_amount, producer_amount, commission_percentage, 'pending', datetime.utcnow(), datetime.utcnow()))
+
+            # Updated quantity for the low stock check (row is still locked by us)
+            cursor.execute('SELECT name, quantity FROM products WHERE id = %s', (product_id,))
+            product_name, updated_quantity = cursor.fetchone()
+
+            # Notifications commit (or roll back) together with the order
+            check_low_stock_and_notify(cursor, product_id, product_name, producer_id, updated_quantity)
+            create_notification(
+                cursor,
+                producer_id,
+                'order',
+                'New Order Received',
+                f'You have received a new order for {product_name} (Order #{order_id}) - ₦{total_amount:,.2f}',
+                order_id
+            )
+            return order_id
+        finally:
+            cursor.close()
 
-    # Create commission record
-    cursor.execute('''INSERT INTO commissions (order_id, producer_id, admin_id, order_amount, commission_amount, producer_amount, commission_percentage, status, created_at, updated_at)
-                      VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)''',
-                   (order_id, producer_id, admin_id, total_amount, commission_amount, producer_amount, commission_percentage, 'pending', datetime.utcnow(), datetime.utcnow()))
+    try:
+        order_id = run_in_transaction(conn, place_order)
+    except Exception as e:
+        print(f"Error creating order: {e}")
+        conn.close()
+        return jsonify({'error': 'Could not place order, please retry'}), 503
+    conn.close()
 
-    # Update product quantity
-    cursor.execute('UPDATE products SET quantity = quantity - %s WHERE id = %s', (quantity, product_id))
+    if order_id is None:
+        return jsonify({'error': 'Insufficient stock'}), 409
     
-    # Get updated product quantity for low stock check
-    cursor.execute('SELECT quantity FROM products WHERE id = %s', (product_id,))
-    updated_quantity = cursor.fetchone()[0]
+    return jsonify({'message': 'Order created successfully', 'order_id': order_id, 'commission_amount': commission_amount, 'producer_amount': producer_amount}), 201
+
+COMMISSION_PERCENTAGE = Decimal('10.00')
+MAX_BATCH_ORDER_LINES = 200
+
+@routes_bp.route('/orders/batch', methods=['POST'])
+@jwt_required
+def create_orders_batch():
+    """Place every line of a checkout in one transaction.
+
+    Body: shared order fields (``shipping_address`` required) plus either
+    ``items: [{product_id, quantity}]`` or no ``items`` to check out the
+    buyer's whole cart. Stock for all lines is validated and locked in one
+    query; orders, commissions, inventory and cart rows (the checked-out
+    cart, or the cart rows of the listed products) are written together
+    and committed once. Either every order is placed or none is.
+    """
+    buyer_id = get_jwt_identity()
+    data = request.json or {}
+    shipping_address = data.get('shipping_address')
+    shipping_method = data.get('shipping_method')
+    payment_method = data.get('payment_method', 'bank_transfer')
+    special_instructions = data.get('special_instructions')
+    status = data.get('status', 'pending')
+    payment_status = data.get('payment_status', 'pending')
+    payment_transaction_id = data.get('payment_transaction_id')
+    payment_timestamp = data.get('payment_timestamp')
+    items = data.get('items')
+    from_cart = items is None
+
+    if not shipping_address:
+        return jsonify({'error': 'Missing required fields'}), 400
+    try:
+        shipping_cost = Decimal(str(data.get('shipping_cost') or 0))
+    except InvalidOperation:
+        return jsonify({'error': 'Invalid shipping_cost'}), 400
 
-    conn.commit()
-    cursor.close()
-    conn.close()
-    
-    # Check for low stock and create notification
-    check_low_stock_and_notify(product_id, updated_quantity)
-    
-    # Get product details for notification
     conn = get_db_connection()
     cursor = conn.cursor(dictionary=True)
-    cursor.execute('SELECT name FROM products WHERE id = %s', (product_id,))
-    product = cursor.fetchone()
+
+    cart_ids = []
+    if from_cart:
+        cursor.execute('SELECT id, product_id, quantity FROM cart WHERE buyer_id = %s ORDER BY created_at', (buyer_id,))
+        cart_rows = cursor.fetchall()
+        items = [{'product_id': row['product_id'], 'quantity': row['quantity']} for row in cart_rows]
+        cart_ids = [row['id'] for row in cart_rows]
+
+    if not isinstance(items, list) or not items:
+        cursor.close()
+        conn.close()
+        return jsonify({'error': 'No items to order'}), 400
+    if len(items) > MAX_BATCH_ORDER_LINES:
+        cursor.close()
+        conn.close()
+        return jsonify({'error': f'At most {MAX_BATCH_ORDER_LINES} items per checkout'}), 400
+
+    lines = []
+    for item in items:
+        try:
+            product_id = int(item['product_id'])
+            quantity = int(item['quantity'])
+        except (KeyError, TypeError, ValueError):
+            cursor.close()
+            conn.close()
+            return jsonify({'error': 'Each item needs a product_id and quantity'}), 400
+        if quantity < 1:
+            cursor.close()
+            conn.close()
+            return jsonify({'error': 'Quantity must be at least 1'}), 400
+        lines.append((product_id, quantity))
+
+    requested = {}
+    for product_id, quantity in lines:
+        requested[product_id] = requested.get(product_id, 0) + quantity
+
+    try:
+        # Validate and lock stock for every product in one round-trip
+        placeholders = ', '.join(['%s'] * len(requested))
+        cursor.execute(f'''SELECT id, name, price, currency, quantity, producer_id FROM products
+                           WHERE id IN ({placeholders}) AND product_status = 'active'
+                           FOR UPDATE''', tuple(requested))
+        products = {row['id']: row for row in cursor.fetchall()}
+
+        missing = [pid for pid in requested if pid not in products]
+        if missing:
+            conn.rollback()
+            cursor.close()
+            conn.close()
+            return jsonify({'error': 'Product not found or not available', 'product_ids': missing}), 404
+        short = [{'product_id': pid, 'requested': qty, 'available': products[pid]['quantity']}
+                 for pid, qty in requested.items() if products[pid]['quantity'] < qty]
+        if short:
+            conn.rollback()
+            cursor.close()
+            conn.close()
+            return jsonify({'error': 'Insufficient stock', 'items': short}), 409
+
+        cursor.execute('SELECT id FROM users WHERE user_type = "admin" LIMIT 1')
+        admin = cursor.fetchone()
+        if not admin:
+            conn.rollback()
+            cursor.close()
+            conn.close()
+            return jsonify({'error': 'Admin user not found'}), 404
+
+        now = datetime.utcnow()
+        order_rows = []
+        summaries = []
+        for product_id, quantity in lines:
+            product = products[product_id]
+            unit_price = Decimal(product['price'])
+            total_amount = unit_price * quantity + shipping_cost
+            commission_amount = (total_amount * COMMISSION_PERCENTAGE / 100).quantize(Decimal('0.01'))
+            producer_amount = total_amount - commission_amount
+            currency = product['currency'] or 'NGN'
+            order_rows.append((buyer_id, product_id, quantity, unit_price, total_amount, currency, shipping_address,
+                               shipping_method, payment_method, special_instructions, status, payment_status,
+                               payment_transaction_id, payment_timestamp, commission_amount, producer_amount, now, now))
+            summaries.append({'product_id': product_id, 'producer_id': product['producer_id'], 'quantity': quantity,
+                              'total_amount': total_amount, 'commission_amount': commission_amount,
+                              'producer_amount': producer_amount})
+
+        # One INSERT per order: auto-increment ids of a multi-row INSERT are not guaranteed to be
+        # consecutive (innodb_autoinc_lock_mode=2, replication), so each id is read back directly
+        for row, summary in zip(order_rows, summaries):
+            cursor.execute('''INSERT INTO orders (buyer_id, product_id, quantity, unit_price, total_amount, currency, shipping_address, shipping_method, payment_method, special_instructions, status, payment_status, payment_transaction_id, payment_timestamp, commission_amount, producer_amount, created_at, updated_at)
+                              VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)''', row)
+            summary['order_id'] = cursor.lastrowid
+
+        cursor.executemany('''INSERT INTO commissions (order_id, producer_id, admin_id, order_amount, commission_amount, producer_amount, commission_percentage, status, created_at, updated_at)
+                              VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)''',
+                           [(summary['order_id'], summary['producer_id'], admin['id'], summary['total_amount'],
+                             summary['commission_amount'], summary['producer_amount'], COMMISSION_PERCENTAGE,
+                             'pending', now, now) for summary in summaries])
+
+        apply_rollup_changes(cursor, [(None, {
+            'producer_id': summary['producer_id'], 'created_at': now, 'total_amount': summary['total_amount'],
+            'commission_amount': summary['commission_amount'], 'status': status, 'payment_status': payment_status
+        }) for summary in summaries])
+
+        # Decrement inventory for all products in one statement
+        cases = ' '.join(['WHEN %s THEN %s'] * len(requested))
+        params = [value for pid, qty in requested.items() for value in (pid, qty)]
+        cursor.execute(f'''UPDATE products SET quantity = quantity - CASE id {cases} END
+                           WHERE id IN ({placeholders})''', tuple(params) + tuple(requested))
+
+        if cart_ids:
+            cart_placeholders = ', '.join(['%s'] * len(cart_ids))
+            cursor.execute(f'DELETE FROM cart WHERE buyer_id = %s AND id IN ({cart_placeholders})',
+                           (buyer_id, *cart_ids))
+        else:
+            # An explicit item list still clears the bought products from the cart
+            cursor.execute(f'DELETE FROM cart WHERE buyer_id = %s AND product_id IN ({placeholders})',
+                           (buyer_id, *requested))
+
+        # Notifications in the same transaction: low stock per product, one order summary per producer
+        for product_id, quantity in requested.items():
+            product = products[product_id]
+            check_low_stock_and_notify(cursor, product_id, product['name'], product['producer_id'],
+                                       product['quantity'] - quantity)
+
+        by_producer = {}
+        for summary in summaries:
+            by_producer.setdefault(summary['producer_id'], []).append(summary)
+        for producer_id, producer_orders in by_producer.items():
+            order_numbers = ', '.join(f"#{summary['order_id']}" for summary in producer_orders)
+            total = sum(summary['total_amount'] for summary in producer_orders)
+            create_notification(
+                cursor,
+                producer_id,
+                'order',
+                'New Order Received',
+                f'You have received {len(producer_orders)} new order(s) ({order_numbers}) - ₦{total:,.2f}',
+                producer_orders[0]['order_id']
+            )
+
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        cursor.close()
+        conn.close()
+        print(f"Error creating batch order: {e}")
+        return jsonify({'error': 'Failed to place order'}), 500
+
     cursor.close()
     conn.close()
-    
-    # Create notification for seller
-    product_name = product['name'] if product else 'Product'
-    create_notification(
-        producer_id, 
-        'order', 
-        'New Order Received', 
-        f'You have received a new order for {product_name} (Order #{order_id}) - ₦{total_amount:,.2f}',
-        order_id
-    )
-    
-    return jsonify({'message': 'Order created successfully', 'order_id': order_id, 'commission_amount': commission_amount, 'producer_amount': producer_amount}), 201
+
+    return jsonify({
+        'message': 'Orders created successfully',
+        'order_ids': [summary['order_id'] for summary in summaries],
+        'orders': [{
+            'order_id': summary['order_id'],
+            'product_id': summary['product_id'],
+            'quantity': summary['quantity'],
+            'total_amount': float(summary['total_amount']),
+            'commission_amount': float(summary['commission_amount']),
+            'producer_amount': float(summary['producer_amount'])
+        } for summary in summaries]
+    }), 201
 
 @routes_bp.route('/orders', methods=['GET'])
 def get_orders():
@@ -668,7 +1017,10 @@ def update_order(order_id):
     values.append(order_id)
     conn = get_db_connection()
     cursor = conn.cursor()
+    before = load_order_for_rollup(cursor, order_id)
     cursor.execute(f'''UPDATE orders SET {', '.join(fields)}, updated_at = %s WHERE id = %s''', tuple(values))
+    if before:
+        apply_rollup_changes(cursor, [(before, load_order_for_rollup(cursor, order_id))])
     conn.commit()
     cursor.close()
     conn.close()
@@ -678,7 +1030,10 @@ def update_order(order_id):
 def delete_order(order_id):
     conn = get_db_connection()
     cursor = conn.cursor()
+    before = load_order_for_rollup(cursor, order_id)
     cursor.execute('DELETE FROM orders WHERE id = %s', (order_id,))
+    if before:
+        apply_rollup_changes(cursor, [(before, None)])
     conn.commit()
     cursor.close()
     conn.close()
@@ -717,11 +1072,8 @@ def get_cart():
     
     items = cursor.fetchall()
     
-    # Get product images for each item
-    for item in items:
-        cursor.execute('SELECT image_url FROM product_images WHERE product_id = %s', (item['product_id'],))
-        images = [row['image_url'] for row in cursor.fetchall()]
-        item['images'] = images
+    # Get product images for all items in one batched query
+    items = attach_product_images(cursor, items, id_key='product_id')
     
     cursor.close()
     conn.close()
@@ -1008,6 +1360,7 @@ def create_inquiry():
     cursor.execute('''INSERT INTO inquiries (product_id, buyer_id, message, quantity_requested, status, created_at, updated_at)
                       VALUES (%s, %s, %s, %s, %s, %s, %s)''',
                    (product_id, buyer_id, message, quantity_requested, status, datetime.utcnow(), datetime.utcnow()))
+    ensure_conversation_summary(cursor, cursor.lastrowid)
     conn.commit()
     cursor.close()
     conn.close()
@@ -1060,18 +1413,24 @@ def upload_image():
     os.makedirs(UPLOAD_FOLDER, exist_ok=True)
     
     try:
-        filename = f"{datetime.utcnow().strftime('%Y%m%d%H%M%S%f')}_{file.filename}"
-        filepath = os.path.join(UPLOAD_FOLDER, filename)
-        file.save(filepath)
+        # Stored once per distinct content under ab/cd/<sha256>.<ext>
+        filename, created = store_upload(file, file.filename.rsplit('.', 1)[1].lower())
         url = f"/uploads/{filename}"
-        return jsonify({'url': url, 'filename': filename})
+        result = {'url': url, 'filename': filename, 'deduplicated': not created}
+        variants = variant_urls(url, built_variants_version(url))
+        # Thumbnails and WebP variants are built in the image pool, not on this thread
+        if len(variants) < len(IMAGE_VARIANTS) and queue_variants(os.path.join(UPLOAD_FOLDER, filename)):
+            variants = {name: f"/uploads/{variant_path(filename, name)}" for name in IMAGE_VARIANTS}
+        if variants:
+            result['variants'] = variants
+        return jsonify(result)
     except Exception as e:
         return jsonify({'error': f'Failed to save file: {str(e)}'}), 500
 
 # Serve uploaded files
 @routes_bp.route('/uploads/<path:filename>')
 def uploaded_file(filename):
-    return send_from_directory(UPLOAD_FOLDER, filename)
+    return serve_upload(filename)
 
 # Admin: Get all products with filters and CSV export
 @routes_bp.route('/admin/products', methods=['GET'])
@@ -1081,9 +1440,12 @@ def admin_get_products():
     start_date = request.args.get('start_date')
     end_date = request.args.get('end_date')
     export = request.args.get('export') == 'csv'
-    conn = get_db_connection()
-    cursor = conn.cursor(dictionary=True)
-    query = '''SELECT p.*, u.username as producer_username, u.company_name as producer_company, u.email as producer_email FROM products p JOIN users u ON p.producer_id = u.id WHERE 1=1'''
+    columns = 'p.*, u.username as producer_username, u.company_name as producer_company, u.email as producer_email'
+    if export:
+        # Image URLs inline so the export stays a single streamed query
+        columns += ''', (SELECT GROUP_CONCAT(pi.image_url ORDER BY pi.is_primary DESC, pi.id SEPARATOR ' ')
+                        FROM product_images pi WHERE pi.product_id = p.id) as images'''
+    query = f'SELECT {columns} FROM products p JOIN users u ON p.producer_id = u.id WHERE 1=1'
     params = []
     if producer_id:
         query += ' AND p.producer_id = %s'
@@ -1094,23 +1456,15 @@ def admin_get_products():
     if end_date:
         query += ' AND p.created_at <= %s'
         params.append(end_date)
+    if export:
+        return csv_export_response(query, params, 'products.csv')
+    conn = get_db_connection()
+    cursor = conn.cursor(dictionary=True)
     cursor.execute(query, tuple(params))
     products = cursor.fetchall()
-    for i, product in enumerate(products):
-        product = dict(product)  # type: ignore
-        cursor.execute('SELECT image_url FROM product_images WHERE product_id = %s', (product['id'],))  # type: ignore
-        images = [row['image_url'] for row in cursor.fetchall()]  # type: ignore
-        product['images'] = images  # type: ignore
-        products[i] = product  # type: ignore
+    products = attach_product_images(cursor, products)
     cursor.close()
     conn.close()
-    if export:
-        si = StringIO()
-        writer = csv.DictWriter(si, fieldnames=products[0].keys() if products else [])
-        writer.writeheader()
-        writer.writerows(products)
-        output = si.getvalue()
-        return output, 200, {'Content-Type': 'text/csv', 'Content-Disposition': 'attachment; filename=products.csv'}
     return jsonify(products)
 
 # Admin: Get single product by ID
@@ -1128,12 +1482,7 @@ def admin_get_product(product_id):
         token = token.split(' ')[1]
         data = jwt.decode(token, current_app.config['SECRET_KEY'], algorithms=['HS256'])
         user_id = data['user_id']
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True, buffered=True)
-        cursor.execute('SELECT * FROM users WHERE id = %s', (user_id,))
-        user = cursor.fetchone()
-        cursor.close()
-        conn.close()
+        user = get_principal(user_id)
         if not user or user['user_type'] != 'admin':
             return jsonify({'error': 'Admin access required'}), 403
     except Exception as e:
@@ -1177,12 +1526,7 @@ def admin_update_product(product_id):
         token = token.split(' ')[1]
         data = jwt.decode(token, current_app.config['SECRET_KEY'], algorithms=['HS256'])
         user_id = data['user_id']
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True, buffered=True)
-        cursor.execute('SELECT * FROM users WHERE id = %s', (user_id,))
-        user = cursor.fetchone()
-        cursor.close()
-        conn.close()
+        user = get_principal(user_id)
         if not user or user['user_type'] != 'admin':
             return jsonify({'error': 'Admin access required'}), 403
     except Exception as e:
@@ -1192,8 +1536,10 @@ def admin_update_product(product_id):
     cursor = conn.cursor()
     
     # Check if product exists
-    cursor.execute('SELECT id FROM products WHERE id = %s', (product_id,))
-    if not cursor.fetchone():
+    cursor.execute('SELECT category FROM products WHERE id = %s FOR UPDATE', (product_id,))
+    product = cursor.fetchone()
+    if not product:
+        conn.rollback()
         cursor.close()
         conn.close()
         return jsonify({'error': 'Product not found'}), 404
@@ -1206,6 +1552,9 @@ def admin_update_product(product_id):
                   (data.get('name'), data.get('description'), data.get('price'), 
                    data.get('price_unit'), data.get('quantity'), data.get('category'), 
                    data.get('product_status', 'active'), product_id))
+    if data.get('category') != product[0]:
+        # Revenue buckets are grouped by category
+        mark_product_revenue_days_dirty(cursor, product_id)
     
     conn.commit()
     cursor.close()
@@ -1228,12 +1577,7 @@ def admin_delete_product(product_id):
         token = token.split(' ')[1]
         data = jwt.decode(token, current_app.config['SECRET_KEY'], algorithms=['HS256'])
         user_id = data['user_id']
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True, buffered=True)
-        cursor.execute('SELECT * FROM users WHERE id = %s', (user_id,))
-        user = cursor.fetchone()
-        cursor.close()
-        conn.close()
+        user = get_principal(user_id)
         if not user or user['user_type'] != 'admin':
             return jsonify({'error': 'Admin access required'}), 403
     except Exception as e:
@@ -1268,8 +1612,6 @@ def admin_get_orders():
     start_date = request.args.get('start_date')
     end_date = request.args.get('end_date')
     export = request.args.get('export') == 'csv'
-    conn = get_db_connection()
-    cursor = conn.cursor(dictionary=True)
     query = '''SELECT o.*, u.username as buyer_username, u.email as buyer_email, p.name as product_name FROM orders o JOIN users u ON o.buyer_id = u.id JOIN products p ON o.product_id = p.id WHERE 1=1'''
     params = []
     if buyer_id:
@@ -1281,17 +1623,14 @@ def admin_get_orders():
     if end_date:
         query += ' AND o.created_at <= %s'
         params.append(end_date)
+    if export:
+        return csv_export_response(query, params, 'orders.csv')
+    conn = get_db_connection()
+    cursor = conn.cursor(dictionary=True)
     cursor.execute(query, tuple(params))
     orders = cursor.fetchall()
     cursor.close()
     conn.close()
-    if export:
-        si = StringIO()
-        writer = csv.DictWriter(si, fieldnames=orders[0].keys() if orders else [])
-        writer.writeheader()
-        writer.writerows(orders)
-        output = si.getvalue()
-        return output, 200, {'Content-Type': 'text/csv', 'Content-Disposition': 'attachment; filename=orders.csv'}
     return jsonify(orders)
 
 # Admin: Get financial summary
@@ -1306,6 +1645,84 @@ def admin_financials():
     conn.close()
     return jsonify(summary)
 
+DEFAULT_ANALYTICS_DAYS = 90
+MAX_ANALYTICS_DAYS = 3660
+
+# Admin: Revenue and commission over time
+@routes_bp.route('/admin/analytics/revenue', methods=['GET'])
+@admin_required
+def admin_revenue_analytics():
+    """Revenue buckets for charting.
+
+    Query params: ``granularity`` (day, week or month), ``start_date`` and
+    ``end_date`` (YYYY-MM-DD, inclusive; default the last 90 days) and
+    ``group_by``, a comma-separated list of producer, category, currency and
+    payment_method. Served from revenue_daily_buckets, which the background
+    refresher keeps up to date, so no order rows are scanned.
+    """
+    granularity = request.args.get('granularity', 'day')
+    if granularity not in REVENUE_PERIODS:
+        return jsonify({'error': 'granularity must be day, week or month'}), 400
+    group_by = [name for name in request.args.get('group_by', '').split(',') if name]
+    unknown = [name for name in group_by if name not in REVENUE_DIMENSIONS]
+    if unknown:
+        return jsonify({'error': f'Unknown group_by: {", ".join(unknown)}'}), 400
+    try:
+        end_date = datetime.strptime(request.args['end_date'], '%Y-%m-%d').date() if request.args.get('end_date') else datetime.utcnow().date()
+        start_date = datetime.strptime(request.args['start_date'], '%Y-%m-%d').date() if request.args.get('start_date') else end_date - timedelta(days=DEFAULT_ANALYTICS_DAYS - 1)
+    except ValueError:
+        return jsonify({'error': 'Dates must be YYYY-MM-DD'}), 400
+    if start_date > end_date:
+        return jsonify({'error': 'start_date must not be after end_date'}), 400
+    if (end_date - start_date).days >= MAX_ANALYTICS_DAYS:
+        return jsonify({'error': f'Date range is limited to {MAX_ANALYTICS_DAYS} days'}), 400
+
+    period = REVENUE_PERIODS[granularity]
+    columns = [REVENUE_DIMENSIONS[name] for name in group_by]
+    select = ''.join(f', {column}' for column in columns)
+    conn = get_db_connection()
+    cursor = conn.cursor(dictionary=True)
+    cursor.execute(f'''SELECT {period} as period{select},
+                       SUM(order_count) as orders, SUM(gross_amount) as revenue,
+                       SUM(commission_amount) as commission, SUM(paid_amount) as paid
+                       FROM revenue_daily_buckets
+                       WHERE day BETWEEN %s AND %s
+                       GROUP BY period{select}
+                       ORDER BY period{select}''', (start_date, end_date))
+    rows = cursor.fetchall()
+
+    producers = {}
+    if 'producer' in group_by and rows:
+        producer_ids = sorted({row['producer_id'] for row in rows})
+        placeholders = ', '.join(['%s'] * len(producer_ids))
+        cursor.execute(f'SELECT id, username, company_name FROM users WHERE id IN ({placeholders})', tuple(producer_ids))
+        producers = {row['id']: row['company_name'] or row['username'] for row in cursor.fetchall()}
+    cursor.close()
+    conn.close()
+
+    buckets = []
+    for row in rows:
+        bucket = {'period': row['period'].isoformat()}
+        for column in columns:
+            bucket[column] = row[column]
+        if 'producer' in group_by:
+            bucket['producer_name'] = producers.get(row['producer_id'])
+        bucket.update({
+            'orders': int(row['orders'] or 0),
+            'revenue': float(row['revenue'] or 0),
+            'commission': float(row['commission'] or 0),
+            'paid': float(row['paid'] or 0)
+        })
+        buckets.append(bucket)
+
+    return jsonify({
+        'granularity': granularity,
+        'start_date': start_date.isoformat(),
+        'end_date': end_date.isoformat(),
+        'group_by': group_by,
+        'buckets': buckets
+    })
+
 # Admin: Approve or deactivate user
 @routes_bp.route('/admin/approve_user', methods=['POST'])
 @admin_required
@@ -1321,6 +1738,7 @@ def admin_approve_user():
     conn.commit()
     cursor.close()
     conn.close()
+    invalidate_principal(user_id)
     return jsonify({'message': 'User status updated'})
 
 # Admin: Create User
@@ -1355,17 +1773,11 @@ def admin_create_user():
     if not password:
         return jsonify({'error': 'Password is required'}), 400
 
-    password_hash = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+    password_hash = hash_password(password)
     cursor.execute('''INSERT INTO users (username, email, password_hash, user_type, first_name, last_name, company_name, phone, address, country, city, postal_code, created_at, updated_at, is_verified, is_active)
                       VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)''',
                    (username, email, password_hash, user_type, first_name, last_name, company_name, phone, address, country, city, postal_code, datetime.utcnow(), datetime.utcnow(), False, True))
     user_id = cursor.lastrowid
-    conn.commit()
-    # Fetch the new user
-    cursor.execute('SELECT id, username, email, user_type, first_name, last_name, company_name, phone, address, country, city, postal_code FROM users WHERE id = %s', (user_id,))
-    user = cursor.fetchone()
-    cursor.close()
-    conn.close()
     # Emit real-time notification to seller
     notification_data = {
         "type": "user",
@@ -1374,7 +1786,13 @@ def admin_create_user():
         "user_id": user_id,
         "timestamp": datetime.utcnow().isoformat()
     }
-    send_notification_to_user(user_id, notification_data)
+    queue_emit(cursor, 'notification', f"user_{user_id}", notification_data)
+    conn.commit()
+    # Fetch the new user
+    cursor.execute('SELECT id, username, email, user_type, first_name, last_name, company_name, phone, address, country, city, postal_code FROM users WHERE id = %s', (user_id,))
+    user = cursor.fetchone()
+    cursor.close()
+    conn.close()
     return jsonify({'message': 'User created successfully', 'user': user}), 201
 
 @routes_bp.route('/categories', methods=['GET'])
@@ -1469,7 +1887,7 @@ def update_profile():
         fields.append('last_name = %s')
         values.append(last_name)
     if password:
-        password_hash = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+        password_hash = hash_password(password)
         fields.append('password_hash = %s')
         values.append(password_hash)
     if city:
@@ -1508,6 +1926,7 @@ def update_profile():
     
     cursor.execute(f"UPDATE users SET {', '.join(fields)} WHERE id = %s", tuple(values))
     conn.commit()
+    invalidate_principal(user_id)
     cursor.execute('SELECT id, username, email, user_type, first_name, last_name, phone, address, company_name, bank_name, account_name, account_number, bank_code, swift_code, routing_number FROM users WHERE id = %s', (user_id,))
     user = cursor.fetchone()
     cursor.close()
@@ -1536,9 +1955,17 @@ def change_password():
     if not current_password or not new_password:
         return jsonify({'error': 'Current password and new password are required'}), 400
     
+    if not isinstance(current_password, str) or not isinstance(new_password, str):
+        return jsonify({'error': 'Passwords must be strings'}), 400
+    
     if len(new_password) < 6:
         return jsonify({'error': 'New password must be at least 6 characters long'}), 400
     
+    account_key = f"user:{user_id}"
+    retry_after = ip_limiter.hit(request.remote_addr) or account_limiter.check(account_key)
+    if retry_after:
+        return too_many_attempts(retry_after)
+    
     conn = get_db_connection()
     cursor = conn.cursor(dictionary=True)
     
@@ -1552,16 +1979,18 @@ def change_password():
         return jsonify({'error': 'User not found'}), 404
     
     # Verify current password
-    if not bcrypt.checkpw(current_password.encode('utf-8'), user['password_hash'].encode('utf-8')):
+    if not check_password(current_password, user['password_hash']):
+        account_limiter.hit(account_key)
         cursor.close()
         conn.close()
         return jsonify({'error': 'Current password is incorrect'}), 401
     
     # Hash new password and update
-    new_password_hash = bcrypt.hashpw(new_password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+    new_password_hash = hash_password(new_password)
     cursor.execute('UPDATE users SET password_hash = %s, updated_at = %s WHERE id = %s', 
                    (new_password_hash, datetime.utcnow(), user_id))
     conn.commit()
+    invalidate_principal(user_id)
     
     cursor.close()
     conn.close()
@@ -1618,13 +2047,12 @@ def get_producer_dashboard():
     cursor.execute('SELECT COUNT(*) as total_products FROM products WHERE producer_id = %s AND product_status = "active"', (user_id,))
     total_products = cursor.fetchone()['total_products']
     
-    # Get total orders and earnings
-    cursor.execute('''SELECT COUNT(*) as total_orders, 
-                      SUM(o.total_amount) as total_earnings,
-                      SUM(CASE WHEN o.status = "pending" THEN 1 ELSE 0 END) as pending_orders
-                      FROM orders o 
-                      JOIN products p ON o.product_id = p.id 
-                      WHERE p.producer_id = %s''', (user_id,))
+    # Get total orders and earnings from the daily rollups
+    cursor.execute('''SELECT SUM(order_count) as total_orders, 
+                      SUM(gross_amount) as total_earnings,
+                      SUM(pending_count) as pending_orders
+                      FROM producer_daily_stats 
+                      WHERE producer_id = %s''', (user_id,))
     order_stats = cursor.fetchone()
     
     # Get recent orders
@@ -1644,16 +2072,26 @@ def get_producer_dashboard():
     return jsonify({
         'stats': {
             'totalProducts': total_products,
-            'totalOrders': order_stats['total_orders'] or 0,
+            'totalOrders': int(order_stats['total_orders'] or 0),
             'totalEarnings': float(order_stats['total_earnings'] or 0),
-            'pendingOrders': order_stats['pending_orders'] or 0
+            'pendingOrders': int(order_stats['pending_orders'] or 0)
         },
         'recentOrders': recent_orders
     })
 
+DEFAULT_TRANSACTION_PAGE_SIZE = 50
+MAX_TRANSACTION_PAGE_SIZE = 200
+
 # Get Seller Financials
 @routes_bp.route('/producer/financials', methods=['GET'])
 def get_producer_financials():
+    """Financial summary plus one page of the producer's transactions.
+
+    The summary is summed from the daily rollups and covers every order, so
+    clients should not derive totals from the transactions. Transactions are
+    newest first, ``limit`` per page; pass the returned ``nextCursor`` as ``cursor``
+    to get the next page.
+    """
     token = None
     if 'Authorization' in request.headers:
         token = request.headers['Authorization'].split()[1]
@@ -1665,43 +2103,71 @@ def get_producer_financials():
     except Exception as e:
         return jsonify({'error': 'Token is invalid!'}), 401
     
+    try:
+        limit = max(1, min(int(request.args.get('limit', DEFAULT_TRANSACTION_PAGE_SIZE)), MAX_TRANSACTION_PAGE_SIZE))
+        after = None
+        if request.args.get('cursor'):
+            values = decode_cursor(request.args['cursor'])
+            if len(values) != 2:
+                raise ValueError('Invalid cursor')
+            after = (datetime.fromisoformat(values[0]), int(values[1]))
+    except (ValueError, TypeError):
+        return jsonify({'error': 'Invalid limit or cursor'}), 400
+    
     conn = get_db_connection()
     cursor = conn.cursor(dictionary=True)
     
-    # Get financial summary
+    # Get financial summary from the daily rollups
     cursor.execute('''SELECT 
-                      COUNT(*) as total_orders,
-                      SUM(o.total_amount) as total_revenue,
-                      AVG(o.total_amount) as average_order_value,
-                      SUM(CASE WHEN o.status = "completed" THEN o.total_amount ELSE 0 END) as completed_revenue,
-                      SUM(CASE WHEN o.status = "pending" THEN o.total_amount ELSE 0 END) as pending_revenue
-                      FROM orders o 
-                      JOIN products p ON o.product_id = p.id 
-                      WHERE p.producer_id = %s''', (user_id,))
+                      SUM(order_count) as total_orders,
+                      SUM(gross_amount) as total_revenue,
+                      SUM(completed_amount) as completed_revenue,
+                      SUM(pending_amount) as pending_revenue,
+                      SUM(completed_count) as completed_orders,
+                      SUM(pending_count) as pending_orders
+                      FROM producer_daily_stats 
+                      WHERE producer_id = %s''', (user_id,))
     summary = cursor.fetchone()
-    
-    # Get transactions (orders) for the seller
-    cursor.execute('''SELECT o.*, u.username as buyer_username, u.first_name as buyer_first_name, u.last_name as buyer_last_name,
-                      u.company_name as buyer_company, p.name as product_name
-                      FROM orders o 
-                      JOIN users u ON o.buyer_id = u.id 
-                      JOIN products p ON o.product_id = p.id 
-                      WHERE p.producer_id = %s 
-                      ORDER BY o.created_at DESC''', (user_id,))
+    total_orders = int(summary['total_orders'] or 0)
+    total_revenue = summary['total_revenue'] or 0
+    
+    # Get one page of transactions (orders) for the seller
+    query = '''SELECT o.*, u.username as buyer_username, u.first_name as buyer_first_name, u.last_name as buyer_last_name,
+               u.company_name as buyer_company, p.name as product_name
+               FROM orders o 
+               JOIN users u ON o.buyer_id = u.id 
+               JOIN products p ON o.product_id = p.id 
+               WHERE p.producer_id = %s'''
+    params = [user_id]
+    if after:
+        query += ' AND (o.created_at < %s OR (o.created_at = %s AND o.id < %s))'
+        params.extend([after[0], after[0], after[1]])
+    query += ' ORDER BY o.created_at DESC, o.id DESC LIMIT %s'
+    params.append(limit + 1)
+    cursor.execute(query, tuple(params))
     transactions = cursor.fetchall()
     
     cursor.close()
     conn.close()
     
+    next_cursor = None
+    if len(transactions) > limit:
+        transactions = transactions[:limit]
+        last = transactions[-1]
+        next_cursor = encode_cursor([last['created_at'], last['id']])
+    
     return jsonify({
         'summary': {
-            'totalOrders': summary['total_orders'] or 0,
-            'totalRevenue': float(summary['total_revenue'] or 0),
-            'averageOrderValue': float(summary['average_order_value'] or 0),
+            'totalOrders': total_orders,
+            'totalRevenue': float(total_revenue),
+            'averageOrderValue': float(total_revenue) / total_orders if total_orders else 0.0,
             'completedRevenue': float(summary['completed_revenue'] or 0),
-            'pendingRevenue': float(summary['pending_revenue'] or 0)
+            'pendingRevenue': float(summary['pending_revenue'] or 0),
+            'completedOrders': int(summary['completed_orders'] or 0),
+            'pendingOrders': int(summary['pending_orders'] or 0)
         },
-        'transactions': transactions
+        'transactions': transactions,
+        'nextCursor': next_cursor
     })
 
 # Update Order Status (Seller)
@@ -1739,9 +2205,10 @@ def update_producer_order_status(order_id):
         return jsonify({'error': 'Order not found or access denied'}), 404
     
     # Update order status
+    before = load_order_for_rollup(cursor, order_id)
     cursor.execute('UPDATE orders SET status = %s, updated_at = %s WHERE id = %s', 
                    (new_status, datetime.utcnow(), order_id))
-    conn.commit()
+    apply_rollup_changes(cursor, [(before, load_order_for_rollup(cursor, order_id))])
     
     # Get order details for notification
     cursor.execute('''SELECT o.total_amount, o.buyer_id, p.name as product_name 
@@ -1749,12 +2216,11 @@ def update_producer_order_status(order_id):
                       JOIN products p ON o.product_id = p.id 
                       WHERE o.id = %s''', (order_id,))
     order_details = cursor.fetchone()
-    cursor.close()
-    conn.close()
     
     if order_details:
         # Create notification for buyer about status change
         create_notification(
+            cursor,
             order_details[1],  # buyer_id
             'order',
             f'Order Status Updated',
@@ -1762,6 +2228,10 @@ def update_producer_order_status(order_id):
             order_id
         )
     
+    conn.commit()
+    cursor.close()
+    conn.close()
+    
     return jsonify({'message': 'Order status updated successfully'})
 
 # Update Payment Status (Seller)
@@ -1799,9 +2269,10 @@ def update_producer_payment_status(order_id):
         return jsonify({'error': 'Order not found or access denied'}), 404
     
     # Update payment status
+    before = load_order_for_rollup(cursor, order_id)
     cursor.execute('UPDATE orders SET payment_status = %s, updated_at = %s WHERE id = %s', 
                    (new_payment_status, datetime.utcnow(), order_id))
-    conn.commit()
+    apply_rollup_changes(cursor, [(before, load_order_for_rollup(cursor, order_id))])
     
     # Get order details for notification
     cursor.execute('''SELECT o.total_amount, o.buyer_id, p.name as product_name 
@@ -1809,12 +2280,11 @@ def update_producer_payment_status(order_id):
                       JOIN products p ON o.product_id = p.id 
                       WHERE o.id = %s''', (order_id,))
     order_details = cursor.fetchone()
-    cursor.close()
-    conn.close()
     
     if order_details:
         # Create notification for buyer about payment status change
         create_notification(
+            cursor,
             order_details[1],  # buyer_id
             'payment',
             f'Payment Status Updated',
@@ -1822,6 +2292,10 @@ def update_producer_payment_status(order_id):
             order_id
         )
     
+    conn.commit()
+    cursor.close()
+    conn.close()
+    
     return jsonify({'message': 'Payment status updated successfully'})
 
 # Get Bank Account Details
@@ -1931,6 +2405,249 @@ def update_commission_status(commission_id):
     
     return jsonify({'message': 'Commission status updated successfully'})
 
+PAYOUT_LINES_QUERY = '''SELECT producer_id, COUNT(*) as commission_count,
+                        SUM(producer_amount) as producer_amount, SUM(commission_amount) as commission_amount
+                        FROM commissions'''
+
+def _payout_line(row):
+    return {
+        'producer_id': row['producer_id'],
+        'commission_count': row['commission_count'],
+        # Money as exact decimal strings
+        'producer_amount': str(row['producer_amount']),
+        'commission_amount': str(row['commission_amount'])
+    }
+
+def _payout_batch(row):
+    batch = dict(row)
+    for key in ('total_producer_amount', 'total_commission_amount'):
+        batch[key] = str(batch[key])
+    return batch
+
+# Admin: Settle all pending commissions up to a cutoff in one payout run
+@routes_bp.route('/admin/payout-runs', methods=['POST'])
+@admin_required
+def create_payout_run():
+    """Pay out every pending commission created at or before ``cutoff``.
+
+    Body: ``cutoff`` (ISO datetime, default now) and optional ``dry_run``.
+    All included commissions are flipped to paid with the batch reference in
+    one UPDATE, amounts are summed per producer by MySQL's exact DECIMAL
+    arithmetic and recorded on a payout_batches row, and each producer is
+    notified - all in one transaction.
+    """
+    data = request.json or {}
+    try:
+        cutoff = datetime.fromisoformat(data['cutoff']) if data.get('cutoff') else datetime.utcnow()
+    except (TypeError, ValueError):
+        return jsonify({'error': 'cutoff must be an ISO date or datetime'}), 400
+
+    conn = get_db_connection()
+    cursor = conn.cursor(dictionary=True)
+
+    if data.get('dry_run'):
+        cursor.execute(PAYOUT_LINES_QUERY + ''' WHERE status = 'pending' AND created_at <= %s
+                       GROUP BY producer_id ORDER BY producer_id''', (cutoff,))
+        lines = cursor.fetchall()
+        cursor.close()
+        conn.close()
+        return jsonify({
+            'cutoff': cutoff.isoformat(),
+            'commission_count': sum(line['commission_count'] for line in lines),
+            'total_producer_amount': str(sum((line['producer_amount'] for line in lines), Decimal('0.00'))),
+            'lines': [_payout_line(line) for line in lines]
+        })
+
+    now = datetime.utcnow()
+    reference = f"PAYOUT-{now:%Y%m%d%H%M%S}-{secrets.token_hex(3).upper()}"
+    try:
+        cursor.execute('''INSERT INTO payout_batches (reference, cutoff, status, created_by, created_at)
+                          VALUES (%s, %s, %s, %s, %s)''', (reference, cutoff, 'completed', get_jwt_identity(), now))
+        batch_id = cursor.lastrowid
+
+        # Set-based settlement: every pending commission up to the cutoff joins this batch
+        cursor.execute('''UPDATE commissions SET status = 'paid', payment_reference = %s, payout_batch_id = %s, updated_at = %s
+                          WHERE status = 'pending' AND created_at <= %s''', (reference, batch_id, now, cutoff))
+        if cursor.rowcount == 0:
+            conn.rollback()
+            cursor.close()
+            conn.close()
+            return jsonify({'error': 'No pending commissions up to the cutoff'}), 409
+
+        cursor.execute(PAYOUT_LINES_QUERY + ' WHERE payout_batch_id = %s GROUP BY producer_id ORDER BY producer_id',
+                       (batch_id,))
+        lines = cursor.fetchall()
+        total_producer_amount = sum((line['producer_amount'] for line in lines), Decimal('0.00'))
+        total_commission_amount = sum((line['commission_amount'] for line in lines), Decimal('0.00'))
+        commission_count = sum(line['commission_count'] for line in lines)
+        cursor.execute('''UPDATE payout_batches SET commission_count = %s, producer_count = %s,
+                          total_producer_amount = %s, total_commission_amount = %s WHERE id = %s''',
+                       (commission_count, len(lines), total_producer_amount, total_commission_amount, batch_id))
+
+        for line in lines:
+            create_notification(
+                cursor,
+                line['producer_id'],
+                'payment',
+                'Payout Sent',
+                f"A payout of ₦{line['producer_amount']:,.2f} for {line['commission_count']} order(s) has been sent (Ref {reference})",
+                batch_id
+            )
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        cursor.close()
+        conn.close()
+        print(f"Error creating payout run: {e}")
+        return jsonify({'error': 'Failed to create payout run'}), 500
+
+    cursor.close()
+    conn.close()
+    return jsonify({
+        'id': batch_id,
+        'reference': reference,
+        'cutoff': cutoff.isoformat(),
+        'commission_count': commission_count,
+        'producer_count': len(lines),
+        'total_producer_amount': str(total_producer_amount),
+        'total_commission_amount': str(total_commission_amount),
+        'lines': [_payout_line(line) for line in lines]
+    }), 201
+
+# Admin: List payout runs
+@routes_bp.route('/admin/payout-runs', methods=['GET'])
+@admin_required
+def get_payout_runs():
+    conn = get_db_connection()
+    cursor = conn.cursor(dictionary=True)
+    cursor.execute('SELECT * FROM payout_batches ORDER BY id DESC LIMIT 100')
+    batches = cursor.fetchall()
+    cursor.close()
+    conn.close()
+    return jsonify([_payout_batch(batch) for batch in batches])
+
+# Admin: One payout run with its per-producer lines
+@routes_bp.route('/admin/payout-runs/<int:batch_id>', methods=['GET'])
+@admin_required
+def get_payout_run(batch_id):
+    conn = get_db_connection()
+    cursor = conn.cursor(dictionary=True)
+    cursor.execute('SELECT * FROM payout_batches WHERE id = %s', (batch_id,))
+    batch = cursor.fetchone()
+    if not batch:
+        cursor.close()
+        conn.close()
+        return jsonify({'error': 'Payout run not found'}), 404
+    cursor.execute(PAYOUT_LINES_QUERY + ' WHERE payout_batch_id = %s GROUP BY producer_id ORDER BY producer_id',
+                   (batch_id,))
+    lines = cursor.fetchall()
+    cursor.close()
+    conn.close()
+    batch = _payout_batch(batch)
+    batch['lines'] = [_payout_line(line) for line in lines]
+    return jsonify(batch)
+
+# Admin: Download the bank payout file of a run
+@routes_bp.route('/admin/payout-runs/<int:batch_id>/file', methods=['GET'])
+@admin_required
+def get_payout_run_file(batch_id):
+    """One CSV line per producer with their active bank account, streamed"""
+    conn = get_db_connection()
+    cursor = conn.cursor(dictionary=True)
+    cursor.execute('SELECT reference FROM payout_batches WHERE id = %s', (batch_id,))
+    batch = cursor.fetchone()
+    cursor.close()
+    conn.close()
+    if not batch:
+        return jsonify({'error': 'Payout run not found'}), 404
+    query = '''SELECT t.producer_id,
+               COALESCE(NULLIF(u.company_name, ''), CONCAT_WS(' ', u.first_name, u.last_name), u.username) as payee,
+               b.bank_name, b.account_name, b.account_number, b.bank_code, b.swift_code, b.routing_number,
+               t.commission_count, t.amount, pb.reference
+               FROM (SELECT producer_id, COUNT(*) as commission_count, SUM(producer_amount) as amount
+                     FROM commissions WHERE payout_batch_id = %s GROUP BY producer_id) t
+               JOIN payout_batches pb ON pb.id = %s
+               JOIN users u ON u.id = t.producer_id
+               LEFT JOIN producer_bank_details b ON b.id = (
+                   SELECT MAX(id) FROM producer_bank_details WHERE producer_id = t.producer_id AND is_active = TRUE)
+               ORDER BY t.producer_id'''
+    return csv_export_response(query, (batch_id, batch_id), f"{batch['reference']}.csv")
+
+# Admin: Confirm bank-transfer payments in bulk from a bank statement
+@routes_bp.route('/admin/payments/reconcile', methods=['POST'])
+@admin_required
+def reconcile_payments():
+    """Match a bank statement CSV against pending orders.
+
+    Upload the statement as multipart field ``statement``. Rows are matched
+    on transaction reference against orders whose payment is pending; the
+    amount must equal one order or the total of all of the reference's
+    orders (a batch checkout). ``reference_column`` / ``amount_column`` name
+    the columns if they aren't one of the usual headers. Matched orders are
+    marked paid in one transaction (skipped with ``dry_run=true``) and
+    unmatched or ambiguous rows are reported with a reason.
+    """
+    statement = request.files.get('statement')
+    if not statement:
+        return jsonify({'error': 'Upload the bank statement as "statement"'}), 400
+    dry_run = request.form.get('dry_run', request.args.get('dry_run', '')).lower() in ('1', 'true', 'yes')
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    index = build_payment_index(cursor)
+    try:
+        matched_ids, unmatched, stats = match_statement(
+            statement.stream, index,
+            reference_column=request.form.get('reference_column'),
+            amount_column=request.form.get('amount_column'))
+    except (ValueError, UnicodeDecodeError, csv.Error) as e:
+        cursor.close()
+        conn.close()
+        return jsonify({'error': f'Could not read statement: {e}'}), 400
+
+    updated = 0
+    if matched_ids and not dry_run:
+        now = datetime.utcnow()
+        try:
+            dict_cursor = conn.cursor(dictionary=True)
+            for start in range(0, len(matched_ids), IN_CHUNK_SIZE):
+                chunk = matched_ids[start:start + IN_CHUNK_SIZE]
+                placeholders = ', '.join(['%s'] * len(chunk))
+                # Lock the still-pending orders, then flip them all in one statement
+                dict_cursor.execute(ROLLUP_ORDER_QUERY + f''' WHERE o.id IN ({placeholders})
+                                    AND o.payment_status = 'pending' FOR UPDATE''', tuple(chunk))
+                before = dict_cursor.fetchall()
+                if not before:
+                    continue
+                ids = [order['id'] for order in before]
+                placeholders = ', '.join(['%s'] * len(ids))
+                cursor.execute(f'''UPDATE orders SET payment_status = 'completed',
+                                   payment_timestamp = COALESCE(payment_timestamp, %s), updated_at = %s
+                                   WHERE id IN ({placeholders})''', (now, now, *ids))
+                updated += cursor.rowcount
+                apply_rollup_changes(cursor, [(order, dict(order, payment_status='completed')) for order in before])
+            dict_cursor.close()
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            cursor.close()
+            conn.close()
+            print(f"Error reconciling payments: {e}")
+            return jsonify({'error': 'Failed to update matched orders'}), 500
+
+    cursor.close()
+    conn.close()
+    return jsonify({
+        'dry_run': dry_run,
+        'rows': stats['rows'],
+        'matched': stats['matched'],
+        'matched_orders': stats['matched_orders'],
+        'updated': updated,
+        'unmatched_count': stats['unmatched'],
+        'unmatched': unmatched,
+        'unmatched_truncated': stats['unmatched'] > len(unmatched)
+    })
+
 
 # Get Producer Payments
 @routes_bp.route('/producer/payments', methods=['GET'])
@@ -1983,23 +2700,33 @@ def get_conversations():
     conn = get_db_connection()
     cursor = conn.cursor(dictionary=True)
 
-    # Get conversations where user is either buyer or producer, including those without a product
+    # Conversations come from the summary table: one index range scan per role.
+    # Unread is a range count above the user's read watermark, skipped when nothing is new.
     cursor.execute('''
-        SELECT DISTINCT i.id as inquiry_id, i.product_id, i.buyer_id, 
-               COALESCE(p.producer_id, i.producer_id) as producer_id,
+        SELECT i.id as inquiry_id, i.product_id, i.buyer_id, 
+               cs.producer_id,
                p.name as product_name, p.main_image_url as product_image,
                buyer.username as buyer_username, buyer.first_name as buyer_first_name, buyer.last_name as buyer_last_name, buyer.company_name as buyer_company,
                producer.username as producer_username, producer.first_name as producer_first_name, producer.last_name as producer_last_name, producer.company_name as producer_company,
                i.created_at as inquiry_created_at,
-               (SELECT COUNT(*) FROM messages m WHERE m.inquiry_id = i.id AND m.sender_id != %s AND m.is_read = FALSE) as unread_count,
-               (SELECT m.message FROM messages m WHERE m.inquiry_id = i.id ORDER BY m.created_at DESC LIMIT 1) as last_message,
-               (SELECT m.created_at FROM messages m WHERE m.inquiry_id = i.id ORDER BY m.created_at DESC LIMIT 1) as last_message_time
-        FROM inquiries i
+               IF(cs.last_message_id > COALESCE(cr.last_read_message_id, 0),
+                  (SELECT COUNT(*) FROM messages m
+                   WHERE m.inquiry_id = cs.inquiry_id AND m.id > COALESCE(cr.last_read_message_id, 0)
+                   AND m.sender_id != %s),
+                  0) as unread_count,
+               cs.last_message,
+               cs.last_message_time
+        FROM (
+            SELECT * FROM conversation_summaries WHERE buyer_id = %s
+            UNION
+            SELECT * FROM conversation_summaries WHERE producer_id = %s
+        ) cs
+        JOIN inquiries i ON i.id = cs.inquiry_id
+        LEFT JOIN conversation_reads cr ON cr.inquiry_id = cs.inquiry_id AND cr.user_id = %s
         LEFT JOIN products p ON i.product_id = p.id
-        JOIN users buyer ON i.buyer_id = buyer.id
-        LEFT JOIN users producer ON (p.producer_id = producer.id OR i.producer_id = producer.id)
-        WHERE i.buyer_id = %s OR (p.producer_id = %s OR i.producer_id = %s)
-        ORDER BY last_message_time DESC
+        JOIN users buyer ON cs.buyer_id = buyer.id
+        LEFT JOIN users producer ON cs.producer_id = producer.id
+        ORDER BY cs.last_message_time DESC
     ''', (user_id, user_id, user_id, user_id))
 
     conversations = cursor.fetchall()
@@ -2028,9 +2755,20 @@ def get_conversations():
 
     return jsonify(conversations)
 
+DEFAULT_MESSAGE_PAGE_SIZE = 50
+MAX_MESSAGE_PAGE_SIZE = 200
+
 # Get messages for a specific inquiry
 @routes_bp.route('/conversations/<int:inquiry_id>/messages', methods=['GET'])
 def get_messages(inquiry_id):
+    """Messages of one conversation in chronological order.
+
+    Without query parameters the whole thread is returned as an array. With
+    ``limit``, ``before_id`` or ``after_id`` a page is returned as
+    ``{"messages": [...], "has_more": bool}``: the latest ``limit`` messages
+    by default, older ones with ``before_id`` (scroll back) or only newer
+    ones with ``after_id`` (delta since last seen, e.g. after a reconnect).
+    """
     token = None
     if 'Authorization' in request.headers:
         token = request.headers['Authorization'].split()[1]
@@ -2064,28 +2802,61 @@ def get_messages(inquiry_id):
         conn.close()
         return jsonify({'error': 'Inquiry not found or access denied'}), 404
 
-    # Get messages
-    cursor.execute('''
+    paginated = any(param in request.args for param in ('limit', 'before_id', 'after_id'))
+    query = '''
         SELECT m.*, u.username, u.first_name, u.last_name, u.user_type
         FROM messages m
         JOIN users u ON m.sender_id = u.id
-        WHERE m.inquiry_id = %s
-        ORDER BY m.created_at ASC
-    ''', (inquiry_id,))
+        WHERE m.inquiry_id = %s'''
+    params = [inquiry_id]
 
+    if paginated:
+        try:
+            limit = int(request.args.get('limit', DEFAULT_MESSAGE_PAGE_SIZE))
+            before_id = int(request.args['before_id']) if request.args.get('before_id') else None
+            after_id = int(request.args['after_id']) if request.args.get('after_id') else None
+        except ValueError:
+            cursor.close()
+            conn.close()
+            return jsonify({'error': 'limit, before_id and after_id must be integers'}), 400
+        if before_id is not None and after_id is not None:
+            cursor.close()
+            conn.close()
+            return jsonify({'error': 'Use either before_id or after_id, not both'}), 400
+        limit = max(1, min(limit, MAX_MESSAGE_PAGE_SIZE))
+
+        # Walk the (inquiry_id, id) index from the cursor, fetching one extra row to detect more
+        if after_id is not None:
+            query += ' AND m.id > %s ORDER BY m.id ASC LIMIT %s'
+            params.extend([after_id, limit + 1])
+        else:
+            if before_id is not None:
+                query += ' AND m.id < %s'
+                params.append(before_id)
+            query += ' ORDER BY m.id DESC LIMIT %s'
+            params.append(limit + 1)
+    else:
+        query += ' ORDER BY m.created_at ASC'
+
+    cursor.execute(query, tuple(params))
     messages = cursor.fetchall()
 
-    # Mark messages as read for the current user
-    cursor.execute('''
-        UPDATE messages 
-        SET is_read = TRUE 
-        WHERE inquiry_id = %s AND sender_id != %s
-    ''', (inquiry_id, user_id))
+    if paginated:
+        has_more = len(messages) > limit
+        messages = messages[:limit]
+        if after_id is None:
+            messages.reverse()
+
+    # Mark the conversation read for the current user
+    apply_read_state(cursor, inquiry_id, messages)
+    mark_conversation_read(cursor, inquiry_id, user_id)
 
     conn.commit()
     cursor.close()
     conn.close()
 
+    if paginated:
+        return jsonify({'messages': messages, 'has_more': has_more})
     return jsonify(messages)
 
 # Send a message (also handled by WebSocket, but this is for REST API compatibility)
@@ -2126,12 +2897,14 @@ def send_message(inquiry_id):
         return jsonify({'error': 'Inquiry not found or access denied'}), 404
     
     # Insert message
+    created_at = datetime.utcnow()
     cursor.execute('''
         INSERT INTO messages (inquiry_id, sender_id, message, is_read, created_at)
         VALUES (%s, %s, %s, %s, %s)
-    ''', (inquiry_id, user_id, message_text, False, datetime.utcnow()))
+    ''', (inquiry_id, user_id, message_text, False, created_at))
     
     message_id = cursor.lastrowid
+    record_message_in_summary(cursor, inquiry_id, message_id, message_text, created_at)
     
     # Get the inserted message with user info
     cursor.execute('''
@@ -2143,8 +2916,6 @@ def send_message(inquiry_id):
     
     message = cursor.fetchone()
     
-    conn.commit()
-    
     # Create notification for the other user in the conversation
     other_user_id = inquiry['buyer_id'] if user_id == inquiry['producer_id'] else inquiry['producer_id']
     
@@ -2152,6 +2923,7 @@ def send_message(inquiry_id):
     sender_name = f"{message['first_name']} {message['last_name']}" if message['first_name'] and message['last_name'] else message['username']
     
     create_notification(
+        cursor,
         other_user_id,
         'message',
         'New Message Received',
@@ -2159,6 +2931,7 @@ def send_message(inquiry_id):
         inquiry_id
     )
     
+    conn.commit()
     cursor.close()
     conn.close()
     
@@ -2181,14 +2954,18 @@ def get_unread_count():
     conn = get_db_connection()
     cursor = conn.cursor(dictionary=True)
     
+    # Range counts above the read watermark of each conversation that has something new
     cursor.execute('''
-        SELECT COUNT(*) as unread_count
-        FROM messages m
-        JOIN inquiries i ON m.inquiry_id = i.id
-        JOIN products p ON i.product_id = p.id
-        WHERE m.sender_id != %s AND m.is_read = FALSE 
-        AND (i.buyer_id = %s OR p.producer_id = %s)
-    ''', (user_id, user_id, user_id))
+        SELECT COUNT(m.id) as unread_count
+        FROM (
+            SELECT inquiry_id, last_message_id FROM conversation_summaries WHERE buyer_id = %s
+            UNION
+            SELECT inquiry_id, last_message_id FROM conversation_summaries WHERE producer_id = %s
+        ) cs
+        LEFT JOIN conversation_reads cr ON cr.inquiry_id = cs.inquiry_id AND cr.user_id = %s
+        JOIN messages m ON m.inquiry_id = cs.inquiry_id AND m.id > COALESCE(cr.last_read_message_id, 0)
+        WHERE cs.last_message_id > COALESCE(cr.last_read_message_id, 0) AND m.sender_id != %s
+    ''', (user_id, user_id, user_id, user_id))
     
     result = cursor.fetchone()
     cursor.close()
@@ -2233,11 +3010,7 @@ def mark_messages_read(inquiry_id):
         return jsonify({'error': 'Inquiry not found or access denied'}), 404
 
     # Mark messages as read
-    cursor.execute('''
-        UPDATE messages 
-        SET is_read = TRUE 
-        WHERE inquiry_id = %s AND sender_id != %s
-    ''', (inquiry_id, user_id))
+    mark_conversation_read(cursor, inquiry_id, user_id)
 
     conn.commit()
     cursor.close()
@@ -2595,13 +3368,47 @@ def get_producer_details(producer_id):
     
     return jsonify(producer)
 
+DEFAULT_ONLINE_USERS_PAGE_SIZE = 100
+MAX_ONLINE_USERS_PAGE_SIZE = 500
+
 # Get online users (Admin only)
 @routes_bp.route('/admin/online-users', methods=['GET'])
 @admin_required
 def get_online_users():
-    from websocket_service import get_online_users
-    online_users = get_online_users()
-    return jsonify(online_users) 
+    """One page of the users connected to this process, in user id order.
+
+    Optional ``role`` filters by user type; pass ``next_cursor`` back as
+    ``cursor`` for the next page. Counts cover every online user.
+    """
+    try:
+        limit = max(1, min(int(request.args.get('limit', DEFAULT_ONLINE_USERS_PAGE_SIZE)), MAX_ONLINE_USERS_PAGE_SIZE))
+        after = None
+        if request.args.get('cursor'):
+            values = decode_cursor(request.args['cursor'])
+            if len(values) != 1:
+                raise ValueError('Invalid cursor')
+            after = int(values[0])
+    except (ValueError, TypeError):
+        return jsonify({'error': 'Invalid limit or cursor'}), 400
+
+    users, last_user_id = presence.page(limit, after, request.args.get('role'))
+    next_cursor = encode_cursor([last_user_id]) if last_user_id is not None else None
+    return jsonify({'users': users, 'next_cursor': next_cursor, 'limit': limit, **presence.counts()})
+
+# Database connection pool statistics (Admin only)
+@routes_bp.route('/admin/db-pool', methods=['GET'])
+@admin_required
+def get_db_pool_stats():
+    return jsonify(get_pool_stats())
+
+# Prometheus scrape endpoint
+@routes_bp.route('/metrics', methods=['GET'])
+def get_metrics():
+    if not METRICS_TOKEN:
+        return jsonify({'error': 'Metrics are disabled; set METRICS_TOKEN to enable them'}), 404
+    if not metrics_authorized(request.headers.get('Authorization')):
+        return jsonify({'error': 'Invalid metrics token'}), 401
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
 
 # Get Producer Order by ID
 @routes_bp.route('/producer/orders/<int:order_id>', methods=['GET'])
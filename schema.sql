@@ -73,15 +73,26 @@ CREATE TABLE products (
     FOREIGN KEY (producer_id) REFERENCES users(id)
 );
 
+-- Keyset pagination for GET /products (status filter + sort column + id tiebreaker)
+CREATE INDEX idx_products_status_name ON products(product_status, name, id);
+CREATE INDEX idx_products_status_price ON products(product_status, price, id);
+CREATE INDEX idx_products_status_created ON products(product_status, created_at, id);
+CREATE INDEX idx_products_category_price ON products(product_status, category, price, id);
+CREATE INDEX idx_products_category_created ON products(product_status, category, created_at, id);
+
 CREATE TABLE product_images (
     id INT AUTO_INCREMENT PRIMARY KEY,
     product_id INT NOT NULL,
     image_url VARCHAR(500) NOT NULL,
     is_primary BOOLEAN DEFAULT FALSE,
+    variants_version INT NULL,
     created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
     FOREIGN KEY (product_id) REFERENCES products(id) ON DELETE CASCADE
 );
 
+CREATE INDEX idx_product_images_product ON product_images(product_id, is_primary, id);
+CREATE INDEX idx_product_images_url ON product_images(image_url(191));
+
 CREATE TABLE product_specifications (
     id INT AUTO_INCREMENT PRIMARY KEY,
     product_id INT NOT NULL,
@@ -160,6 +171,34 @@ CREATE TABLE messages (
     FOREIGN KEY (sender_id) REFERENCES users(id)
 );
 
+-- Cursor pagination of a conversation's history
+CREATE INDEX idx_messages_inquiry_id ON messages(inquiry_id, id);
+
+-- Denormalized per-conversation state maintained on every message insert
+CREATE TABLE conversation_summaries (
+    inquiry_id INT PRIMARY KEY,
+    buyer_id INT NOT NULL,
+    producer_id INT NULL,
+    last_message_id INT NULL,
+    last_message TEXT,
+    last_message_time DATETIME NULL,
+    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    FOREIGN KEY (inquiry_id) REFERENCES inquiries(id) ON DELETE CASCADE
+);
+CREATE INDEX idx_conversation_summaries_buyer ON conversation_summaries(buyer_id, last_message_time);
+CREATE INDEX idx_conversation_summaries_producer ON conversation_summaries(producer_id, last_message_time);
+
+-- Per-participant read watermark: messages with id > last_read_message_id are unread
+CREATE TABLE conversation_reads (
+    inquiry_id INT NOT NULL,
+    user_id INT NOT NULL,
+    last_read_message_id INT NOT NULL DEFAULT 0,
+    updated_at DATETIME,
+    PRIMARY KEY (inquiry_id, user_id),
+    FOREIGN KEY (inquiry_id) REFERENCES inquiries(id) ON DELETE CASCADE,
+    FOREIGN KEY (user_id) REFERENCES users(id)
+);
+
 CREATE TABLE message_attachments (
     id INT AUTO_INCREMENT PRIMARY KEY,
     message_id INT NOT NULL,
@@ -195,6 +234,61 @@ CREATE TABLE orders (
     FOREIGN KEY (product_id) REFERENCES products(id)
 );
 
+-- Per-producer daily order totals, maintained with every order write
+CREATE TABLE producer_daily_stats (
+    producer_id INT NOT NULL,
+    day DATE NOT NULL,
+    order_count INT NOT NULL DEFAULT 0,
+    gross_amount DECIMAL(14,2) NOT NULL DEFAULT 0.00,
+    commission_amount DECIMAL(14,2) NOT NULL DEFAULT 0.00,
+    completed_count INT NOT NULL DEFAULT 0,
+    completed_amount DECIMAL(14,2) NOT NULL DEFAULT 0.00,
+    pending_count INT NOT NULL DEFAULT 0,
+    pending_amount DECIMAL(14,2) NOT NULL DEFAULT 0.00,
+    paid_amount DECIMAL(14,2) NOT NULL DEFAULT 0.00,
+    PRIMARY KEY (producer_id, day),
+    FOREIGN KEY (producer_id) REFERENCES users(id) ON DELETE CASCADE
+);
+
+-- Paging a producer's transactions newest first
+CREATE INDEX idx_orders_product_created ON orders(product_id, created_at, id);
+
+-- Admin revenue analytics: one row per day and dimension combination
+CREATE TABLE revenue_daily_buckets (
+    day DATE NOT NULL,
+    producer_id INT NOT NULL,
+    category VARCHAR(100) NOT NULL DEFAULT '',
+    currency VARCHAR(10) NOT NULL DEFAULT '',
+    payment_method VARCHAR(50) NOT NULL DEFAULT '',
+    order_count INT NOT NULL DEFAULT 0,
+    gross_amount DECIMAL(16,2) NOT NULL DEFAULT 0.00,
+    commission_amount DECIMAL(16,2) NOT NULL DEFAULT 0.00,
+    paid_amount DECIMAL(16,2) NOT NULL DEFAULT 0.00,
+    PRIMARY KEY (day, producer_id, category, currency, payment_method)
+);
+
+-- Days whose orders changed since their buckets were last computed
+CREATE TABLE revenue_dirty_days (
+    day DATE PRIMARY KEY
+);
+
+CREATE INDEX idx_orders_created_at ON orders(created_at);
+
+-- Commission payout runs: one row per settlement batch
+CREATE TABLE payout_batches (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    reference VARCHAR(64) NOT NULL UNIQUE,
+    cutoff DATETIME NOT NULL,
+    status VARCHAR(20) DEFAULT 'completed',
+    commission_count INT NOT NULL DEFAULT 0,
+    producer_count INT NOT NULL DEFAULT 0,
+    total_producer_amount DECIMAL(14,2) NOT NULL DEFAULT 0.00,
+    total_commission_amount DECIMAL(14,2) NOT NULL DEFAULT 0.00,
+    created_by INT,
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (created_by) REFERENCES users(id)
+);
+
 CREATE TABLE commissions (
     id INT AUTO_INCREMENT PRIMARY KEY,
     order_id INT NOT NULL,
@@ -206,13 +300,21 @@ CREATE TABLE commissions (
     commission_percentage DECIMAL(5,2) DEFAULT 10.00,
     status VARCHAR(20) DEFAULT 'pending',
     payment_reference VARCHAR(255),
+    payout_batch_id INT NULL,
     created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
     updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
     FOREIGN KEY (order_id) REFERENCES orders(id),
     FOREIGN KEY (producer_id) REFERENCES users(id),
-    FOREIGN KEY (admin_id) REFERENCES users(id)
+    FOREIGN KEY (admin_id) REFERENCES users(id),
+    FOREIGN KEY (payout_batch_id) REFERENCES payout_batches(id)
 );
 
+CREATE INDEX idx_commissions_status_created ON commissions(status, created_at);
+CREATE INDEX idx_commissions_payout_batch ON commissions(payout_batch_id, producer_id);
+
+-- Bank statement reconciliation scans pending orders by transfer reference
+CREATE INDEX idx_orders_payment_status ON orders(payment_status, payment_transaction_id);
+
 CREATE TABLE admin_bank_details (
     id INT AUTO_INCREMENT PRIMARY KEY,
     bank_name VARCHAR(100) NOT NULL,
@@ -257,6 +359,16 @@ CREATE TABLE notifications (
 CREATE INDEX idx_notifications_user_status ON notifications(user_id, status);
 CREATE INDEX idx_notifications_created_at ON notifications(created_at);
 
+-- Socket.IO emits staged in the same transaction as the change they announce
+CREATE TABLE outbox (
+    id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    event VARCHAR(50) NOT NULL,
+    room VARCHAR(100) NOT NULL,
+    payload JSON NOT NULL,
+    attempts INT NOT NULL DEFAULT 0,
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+);
+
 -- Insert default admin bank details
 INSERT INTO admin_bank_details (bank_name, account_name, account_number) 
 VALUES ('Opay', 'Aminu Aminu', '8060051309')
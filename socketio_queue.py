@@ -0,0 +1,210 @@
+import argparse
+import asyncio
+import os
+import socket
+import stat
+import struct
+import tempfile
+import threading
+import time
+import socketio
+from dotenv import load_dotenv
+from engineio import json
+
+load_dotenv()
+
+# Shared by every process that serves or emits to sockets; empty keeps emits in-process.
+# unix:// uses the local broker below (python socketio_queue.py) on a socket in a private
+# per-user directory, unix:///path on a socket of your choosing; redis://, amqp://,
+# kafka:// and zmq+tcp:// URLs go to the python-socketio manager for that backend.
+SOCKETIO_MESSAGE_QUEUE = os.getenv('SOCKETIO_MESSAGE_QUEUE', '')
+SOCKETIO_CHANNEL = os.getenv('SOCKETIO_CHANNEL', 'bis-socketio')
+# Seconds between attempts to reach the broker after the connection drops
+SOCKETIO_QUEUE_RECONNECT = float(os.getenv('SOCKETIO_QUEUE_RECONNECT', '1'))
+# Subscribers that fall this far behind are disconnected by the broker and reconnect
+BROKER_MAX_BUFFER = int(os.getenv('SOCKETIO_BROKER_MAX_BUFFER', str(16 * 1024 * 1024)))
+
+# Only this user can list or enter the directory, so no one else can bind the socket
+DEFAULT_BROKER_DIR = os.path.join(tempfile.gettempdir(), f'bis-socketio-{os.getuid()}')
+DEFAULT_BROKER_PATH = os.path.join(DEFAULT_BROKER_DIR, 'broker.sock')
+_HEADER = struct.Struct('!I')
+
+
+def _broker_path(url):
+    return url[len('unix://'):] or DEFAULT_BROKER_PATH
+
+
+def check_broker_path(path):
+    """Raise PermissionError unless only this user could have created ``path``.
+
+    The directory must belong to this user and be writable by no one else;
+    the socket, if it exists, must belong to this user too. A missing
+    directory or socket raises FileNotFoundError.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    info = os.lstat(directory)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or info.st_mode & 0o022:
+        raise PermissionError(f"{directory} must be a directory owned by this user and not writable by others")
+    try:
+        info = os.lstat(path)
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(info.st_mode) or info.st_uid != os.getuid():
+        raise PermissionError(f"{path} is not a socket owned by this user")
+
+
+class UnixSocketManager(socketio.PubSubManager):
+    """Client manager that shares emits between processes through the local broker.
+
+    Every emit is sent as JSON to the broker, which relays it to each
+    subscribed process (including this one) for local delivery. Like Redis
+    pub/sub, messages published while a process is reconnecting are not
+    replayed to it. The socket is only used if it passes check_broker_path.
+    """
+    name = 'unix'
+
+    def __init__(self, url='unix://', channel='socketio', write_only=False, logger=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+        self.path = _broker_path(url)
+        try:
+            check_broker_path(self.path)
+        except FileNotFoundError:
+            # The broker may start after us; _connect checks again
+            pass
+        self._publisher = None
+        self._publish_lock = threading.Lock()
+
+    def _connect(self, role):
+        check_broker_path(self.path)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.path)
+            sock.sendall(f'{role} {self.channel}\n'.encode('utf-8'))
+        except OSError:
+            sock.close()
+            raise
+        return sock
+
+    def _publish(self, data):
+        payload = json.dumps(data).encode('utf-8')
+        frame = _HEADER.pack(len(payload)) + payload
+        with self._publish_lock:
+            # One retry on a fresh connection covers a restarted broker
+            for attempt in range(2):
+                try:
+                    if self._publisher is None:
+                        self._publisher = self._connect('PUB')
+                    self._publisher.sendall(frame)
+                    return
+                except OSError as e:
+                    error = e
+                    if self._publisher is not None:
+                        self._publisher.close()
+                        self._publisher = None
+        print(f"Socket.IO queue publish to {self.path} failed: {error}")
+
+    def _listen(self):
+        while True:
+            try:
+                sock = self._connect('SUB')
+            except OSError as e:
+                print(f"Socket.IO queue broker {self.path} unavailable: {e}")
+                time.sleep(SOCKETIO_QUEUE_RECONNECT)
+                continue
+            reader = sock.makefile('rb')
+            try:
+                while True:
+                    header = reader.read(_HEADER.size)
+                    if len(header) < _HEADER.size:
+                        break
+                    size = _HEADER.unpack(header)[0]
+                    payload = reader.read(size)
+                    if len(payload) < size:
+                        break
+                    try:
+                        message = json.loads(payload)
+                    except ValueError:
+                        print(f"Socket.IO queue dropped a malformed message from {self.path}")
+                        continue
+                    # Yield the decoded dict so the base class never tries to unpickle it
+                    if isinstance(message, dict):
+                        yield message
+            except OSError as e:
+                print(f"Socket.IO queue connection lost: {e}")
+            finally:
+                reader.close()
+                sock.close()
+            time.sleep(SOCKETIO_QUEUE_RECONNECT)
+
+
+def queue_options(url=SOCKETIO_MESSAGE_QUEUE, channel=SOCKETIO_CHANNEL, write_only=False):
+    """Keyword arguments for SocketIO.init_app that attach the configured message queue"""
+    if not url:
+        return {}
+    if url.startswith('unix://'):
+        return {'client_manager': UnixSocketManager(url, channel=channel, write_only=write_only)}
+    return {'message_queue': url, 'channel': channel}
+
+
+async def _serve(path):
+    subscribers = {}  # channel -> set of subscriber writers
+
+    async def handle(reader, writer):
+        channel = None
+        try:
+            role, _, channel = (await reader.readline()).decode('utf-8').strip().partition(' ')
+            if role == 'SUB':
+                subscribers.setdefault(channel, set()).add(writer)
+                # Subscribers never send; this returns when they disconnect
+                await reader.read()
+            elif role == 'PUB':
+                while True:
+                    header = await reader.readexactly(_HEADER.size)
+                    frame = header + await reader.readexactly(_HEADER.unpack(header)[0])
+                    for subscriber in list(subscribers.get(channel, ())):
+                        if subscriber.transport.get_write_buffer_size() > BROKER_MAX_BUFFER:
+                            print(f"Dropping slow subscriber on {channel}")
+                            subscribers[channel].discard(subscriber)
+                            subscriber.close()
+                        else:
+                            subscriber.write(frame)
+        except (asyncio.IncompleteReadError, ConnectionError, UnicodeDecodeError):
+            pass
+        finally:
+            subscribers.get(channel, set()).discard(writer)
+            writer.close()
+
+    if path == DEFAULT_BROKER_PATH:
+        os.makedirs(DEFAULT_BROKER_DIR, mode=0o700, exist_ok=True)
+    # Refuses a directory or stale socket another user could have planted
+    check_broker_path(path)
+    if os.path.exists(path):
+        os.unlink(path)
+    # Created 0600 in one step, so there is no window where others may connect
+    umask = os.umask(0o177)
+    try:
+        server = await asyncio.start_unix_server(handle, path)
+    finally:
+        os.umask(umask)
+    print(f"Socket.IO broker listening on {path}")
+    async with server:
+        await server.serve_forever()
+
+
+def run_broker(path=DEFAULT_BROKER_PATH):
+    """Relay Socket.IO emits between the app processes on this host"""
+    try:
+        asyncio.run(_serve(path))
+    except KeyboardInterrupt:
+        pass
+    except OSError as e:
+        raise SystemExit(f"Socket.IO broker not started: {e}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Local Socket.IO message broker')
+    default_path = (_broker_path(SOCKETIO_MESSAGE_QUEUE) if SOCKETIO_MESSAGE_QUEUE.startswith('unix://')
+                    else DEFAULT_BROKER_PATH)
+    parser.add_argument('--path', default=default_path, help='Unix socket to listen on')
+    args = parser.parse_args()
+    run_broker(args.path)
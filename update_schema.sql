@@ -7,5 +7,158 @@ ALTER TABLE users ADD COLUMN IF NOT EXISTS state VARCHAR(50);
 -- Add currency column to orders table if not exists
 ALTER TABLE orders ADD COLUMN IF NOT EXISTS currency VARCHAR(10) DEFAULT 'NGN' AFTER total_amount;
 
+-- Serve batched image lookups (primary image first) from the index
+CREATE INDEX IF NOT EXISTS idx_product_images_product ON product_images(product_id, is_primary, id);
+
+-- Image variant version built for each product image (NULL = none yet); run build_image_variants.py to backfill
+ALTER TABLE product_images ADD COLUMN IF NOT EXISTS variants_version INT NULL AFTER is_primary;
+CREATE INDEX IF NOT EXISTS idx_product_images_url ON product_images(image_url(191));
+
+-- Keyset pagination for GET /products (status filter + sort column + id tiebreaker)
+CREATE INDEX IF NOT EXISTS idx_products_status_name ON products(product_status, name, id);
+CREATE INDEX IF NOT EXISTS idx_products_status_price ON products(product_status, price, id);
+CREATE INDEX IF NOT EXISTS idx_products_status_created ON products(product_status, created_at, id);
+CREATE INDEX IF NOT EXISTS idx_products_category_price ON products(product_status, category, price, id);
+CREATE INDEX IF NOT EXISTS idx_products_category_created ON products(product_status, category, created_at, id);
+
+-- Conversation summaries for GET /conversations
+CREATE TABLE IF NOT EXISTS conversation_summaries (
+    inquiry_id INT PRIMARY KEY,
+    buyer_id INT NOT NULL,
+    producer_id INT NULL,
+    last_message_id INT NULL,
+    last_message TEXT,
+    last_message_time DATETIME NULL,
+    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    FOREIGN KEY (inquiry_id) REFERENCES inquiries(id) ON DELETE CASCADE
+);
+CREATE INDEX IF NOT EXISTS idx_conversation_summaries_buyer ON conversation_summaries(buyer_id, last_message_time);
+CREATE INDEX IF NOT EXISTS idx_conversation_summaries_producer ON conversation_summaries(producer_id, last_message_time);
+
+-- Backfill summaries for existing inquiries
+INSERT IGNORE INTO conversation_summaries (inquiry_id, buyer_id, producer_id, last_message_id, last_message, last_message_time)
+SELECT i.id, i.buyer_id, COALESCE(p.producer_id, i.producer_id),
+       last_m.id, last_m.message, last_m.created_at
+FROM inquiries i
+LEFT JOIN products p ON i.product_id = p.id
+LEFT JOIN messages last_m ON last_m.id = (SELECT MAX(m.id) FROM messages m WHERE m.inquiry_id = i.id);
+
+-- Cursor pagination of a conversation's history
+CREATE INDEX IF NOT EXISTS idx_messages_inquiry_id ON messages(inquiry_id, id);
+
+-- Read watermarks replace the per-row is_read updates and the summary unread counters
+ALTER TABLE conversation_summaries
+    DROP COLUMN IF EXISTS buyer_unread,
+    DROP COLUMN IF EXISTS producer_unread;
+
+CREATE TABLE IF NOT EXISTS conversation_reads (
+    inquiry_id INT NOT NULL,
+    user_id INT NOT NULL,
+    last_read_message_id INT NOT NULL DEFAULT 0,
+    updated_at DATETIME,
+    PRIMARY KEY (inquiry_id, user_id),
+    FOREIGN KEY (inquiry_id) REFERENCES inquiries(id) ON DELETE CASCADE,
+    FOREIGN KEY (user_id) REFERENCES users(id)
+);
+
+-- Backfill watermarks from the newest message each participant has already read
+INSERT IGNORE INTO conversation_reads (inquiry_id, user_id, last_read_message_id, updated_at)
+SELECT cs.inquiry_id, cs.buyer_id, MAX(m.id), NOW()
+FROM conversation_summaries cs
+JOIN messages m ON m.inquiry_id = cs.inquiry_id AND m.sender_id != cs.buyer_id AND m.is_read = TRUE
+GROUP BY cs.inquiry_id, cs.buyer_id;
+
+INSERT IGNORE INTO conversation_reads (inquiry_id, user_id, last_read_message_id, updated_at)
+SELECT cs.inquiry_id, cs.producer_id, MAX(m.id), NOW()
+FROM conversation_summaries cs
+JOIN messages m ON m.inquiry_id = cs.inquiry_id AND m.sender_id != cs.producer_id AND m.is_read = TRUE
+WHERE cs.producer_id IS NOT NULL
+GROUP BY cs.inquiry_id, cs.producer_id;
+
+-- Socket.IO emits staged in the same transaction as the change they announce
+CREATE TABLE IF NOT EXISTS outbox (
+    id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    event VARCHAR(50) NOT NULL,
+    room VARCHAR(100) NOT NULL,
+    payload JSON NOT NULL,
+    attempts INT NOT NULL DEFAULT 0,
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Per-producer daily order totals, maintained with every order write
+CREATE TABLE IF NOT EXISTS producer_daily_stats (
+    producer_id INT NOT NULL,
+    day DATE NOT NULL,
+    order_count INT NOT NULL DEFAULT 0,
+    gross_amount DECIMAL(14,2) NOT NULL DEFAULT 0.00,
+    commission_amount DECIMAL(14,2) NOT NULL DEFAULT 0.00,
+    completed_count INT NOT NULL DEFAULT 0,
+    completed_amount DECIMAL(14,2) NOT NULL DEFAULT 0.00,
+    pending_count INT NOT NULL DEFAULT 0,
+    pending_amount DECIMAL(14,2) NOT NULL DEFAULT 0.00,
+    paid_amount DECIMAL(14,2) NOT NULL DEFAULT 0.00,
+    PRIMARY KEY (producer_id, day),
+    FOREIGN KEY (producer_id) REFERENCES users(id) ON DELETE CASCADE
+);
+
+-- Backfill the rollups (rebuild later with: python rebuild_producer_rollups.py)
+INSERT IGNORE INTO producer_daily_stats (producer_id, day, order_count, gross_amount, commission_amount, completed_count, completed_amount, pending_count, pending_amount, paid_amount)
+SELECT p.producer_id, DATE(o.created_at), COUNT(*), SUM(o.total_amount), SUM(COALESCE(o.commission_amount, 0)),
+       SUM(o.status = 'completed'), SUM(CASE WHEN o.status = 'completed' THEN o.total_amount ELSE 0 END),
+       SUM(o.status = 'pending'), SUM(CASE WHEN o.status = 'pending' THEN o.total_amount ELSE 0 END),
+       SUM(CASE WHEN o.payment_status = 'completed' THEN o.total_amount ELSE 0 END)
+FROM orders o JOIN products p ON o.product_id = p.id
+GROUP BY p.producer_id, DATE(o.created_at);
+
+CREATE INDEX IF NOT EXISTS idx_orders_product_created ON orders(product_id, created_at, id);
+
+-- Admin revenue analytics: one row per day and dimension combination
+CREATE TABLE IF NOT EXISTS revenue_daily_buckets (
+    day DATE NOT NULL,
+    producer_id INT NOT NULL,
+    category VARCHAR(100) NOT NULL DEFAULT '',
+    currency VARCHAR(10) NOT NULL DEFAULT '',
+    payment_method VARCHAR(50) NOT NULL DEFAULT '',
+    order_count INT NOT NULL DEFAULT 0,
+    gross_amount DECIMAL(16,2) NOT NULL DEFAULT 0.00,
+    commission_amount DECIMAL(16,2) NOT NULL DEFAULT 0.00,
+    paid_amount DECIMAL(16,2) NOT NULL DEFAULT 0.00,
+    PRIMARY KEY (day, producer_id, category, currency, payment_method)
+);
+
+-- Days whose orders changed since their buckets were last computed
+CREATE TABLE IF NOT EXISTS revenue_dirty_days (
+    day DATE PRIMARY KEY
+);
+
+CREATE INDEX IF NOT EXISTS idx_orders_created_at ON orders(created_at);
+
+-- Queue every existing order day; the background refresher fills the buckets
+INSERT IGNORE INTO revenue_dirty_days (day)
+SELECT DISTINCT DATE(created_at) FROM orders;
+
+-- Commission payout runs: one row per settlement batch
+CREATE TABLE IF NOT EXISTS payout_batches (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    reference VARCHAR(64) NOT NULL UNIQUE,
+    cutoff DATETIME NOT NULL,
+    status VARCHAR(20) DEFAULT 'completed',
+    commission_count INT NOT NULL DEFAULT 0,
+    producer_count INT NOT NULL DEFAULT 0,
+    total_producer_amount DECIMAL(14,2) NOT NULL DEFAULT 0.00,
+    total_commission_amount DECIMAL(14,2) NOT NULL DEFAULT 0.00,
+    created_by INT,
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (created_by) REFERENCES users(id)
+);
+
+ALTER TABLE commissions ADD COLUMN IF NOT EXISTS payout_batch_id INT NULL AFTER payment_reference;
+ALTER TABLE commissions ADD CONSTRAINT fk_commissions_payout_batch FOREIGN KEY IF NOT EXISTS (payout_batch_id) REFERENCES payout_batches(id);
+CREATE INDEX IF NOT EXISTS idx_commissions_status_created ON commissions(status, created_at);
+CREATE INDEX IF NOT EXISTS idx_commissions_payout_batch ON commissions(payout_batch_id, producer_id);
+
+-- Bank statement reconciliation scans pending orders by transfer reference
+CREATE INDEX IF NOT EXISTS idx_orders_payment_status ON orders(payment_status, payment_transaction_id);
+
 -- Verify the table structure
 DESCRIBE users; 
\ No newline at end of file
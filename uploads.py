@@ -0,0 +1,185 @@
+import hashlib
+import mimetypes
+import os
+import re
+import tempfile
+import time
+from functools import lru_cache
+from urllib.parse import quote
+from flask import abort, current_app, request
+from werkzeug.security import safe_join
+from werkzeug.utils import send_file
+from images import UPLOAD_FOLDER, TEMP_FOLDER, BLOB_PATH, iter_uploads, strip_upload_metadata, upload_relpath, variant_files
+
+# Browser cache lifetime of upload names that never change content
+UPLOADS_MAX_AGE = int(os.getenv('UPLOADS_MAX_AGE', '31536000'))
+# '' serves from Python; 'x-accel-redirect' (nginx) or 'x-sendfile' (Apache, lighttpd) hand the
+# file to the front proxy so no bytes pass through the app server
+UPLOADS_OFFLOAD = os.getenv('UPLOADS_OFFLOAD', '').lower()
+# nginx `internal` location aliased to the uploads folder
+UPLOADS_ACCEL_PREFIX = os.getenv('UPLOADS_ACCEL_PREFIX', '/_uploads/')
+# Unreferenced uploads younger than this are kept: the product or message using them may not be saved yet
+UPLOADS_GC_GRACE_HOURS = float(os.getenv('UPLOADS_GC_GRACE_HOURS', '24'))
+
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Content-addressed blobs (<sha256>.<ext>), legacy <timestamp>_<name> uploads and their
+# variants are never rewritten
+IMMUTABLE_NAME = re.compile(r'^(\d{20}_|[0-9a-f]{64}[._])')
+
+
+def is_immutable(filename):
+    return bool(IMMUTABLE_NAME.match(os.path.basename(filename)))
+
+
+def store_upload(file, extension):
+    """Stream an upload to disk while hashing it and file it under its SHA-256.
+
+    Blobs live at ``ab/cd/<sha256>.<ext>`` so no directory grows large.
+    Images are stripped of EXIF/XMP metadata (GPS position, camera serials)
+    before they are filed, since the original is served alongside its
+    variants. Returns ``(relpath, created)``; ``created`` is False when an
+    identical blob was already stored, in which case the new copy is dropped.
+    """
+    extension = 'jpg' if extension == 'jpeg' else extension
+    os.makedirs(TEMP_FOLDER, exist_ok=True)
+    digest = hashlib.sha256()
+    fd, temp_path = tempfile.mkstemp(dir=TEMP_FOLDER)
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            for block in iter(lambda: file.stream.read(UPLOAD_CHUNK_SIZE), b''):
+                digest.update(block)
+                out.write(block)
+        if strip_upload_metadata(temp_path):
+            # Hash the bytes that are stored, so re-uploads with other metadata still dedupe
+            digest = hashlib.sha256()
+            with open(temp_path, 'rb') as f:
+                for block in iter(lambda: f.read(UPLOAD_CHUNK_SIZE), b''):
+                    digest.update(block)
+        sha = digest.hexdigest()
+        relpath = f'{sha[:2]}/{sha[2:4]}/{sha}.{extension}'
+        path = os.path.join(UPLOAD_FOLDER, relpath)
+        if os.path.exists(path):
+            # A re-upload restarts the blob's garbage collection grace period
+            os.utime(path)
+            return relpath, False
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, path)
+        temp_path = None
+        return relpath, True
+    finally:
+        if temp_path is not None:
+            os.remove(temp_path)
+
+
+def _remove_upload(relpath):
+    """Delete an upload, its variants of every version and any shard directories left empty"""
+    for path in [relpath] + variant_files(relpath):
+        try:
+            os.remove(os.path.join(UPLOAD_FOLDER, path))
+        except FileNotFoundError:
+            continue
+        directory = os.path.dirname(path)
+        while directory and directory != 'variants':
+            try:
+                os.rmdir(os.path.join(UPLOAD_FOLDER, directory))
+            except OSError:
+                break
+            directory = os.path.dirname(directory)
+
+
+def referenced_uploads(cursor):
+    """Paths of every upload referenced by a product, product image or message attachment"""
+    cursor.execute('''SELECT main_image_url FROM products WHERE main_image_url IS NOT NULL
+                      UNION SELECT image_url FROM product_images
+                      UNION SELECT file_url FROM message_attachments''')
+    referenced = set()
+    for (url,) in cursor:
+        relpath = upload_relpath(url)
+        if relpath:
+            referenced.add(relpath)
+    return referenced
+
+
+def collect_garbage(cursor, grace_hours=UPLOADS_GC_GRACE_HOURS, dry_run=False):
+    """Delete uploads that nothing references, with their variants.
+
+    Uploads modified within ``grace_hours`` are kept so a file uploaded for
+    a product that hasn't been saved yet survives. Abandoned temp files
+    past the grace period go too. Returns ``(removed_relpaths, bytes_freed)``.
+    """
+    referenced = referenced_uploads(cursor)
+    cutoff = time.time() - grace_hours * 3600
+    removed = []
+    freed = 0
+    for relpath, path in iter_uploads():
+        if relpath in referenced:
+            continue
+        stat = os.stat(path)
+        if stat.st_mtime > cutoff:
+            continue
+        removed.append(relpath)
+        freed += stat.st_size
+        if not dry_run:
+            _remove_upload(relpath)
+    if os.path.isdir(TEMP_FOLDER):
+        for entry in os.scandir(TEMP_FOLDER):
+            if entry.is_file() and entry.stat().st_mtime <= cutoff:
+                removed.append(os.path.join('tmp', entry.name))
+                freed += entry.stat().st_size
+                if not dry_run:
+                    os.remove(entry.path)
+    return removed, freed
+
+
+@lru_cache(maxsize=4096)
+def _content_etag(path, mtime_ns, size):
+    """Strong ETag from the file contents, hashed once per (path, mtime, size)"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()[:32]
+
+
+def _cache_control(response, filename):
+    if is_immutable(filename):
+        response.cache_control.public = True
+        response.cache_control.no_cache = None
+        response.cache_control.max_age = UPLOADS_MAX_AGE
+        response.cache_control.immutable = True
+    else:
+        # Legacy names may be overwritten; let the browser revalidate with the ETag
+        response.cache_control.public = True
+        response.cache_control.no_cache = True
+    return response
+
+
+def serve_upload(filename):
+    """Serve a file from the uploads folder with caching and conditional/range support.
+
+    Responses carry a content-hash ETag and Last-Modified, so revalidations
+    end in a 304; Range requests get a 206. With UPLOADS_OFFLOAD set, only
+    headers are produced here and the proxy streams the file.
+    """
+    path = safe_join(UPLOAD_FOLDER, filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+    stat = os.stat(path)
+    blob = BLOB_PATH.match(filename)
+    # A content-addressed name already is the content hash
+    etag = blob.group(3) if blob else _content_etag(path, stat.st_mtime_ns, stat.st_size)
+
+    if UPLOADS_OFFLOAD == 'x-accel-redirect':
+        # nginx handles Range itself; answer 304s here without touching the file
+        response = current_app.response_class(mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+        response.headers['X-Accel-Redirect'] = UPLOADS_ACCEL_PREFIX + quote(filename)
+        response.set_etag(etag)
+        response.last_modified = stat.st_mtime
+        response = response.make_conditional(request.environ)
+    else:
+        response = send_file(path, request.environ, etag=etag, last_modified=stat.st_mtime, conditional=True,
+                             use_x_sendfile=UPLOADS_OFFLOAD == 'x-sendfile',
+                             response_class=current_app.response_class)
+    return _cache_control(response, filename)
@@ -1,51 +1,78 @@
 from flask_socketio import SocketIO, emit, join_room, leave_room
+from engineio import packet as eio_packet
+from socketio import packet
 from flask import request
 import jwt
 import os
 from db import get_db_connection
+from auth_cache import get_principal
+from models import record_message_in_summary, mark_conversation_read
+from metrics import observe_event
+from socketio_queue import queue_options
+from presence import presence, PRESENCE_SWEEP_INTERVAL
+from event_log import event_log
 from datetime import datetime
 import json
 
+# 'threading' costs an OS thread per connection; 'eventlet' or 'gevent' serve thousands of
+# sockets per process (app.py monkey-patches the standard library for them)
+SOCKETIO_ASYNC_MODE = os.getenv('SOCKETIO_ASYNC_MODE', 'threading')
+# Per-packet Socket.IO/Engine.IO logging; turn off for large numbers of connections
+SOCKETIO_LOGGING = os.getenv('SOCKETIO_LOGGING', '1') == '1'
+
 socketio = SocketIO(
     cors_allowed_origins="*",
-    async_mode='threading',  # Use threading mode for better compatibility
-    logger=True,
-    engineio_logger=True
+    async_mode=SOCKETIO_ASYNC_MODE,
+    logger=SOCKETIO_LOGGING,
+    engineio_logger=SOCKETIO_LOGGING
 )
 
-# Store connected users
-connected_users = {}
-
 def init_socketio(app):
     """Initialize SocketIO with the Flask app"""
     socketio.init_app(
         app, 
         cors_allowed_origins="*",
-        async_mode='threading',  # Use threading mode for better compatibility
-        logger=True,
-        engineio_logger=True
+        async_mode=SOCKETIO_ASYNC_MODE,
+        logger=SOCKETIO_LOGGING,
+        engineio_logger=SOCKETIO_LOGGING,
+        # With SOCKETIO_MESSAGE_QUEUE set, emits from any process reach sockets held by the others
+        **queue_options()
     )
 
+def start_presence_sweep():
+    """Start the background task that reaps stale presence entries"""
+    socketio.start_background_task(sweep_presence)
+
+def sweep_presence():
+    """Reap sockets past the presence TTL whose disconnect was never handled"""
+    while True:
+        socketio.sleep(PRESENCE_SWEEP_INTERVAL)
+        try:
+            for sid in presence.expired():
+                if socketio.server.manager.is_connected(sid, '/'):
+                    # Idle but Engine.IO pings still reach it
+                    presence.touch(sid)
+                else:
+                    user, went_offline = presence.remove(sid)
+                    if user:
+                        print(f"Reaped stale connection {sid} of {user['username']}")
+        except Exception as e:
+            print(f"Presence sweep failed: {e}")
+
 def get_user_from_token(token):
     """Extract user information from JWT token"""
     try:
         data = jwt.decode(token, os.getenv('SECRET_KEY', 'your-secret-key-here'), algorithms=['HS256'])
         user_id = data['user_id']
         
-        # Get user details from database
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
-        cursor.execute('SELECT id, username, email, user_type, first_name, last_name, company_name FROM users WHERE id = %s', (user_id,))
-        user = cursor.fetchone()
-        cursor.close()
-        conn.close()
-        
-        return user
+        # Get user details (cached principal)
+        return get_principal(user_id)
     except Exception as e:
         print(f"Error decoding token: {e}")
         return None
 
 @socketio.on('connect')
+@observe_event('connect')
 def handle_connect(auth=None):
     """Handle client connection"""
     print(f"Client connected: {request.sid}")
@@ -60,15 +87,15 @@ def handle_connect(auth=None):
     if token:
         user = get_user_from_token(token)
         if user:
-            # Store user connection
-            connected_users[request.sid] = {
+            # Register this device in the presence registry
+            presence.add(request.sid, {
                 'user_id': user['id'],
                 'username': user['username'],
                 'user_type': user['user_type'],
                 'first_name': user['first_name'],
                 'last_name': user['last_name'],
                 'company_name': user['company_name']
-            }
+            })
             # Join user-specific room
             join_room(f"user_{user['id']}")
             # Join role-specific room
@@ -77,12 +104,15 @@ def handle_connect(auth=None):
             if user['user_type'] == 'admin':
                 join_room('admin')
             print(f"User {user['username']} connected and joined rooms")
-            # Emit connection confirmation
+            # Emit connection confirmation with the position of the user's event stream
             emit('connection_confirmed', {
                 'user_id': user['id'],
                 'username': user['username'],
-                'user_type': user['user_type']
+                'user_type': user['user_type'],
+                'epoch': event_log.epoch if event_log.enabled else None,
+                'seq': event_log.track(user['id'], user['user_type'])
             })
+            replay_missed_events(user['id'], auth)
             return
         else:
             emit('error', {'message': 'Invalid token'})
@@ -91,17 +121,39 @@ def handle_connect(auth=None):
         emit('error', {'message': 'No token provided'})
         return False
 
+def replay_missed_events(user_id, auth):
+    """Re-send the events numbered after the client's ``last_seq``, or tell it to resync.
+
+    Rooms are joined before the replay, so an event may arrive both live and
+    replayed; clients skip any ``seq`` they have already applied.
+    """
+    if not auth or auth.get('last_seq') is None:
+        return
+    try:
+        last_seq = int(auth['last_seq'])
+    except (TypeError, ValueError):
+        last_seq = -1
+    missed = event_log.since(user_id, auth.get('epoch'), last_seq)
+    if missed is None:
+        # Too far behind, another epoch or replay disabled: refetch the lists
+        emit('resync', {'epoch': event_log.epoch if event_log.enabled else None})
+        return
+    for event, data in missed:
+        emit(event, data)
+    print(f"Replayed {len(missed)} events to user {user_id}")
+
 @socketio.on('disconnect')
+@observe_event('disconnect')
 def handle_disconnect():
     """Handle client disconnection"""
     print(f"Client disconnected: {request.sid}")
     
-    if request.sid in connected_users:
-        user = connected_users[request.sid]
+    user, went_offline = presence.remove(request.sid)
+    if user:
         print(f"User {user['username']} disconnected")
-        del connected_users[request.sid]
 
 @socketio.on('join_conversation')
+@observe_event('join_conversation')
 def handle_join_conversation(data):
     """Join a specific conversation room"""
     conversation_id = data.get('conversation_id')
@@ -110,6 +162,7 @@ def handle_join_conversation(data):
         print(f"User joined conversation {conversation_id}")
 
 @socketio.on('leave_conversation')
+@observe_event('leave_conversation')
 def handle_leave_conversation(data):
     """Leave a specific conversation room"""
     conversation_id = data.get('conversation_id')
@@ -118,13 +171,14 @@ def handle_leave_conversation(data):
         print(f"User left conversation {conversation_id}")
 
 @socketio.on('send_message')
+@observe_event('send_message')
 def handle_send_message(data):
     """Handle sending a new message"""
-    if request.sid not in connected_users:
+    user = presence.touch(request.sid)
+    if user is None:
         emit('error', {'message': 'Not authenticated'})
         return
     
-    user = connected_users[request.sid]
     conversation_id = data.get('conversation_id')
     message_text = data.get('message')
     inquiry_id = data.get('inquiry_id')
@@ -138,12 +192,14 @@ def handle_send_message(data):
         conn = get_db_connection()
         cursor = conn.cursor(dictionary=True)
         
+        created_at = datetime.utcnow()
         cursor.execute('''
             INSERT INTO messages (inquiry_id, sender_id, message, is_read, created_at)
             VALUES (%s, %s, %s, %s, %s)
-        ''', (inquiry_id, user['user_id'], message_text, False, datetime.utcnow()))
+        ''', (inquiry_id, user['user_id'], message_text, False, created_at))
         
         message_id = cursor.lastrowid
+        record_message_in_summary(cursor, inquiry_id, message_id, message_text, created_at)
         
         # Get the inquiry details
         cursor.execute('''
@@ -160,11 +216,7 @@ def handle_send_message(data):
         inquiry = cursor.fetchone()
         
         # Mark messages as read for the sender
-        cursor.execute('''
-            UPDATE messages 
-            SET is_read = TRUE 
-            WHERE inquiry_id = %s AND sender_id != %s
-        ''', (inquiry_id, user['user_id']))
+        mark_conversation_read(cursor, inquiry_id, user['user_id'])
         
         conn.commit()
         cursor.close()
@@ -186,15 +238,9 @@ def handle_send_message(data):
             'producer_name': f"{inquiry['producer_first_name']} {inquiry['producer_last_name']}"
         }
         
-        # Emit to conversation room
-        socketio.emit('new_message', message_data, room=f"conversation_{inquiry_id}")
-        
-        # Emit to specific users involved in the conversation
-        socketio.emit('new_message', message_data, room=f"user_{inquiry['buyer_id']}")
-        socketio.emit('new_message', message_data, room=f"user_{inquiry['producer_id']}")
-        
-        # Emit to admin room
-        socketio.emit('new_message', message_data, room='admin')
+        # One copy per socket in the conversation, the participants' rooms and the admin room
+        fan_out('new_message', message_data, [f"conversation_{inquiry_id}", f"user_{inquiry['buyer_id']}",
+                                              f"user_{inquiry['producer_id']}", 'admin'])
         
         # Send confirmation to sender
         emit('message_sent', {
@@ -209,13 +255,14 @@ def handle_send_message(data):
         emit('error', {'message': 'Failed to send message'})
 
 @socketio.on('mark_read')
+@observe_event('mark_read')
 def handle_mark_read(data):
     """Mark messages as read"""
-    if request.sid not in connected_users:
+    user = presence.touch(request.sid)
+    if user is None:
         emit('error', {'message': 'Not authenticated'})
         return
     
-    user = connected_users[request.sid]
     inquiry_id = data.get('inquiry_id')
     
     if not inquiry_id:
@@ -227,22 +274,26 @@ def handle_mark_read(data):
         cursor = conn.cursor()
         
         # Mark all messages in this inquiry as read for this user
-        cursor.execute('''
-            UPDATE messages 
-            SET is_read = TRUE 
-            WHERE inquiry_id = %s AND sender_id != %s
-        ''', (inquiry_id, user['user_id']))
+        mark_conversation_read(cursor, inquiry_id, user['user_id'])
+        
+        participants = None
+        if event_log.enabled:
+            cursor.execute('SELECT buyer_id, producer_id FROM conversation_summaries WHERE inquiry_id = %s',
+                           (inquiry_id,))
+            participants = cursor.fetchone()
         
         conn.commit()
         cursor.close()
         conn.close()
         
-        # Emit read status to conversation room
-        socketio.emit('messages_read', {
+        read_data = {
             'inquiry_id': inquiry_id,
             'read_by': user['user_id'],
             'read_by_name': f"{user['first_name']} {user['last_name']}"
-        }, room=f"conversation_{inquiry_id}")
+        }
+        # Emit read status to the conversation room; the participants' copies are numbered
+        fan_out('messages_read', read_data,
+                [f"conversation_{inquiry_id}"] + [f"user_{participant}" for participant in participants or () if participant])
         
         print(f"Messages marked as read by {user['username']} in inquiry {inquiry_id}")
         
@@ -251,12 +302,13 @@ def handle_mark_read(data):
         emit('error', {'message': 'Failed to mark messages as read'})
 
 @socketio.on('typing')
+@observe_event('typing')
 def handle_typing(data):
     """Handle typing indicator"""
-    if request.sid not in connected_users:
+    user = presence.touch(request.sid)
+    if user is None:
         return
     
-    user = connected_users[request.sid]
     inquiry_id = data.get('inquiry_id')
     is_typing = data.get('is_typing', False)
     
@@ -273,12 +325,13 @@ def handle_typing(data):
         socketio.emit('user_typing', typing_data, room=f"conversation_{inquiry_id}", include_self=False)
 
 @socketio.on('online_status')
+@observe_event('online_status')
 def handle_online_status(data):
     """Handle online status updates"""
-    if request.sid not in connected_users:
+    user = presence.touch(request.sid)
+    if user is None:
         return
     
-    user = connected_users[request.sid]
     is_online = data.get('is_online', True)
     
     status_data = {
@@ -292,18 +345,81 @@ def handle_online_status(data):
     # Emit to role-specific rooms
     socketio.emit('user_status_change', status_data, room=f"role_{user['user_type']}")
 
-def get_online_users():
-    """Get list of currently online users"""
-    return list(connected_users.values())
+@socketio.on('heartbeat')
+@observe_event('heartbeat')
+def handle_heartbeat(data=None):
+    """Keep this socket's presence fresh; any other event does too"""
+    return {'online': presence.touch(request.sid) is not None}
+
+def _room_users(room):
+    """Users whose event stream an emit to ``room`` belongs to"""
+    if room.startswith('user_') and room[5:].isdigit():
+        return [int(room[5:])]
+    if room == 'admin':
+        return event_log.users_with_role('admin')
+    if room.startswith('role_'):
+        return event_log.users_with_role(room[5:])
+    return []
+
+def _with_seq(encoded, seq):
+    """Add ``seq`` to the payload object of an encoded ``[event, {...}]`` packet"""
+    separator = '' if encoded.endswith('{}]') else ','
+    return f'{encoded[:-2]}{separator}"seq":{seq}}}]'
+
+def fan_out(event, data, rooms):
+    """Deliver one copy of ``event`` to every socket in any of ``rooms``.
+
+    The sockets are resolved as one union, so a user in several of the
+    rooms gets it once. The packet is encoded once; a user with an event
+    stream gets that packet with their own ``seq`` added. With a message
+    queue the manager does the union and publishes one packet instead.
+    Returns the number of sockets sent to (None when queued).
+    """
+    rooms = list(dict.fromkeys(rooms))
+    if not event_log.enabled:
+        socketio.emit(event, data, to=rooms)
+        return None
+    user_ids = {}
+    for room in rooms:
+        user_ids.update(dict.fromkeys(_room_users(room)))
+    seqs = event_log.record(user_ids, event, data)
+    server = socketio.server
+    if '/' not in server.manager.rooms:
+        return 0
+    encoded = server.packet_class(packet.EVENT, namespace='/', data=[event, data]).encode()
+    if not isinstance(encoded, str):
+        # Binary attachments can't be patched in place
+        socketio.emit(event, data, to=rooms)
+        return None
+    sent = set()
+    for user_id, seq in seqs.items():
+        stamped = None
+        for sid, eio_sid in server.manager.get_participants('/', f"user_{user_id}"):
+            if sid not in sent:
+                sent.add(sid)
+                stamped = stamped or eio_packet.Packet(eio_packet.MESSAGE, _with_seq(encoded, seq))
+                server.eio.send_packet(eio_sid, stamped)
+    # Every other member of the rooms gets the plain packet: role and admin rooms only know the
+    # buffered users, and one LRU-evicted past EVENT_LOG_USERS must still receive broadcasts
+    shared = eio_packet.Packet(eio_packet.MESSAGE, encoded)
+    for sid, eio_sid in server.manager.get_participants('/', rooms):
+        if sid not in sent:
+            sent.add(sid)
+            server.eio.send_packet(eio_sid, shared)
+    return len(sent)
+
+def emit_to_room(event, data, room):
+    """Emit to one room through fan_out; the outbox dispatcher's emit"""
+    fan_out(event, data, [room])
 
 def send_notification_to_user(user_id, notification_data):
     """Send notification to specific user"""
-    socketio.emit('notification', notification_data, room=f"user_{user_id}")
+    fan_out('notification', notification_data, [f"user_{user_id}"])
 
 def send_notification_to_role(role, notification_data):
     """Send notification to all users of a specific role"""
-    socketio.emit('notification', notification_data, room=f"role_{role}")
+    fan_out('notification', notification_data, [f"role_{role}"])
 
 def send_admin_notification(notification_data):
     """Send notification to all admin users"""
-    socketio.emit('admin_notification', notification_data, room='admin') 
\ No newline at end of file
+    fan_out('admin_notification', notification_data, ['admin']) 
\ No newline at end of file